@@ -0,0 +1,120 @@
+""" Local archive of the closed lines of the spreadsheet (invoiced & paid orders, other expenses...).
+
+    The archived lines are stored in one parquet file per year, described by a manifest that also
+    stores the first line of the spreadsheet that is still open: the lines above it are never
+    downloaded again, and the archive partitions are only read when the history is needed.
+
+    Run this file to archive the lines that were closed since the last run.
+"""
+
+import json
+import os
+from typing import Dict, Iterator, List
+
+import pandas as pd
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+ARCHIVE_PATH = os.getenv('ARCHIVE_PATH', 'archive')
+MANIFEST_FILE = "manifest.json"
+# first line of the orders in the spreadsheet (the first two are titles & column names)
+FIRST_ORDER_LINE = 3
+# number of lines read at once when the partitions are streamed
+CHUNK_SIZE = 10000
+
+
+class Archive():
+    def __init__(self, path: str = ARCHIVE_PATH) -> None:
+        self.path = path
+        self._manifest = None
+        # partitions already read, by year
+        self._partitions = {}
+
+    @property
+    def manifest(self) -> Dict:
+        """The content of the manifest (read only once)"""
+        if self._manifest is None:
+            manifest_path = os.path.join(self.path, MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r", encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {"first open line": FIRST_ORDER_LINE, "partitions": {}}
+        return self._manifest
+
+    @property
+    def first_open_line(self) -> int:
+        """First line of the spreadsheet that is not archived"""
+        return self.manifest["first open line"]
+
+    def years(self) -> List[str]:
+        return sorted(self.manifest["partitions"])
+
+    def load(self, years: List[str] = None) -> pd.DataFrame:
+        """Returns the archived lines of the given years (all years by default), indexed by their line number"""
+        years = self.years() if years is None else [y for y in years if y in self.manifest["partitions"]]
+        for year in years:
+            if year not in self._partitions:
+                file_name = self.manifest["partitions"][year]["file"]
+                self._partitions[year] = pd.read_parquet(os.path.join(self.path, file_name))
+        if not years:
+            return pd.DataFrame(columns=self.manifest.get("columns", []))
+        return pd.concat([self._partitions[year] for year in years]).sort_index()
+
+    def iter_chunks(self, years: List[str] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yields the archived lines of the given years (all years by default) by chunks of chunk_size lines.
+
+            The partitions are read batch by batch and not kept in memory (unlike load).
+        """
+        years = self.years() if years is None else [y for y in years if y in self.manifest["partitions"]]
+        for year in years:
+            partition = pq.ParquetFile(os.path.join(self.path, self.manifest["partitions"][year]["file"]))
+            for batch in partition.iter_batches(batch_size=chunk_size):
+                yield batch.to_pandas()
+
+    def add(self, lines: pd.DataFrame, years: pd.Series, first_open_line: int) -> None:
+        """Adds lines to the archive.
+
+            Args:
+                lines (pd.DataFrame) : lines to archive, indexed by their line number
+                years (pd.Series) : the year (partition) of each line
+                first_open_line (int) : the first line of the spreadsheet that is not archived after this
+        """
+        os.makedirs(self.path, exist_ok=True)
+        # column names must be unique (and not empty) to be stored
+        lines = lines.loc[:, ~lines.columns.duplicated() & (lines.columns != "")]
+        lines = lines.fillna("").astype(str)
+        lines.index.name = "line"
+
+        partitions = self.manifest["partitions"]
+        for year, year_lines in lines.groupby(years.astype(str)):
+            if year in partitions:
+                year_lines = pd.concat([self.load([year]), year_lines])
+                year_lines = year_lines[~year_lines.index.duplicated(keep="last")].sort_index()
+            file_name = f"orders-{year}.parquet"
+            year_lines.to_parquet(os.path.join(self.path, file_name))
+            self._partitions[year] = year_lines
+            partitions[year] = {"file": file_name, "lines": len(year_lines),
+                                "first line": int(year_lines.index.min()), "last line": int(year_lines.index.max())}
+
+        self.manifest["first open line"] = int(first_open_line)
+        self.manifest["columns"] = lines.columns.tolist()
+        self.write_manifest()
+
+    def write_manifest(self) -> None:
+        """Writes the manifest (atomically, so that it always describes complete partitions)"""
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        with open(manifest_path + ".tmp", "w", encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+
+if __name__ == '__main__':
+    from retrieve import Retriever
+
+    retriever = Retriever()
+    nb_archived = retriever.archive_closed_orders()
+    print(f"{nb_archived} ligne(s) archivée(s), les lignes sont maintenant lues à partir de la ligne {retriever.archive.first_open_line}.")
@@ -0,0 +1,85 @@
+""" Images embedded in the receipts, optimized once for their printed size.
+
+    The logo is printed 3 cm wide: there is no need to embed a larger image in every receipt.
+    It is resized to the printing resolution and recompressed, and the result is cached on disk
+    (by hash of the original image), so that it is only computed again when the logo changes.
+"""
+
+import hashlib
+import io
+import os
+from functools import lru_cache
+from typing import Optional
+
+from dotenv import load_dotenv
+from PIL import Image
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+LOGO_PATH = "logo.png"
+# printed width of the logo
+LOGO_WIDTH_CM = 3
+PRINT_DPI = 300
+ASSETS_CACHE_PATH = os.getenv('ASSETS_CACHE_PATH', '.assets_cache')
+# above this size, a receipt is reported as too large
+RECEIPT_SIZE_BUDGET_KB = int(os.getenv('RECEIPT_SIZE_BUDGET_KB', 200))
+
+
+def optimize_image(source: bytes, width_cm: float = LOGO_WIDTH_CM, dpi: int = PRINT_DPI) -> bytes:
+    """Returns the image resized to its printed width (at the given resolution) and recompressed"""
+    image = Image.open(io.BytesIO(source))
+    image.load()
+    width_px = round(width_cm / 2.54 * dpi)
+    if image.width > width_px:
+        height_px = max(1, round(image.height * width_px / image.width))
+        image = image.resize((width_px, height_px), Image.LANCZOS)
+
+    candidates = []
+    png = io.BytesIO()
+    image.save(png, format="PNG", optimize=True, dpi=(dpi, dpi))
+    candidates.append(png.getvalue())
+    # images without transparency may be smaller as jpeg
+    if image.mode in ("RGB", "L"):
+        jpeg = io.BytesIO()
+        image.save(jpeg, format="JPEG", quality=90, optimize=True, dpi=(dpi, dpi))
+        candidates.append(jpeg.getvalue())
+    # never make it bigger than the original
+    candidates.append(source)
+    return min(candidates, key=len)
+
+
+@lru_cache(maxsize=None)
+def get_optimized_image(path: str = LOGO_PATH, width_cm: float = LOGO_WIDTH_CM, dpi: int = PRINT_DPI,
+                        cache_path: str = ASSETS_CACHE_PATH) -> bytes:
+    """Returns the optimized bytes of an image (computed once per run, and cached on disk)"""
+    with open(path, "rb") as f:
+        source = f.read()
+    key = hashlib.sha256(source + f"{width_cm}-{dpi}".encode()).hexdigest()[:16]
+    cached_path = os.path.join(cache_path, f"{os.path.splitext(os.path.basename(path))[0]}-{key}")
+    if os.path.exists(cached_path):
+        with open(cached_path, "rb") as f:
+            return f.read()
+
+    optimized = optimize_image(source, width_cm, dpi)
+    os.makedirs(cache_path, exist_ok=True)
+    with open(cached_path + ".tmp", "wb") as f:
+        f.write(optimized)
+    os.replace(cached_path + ".tmp", cached_path)
+    return optimized
+
+
+def get_logo() -> io.BytesIO:
+    """Returns the optimized logo, ready to be added to a document"""
+    return io.BytesIO(get_optimized_image(LOGO_PATH))
+
+
+def check_receipt_size(path: str, budget_kb: int = RECEIPT_SIZE_BUDGET_KB, size: int = None) -> Optional[str]:
+    """Returns a warning message if the receipt file is larger than the budget, None otherwise
+
+        The size (in bytes) can be given for a receipt that is not written yet.
+    """
+    size_kb = (os.path.getsize(path) if size is None else size) / 1024
+    if size_kb > budget_kb:
+        return f"Attention : {os.path.basename(path)} fait {size_kb:.0f} ko (budget : {budget_kb} ko)."
+    return None
@@ -0,0 +1,106 @@
+"""  Asynchronous version of the Retriever: the spreadsheet ranges are read concurrently
+    (through the Sheets REST API), the filtering methods are the same.
+
+    The coroutines have their own names (`..._async`): the synchronous API of the Retriever is kept,
+    so that an AsyncRetriever can be used by the Watcher or the InvoiceService once created.
+"""
+
+import asyncio
+from typing import Dict, List
+from urllib.parse import quote
+
+import aiohttp
+import pandas as pd
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+
+from archive import Archive
+from retrieve import (ALL_RANGE, ASSO_DETAILS_PATH, HEADER_RANGE, SCOPES,
+                      SPREADSHEET_ID, Retriever, build_orders_frame,
+                      connect_to_spreadsheet, get_open_range)
+
+SHEETS_API_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+# maximum number of requests sent to the API at the same time
+MAX_CONCURRENT_REQUESTS = 4
+
+
+class AsyncRetriever(Retriever):
+    def __init__(self, creds=None, base_url: str = SHEETS_API_URL, spreadsheet_id: str = SPREADSHEET_ID,
+                 max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS, archive: Archive = None,
+                 asso_details_path: str = ASSO_DETAILS_PATH) -> None:
+        """Does not fetch anything, use `await AsyncRetriever.create()` to get a retriever with its data loaded.
+
+            Args:
+                creds : google credentials (no authentication if None)
+                base_url (str) : url of the Sheets API
+                spreadsheet_id (str) : id of the accounting spreadsheet
+                max_concurrent_requests (int) : maximum number of requests sent at the same time
+                archive (Archive) : archive of the closed lines (not fetched)
+                asso_details_path (str) : path of the json file containing the assos details
+        """
+        self.archive = archive if archive is not None else Archive()
+        self.asso_details_path = asso_details_path
+        self.source = None
+        self.creds = creds
+        self.base_url = base_url
+        self.spreadsheet_id = spreadsheet_id
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.spreadsheet = None
+
+    @classmethod
+    async def create(cls, creds=None, **kwargs) -> "AsyncRetriever":
+        """Returns a retriever with the orders and associations data loaded.
+
+            The credentials are those of the Retriever (token.json) if none are given.
+        """
+        if creds is None:
+            creds = await asyncio.to_thread(connect_to_spreadsheet, SCOPES)
+        retriever = cls(creds, **kwargs)
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(retriever.fetch_orders_data_async(session),
+                                 retriever.fetch_asso_details_async(),
+                                 retriever.build_spreadsheet())
+        return retriever
+
+    async def get_headers(self) -> Dict[str, str]:
+        """Returns the authorization headers, refreshing the access token if needed"""
+        if self.creds is None:
+            return {}
+        if not self.creds.valid:
+            await asyncio.to_thread(self.creds.refresh, Request())
+        return {"Authorization": f"Bearer {self.creds.token}"}
+
+    async def fetch_range(self, session: aiohttp.ClientSession, data_range: str) -> List[List[str]]:
+        """Returns the values of a range of the spreadsheet (ex: 'A:S' or 'Paiements!A:F')"""
+        url = f"{self.base_url}/{self.spreadsheet_id}/values/{quote(data_range)}"
+        headers = await self.get_headers()
+        async with self.semaphore:
+            async with session.get(url, headers=headers) as response:
+                response.raise_for_status()
+                data = await response.json()
+        return data.get('values', [])
+
+    async def fetch_ranges(self, session: aiohttp.ClientSession, *data_ranges: str) -> List[List[List[str]]]:
+        """Returns the values of several ranges (in the same order), read concurrently"""
+        return await asyncio.gather(*(self.fetch_range(session, data_range) for data_range in data_ranges))
+
+    async def fetch_orders_data_async(self, session: aiohttp.ClientSession) -> pd.DataFrame:
+        """Returns all the orders data as a panda Dataframe"""
+        first_line = self.archive.first_open_line
+        if first_line <= 3:
+            data = await self.fetch_range(session, ALL_RANGE)
+            self.orders = build_orders_frame(data[1], data[2:])
+        else:
+            # the lines above first_line are archived: only fetch the columns names & the open lines
+            header, lines = await self.fetch_ranges(session, HEADER_RANGE, get_open_range(first_line))
+            self.orders = build_orders_frame(header[0], lines, first_line)
+        return self.orders
+
+    async def fetch_asso_details_async(self) -> pd.DataFrame:
+        return await asyncio.to_thread(self.fetch_asso_details)
+
+    async def build_spreadsheet(self) -> None:
+        """Builds the googleapiclient spreadsheet object, used to write in the spreadsheet"""
+        if self.creds is not None:
+            service = await asyncio.to_thread(build, 'sheets', 'v4', credentials=self.creds)
+            self.spreadsheet = service.spreadsheets()
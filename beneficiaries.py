@@ -0,0 +1,79 @@
+""" Matching of the beneficiaries names written in the spreadsheet with the known associations.
+
+    Names are normalized (case, accents, spaces) before being compared, and the names that still
+    do not match are compared to the known ones through an index of their n-grams: only the known
+    names sharing n-grams with a name are scored, instead of every known name.
+"""
+
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+NGRAM_SIZE = 3
+# minimum similarity to merge automatically an unknown name with a known one
+AUTO_MERGE_SCORE = 0.8
+
+
+def normalize_name(name: str) -> str:
+    """Returns the name without accents, case-folded and with single spaces (ex: ' Bureau  des Élèves' -> 'bureau des eleves')"""
+    decomposed = unicodedata.normalize("NFKD", str(name))
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(without_accents.casefold().split())
+
+
+def get_ngrams(name: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """Returns the n-grams of a normalized name (padded so that short names have n-grams too)"""
+    padded = f" {name} "
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+class BeneficiaryIndex():
+    def __init__(self, names: Iterable[str], n: int = NGRAM_SIZE) -> None:
+        """
+            Args:
+                names (Iterable[str]) : the known names (ex: the keys of associations_addresses.json)
+                n (int) : size of the n-grams
+        """
+        self.n = n
+        # normalized name -> known name
+        self.names = {normalize_name(name): name for name in names}
+        # n-gram -> normalized names containing it
+        self.ngrams_index = defaultdict(set)
+        self.nb_ngrams = {}
+        for normalized in self.names:
+            ngrams = get_ngrams(normalized, n)
+            self.nb_ngrams[normalized] = len(ngrams)
+            for ngram in ngrams:
+                self.ngrams_index[ngram].add(normalized)
+
+    def match(self, name: str) -> Optional[str]:
+        """Returns the known name equal to the given one once normalized, or None"""
+        return self.names.get(normalize_name(name))
+
+    def suggest(self, name: str, limit: int = 1) -> List[Tuple[str, float]]:
+        """Returns the closest known names with their similarity score (between 0 and 1, best first)"""
+        ngrams = get_ngrams(normalize_name(name), self.n)
+        shared = Counter()
+        for ngram in ngrams:
+            shared.update(self.ngrams_index.get(ngram, ()))
+        # Dice coefficient of the n-grams sets
+        scores = [(self.names[normalized], 2 * count / (len(ngrams) + self.nb_ngrams[normalized]))
+                  for normalized, count in shared.items()]
+        return sorted(scores, key=lambda s: (-s[1], s[0]))[:limit]
+
+    def resolve(self, name: str, auto_merge: bool = False, min_score: float = AUTO_MERGE_SCORE) -> Optional[str]:
+        """Returns the known name corresponding to the given one, or None.
+
+            Args:
+                auto_merge (bool) : also accept the closest known name if its score is at least min_score
+        """
+        known_name = self.match(name)
+        if known_name is None and auto_merge:
+            suggestions = self.suggest(name)
+            if suggestions and suggestions[0][1] >= min_score:
+                known_name = suggestions[0][0]
+        return known_name
+
+    def resolve_all(self, names: Iterable[str], auto_merge: bool = False, min_score: float = AUTO_MERGE_SCORE) -> Dict[str, Optional[str]]:
+        """Returns the known name corresponding to each distinct given name (or None)"""
+        return {name: self.resolve(name, auto_merge, min_score) for name in set(names)}
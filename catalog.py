@@ -0,0 +1,194 @@
+""" SQLite catalog of the generated receipts, to find them without walking the receipts directories.
+
+    Usage:
+        python catalog.py backfill [--with-sheet]     # adds the receipts already in RECEIPTS_PATH
+        python catalog.py query -r bde -y 2022        # lists the receipts of bde in 2022
+"""
+
+import argparse
+import datetime as dt
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import pricing
+import receipt_utils as ru
+from beneficiaries import normalize_name
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+CATALOG_PATH = os.getenv('CATALOG_PATH', 'receipts_catalog.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    number TEXT PRIMARY KEY,
+    month TEXT NOT NULL,
+    recipient TEXT,
+    recipient_key TEXT,
+    amount_cents INTEGER,
+    sheet_line INTEGER,
+    path TEXT NOT NULL,
+    size INTEGER,
+    sha256 TEXT,
+    created_at TEXT,
+    sent_at TEXT,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS receipts_recipient ON receipts (recipient_key);
+CREATE INDEX IF NOT EXISTS receipts_month ON receipts (month);
+CREATE INDEX IF NOT EXISTS receipts_status ON receipts (status);
+"""
+
+RECEIPT_FILE_PATTERN = re.compile(r"^(\d{4}-\d{2})-\d{4}\.pdf$")
+
+
+def hash_file(path: str) -> str:
+    """Returns the sha256 of a file content"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ReceiptCatalog():
+    def __init__(self, path: str = CATALOG_PATH) -> None:
+        # the catalog can be shared by the workers of the backfill (the writes are serialized by the lock)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.connection.executescript(SCHEMA)
+
+    def add(self, number: str, path: str, recipient: str = None, amount_cents: int = None,
+            sheet_line: int = None, status: str = "created", created_at: str = None, data: bytes = None) -> None:
+        """Adds (or updates) a receipt in the catalog
+
+            Args:
+                number (str) : the receipt number (ex: 2022-03-0001)
+                path (str) : path of the pdf receipt
+                recipient (str) : name of the recipient
+                amount_cents (int) : total price of the receipt (in cents)
+                sheet_line (int) : line of the order in the spreadsheet
+                status (str) : 'created', 'queued' (in the outbox) or 'sent'
+                data (bytes) : content of the pdf, for a receipt that is not written yet
+        """
+        size, sha256 = None, None
+        if data is not None:
+            size, sha256 = len(data), hashlib.sha256(data).hexdigest()
+        elif os.path.exists(path):
+            size, sha256 = os.path.getsize(path), hash_file(path)
+        created_at = created_at or dt.datetime.now().isoformat(timespec="seconds")
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO receipts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)",
+                (number, number[:7], recipient, normalize_name(recipient) if recipient else None, amount_cents,
+                 sheet_line, path, size, sha256, created_at, status))
+
+    def mark_sent(self, numbers: Iterable[str], status: str = "sent", sent_at: str = None) -> None:
+        """Records that the given receipts were sent (now by default), or queued in the outbox (not sent yet)"""
+        if status == "sent":
+            sent_at = sent_at or dt.datetime.now().isoformat(timespec="seconds")
+        else:
+            sent_at = None
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE receipts SET status = ?, sent_at = ? WHERE number = ?",
+                                        ((status, sent_at, number) for number in numbers))
+
+    def backfill(self, receipts_path: str = ru.RECEIPTS_PATH, orders: pd.DataFrame = None) -> int:
+        """Adds the receipts of the receipts directory that are not in the catalog yet.
+
+            Args:
+                receipts_path (str) : the directory containing one directory of receipts per month
+                orders (pd.DataFrame) : the orders of the spreadsheet, used to find the recipient,
+                    amount and line of each receipt (optional)
+
+            Returns the number of receipts added.
+        """
+        known = {row["number"] for row in self.connection.execute("SELECT number FROM receipts")}
+        orders_by_number = {}
+        if orders is not None:
+            with_receipt = orders[orders["№ facture"].notnull() & orders["№ facture"].ne("")]
+            for line, order in zip(with_receipt.index, with_receipt.to_dict(orient="records")):
+                orders_by_number[order["№ facture"]] = (line, order)
+
+        nb_added = 0
+        for entry in os.scandir(receipts_path):
+            if not entry.is_dir():
+                continue
+            for receipt in os.scandir(entry.path):
+                match = RECEIPT_FILE_PATTERN.match(receipt.name)
+                number = receipt.name[:-len(".pdf")]
+                if match is None or number in known:
+                    continue
+                line, order = orders_by_number.get(number, (None, {}))
+                amount = pricing.parse_price(order["Prix total"]) if "Prix total" in order else None
+                created_at = dt.datetime.fromtimestamp(receipt.stat().st_mtime).isoformat(timespec="seconds")
+                # receipts already in the directory were sent when they were created
+                self.add(number, receipt.path, order.get("Bénéficiaire"),
+                         amount, line, status="sent", created_at=created_at)
+                nb_added += 1
+        return nb_added
+
+    def query(self, recipient: str = None, year: str = None, month: str = None, status: str = None) -> List[sqlite3.Row]:
+        """Returns the receipts matching all the given criteria (ordered by number)"""
+        conditions, params = [], []
+        if recipient is not None:
+            # (same normalization as the grouping of the orders: case, accents, spaces)
+            conditions.append("recipient_key = ?")
+            params.append(normalize_name(recipient))
+        if year is not None:
+            # a range (and not LIKE) so that the month index is used
+            conditions.append("month >= ? AND month < ?")
+            params += [f"{year}-01", f"{int(year) + 1}-01"]
+        if month is not None:
+            conditions.append("month = ?")
+            params.append(month)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.connection.execute(f"SELECT * FROM receipts{where} ORDER BY number", params).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Adds the receipts of RECEIPTS_PATH to the catalog.")
+    backfill_parser.add_argument("--with-sheet", help="Reads the spreadsheet to find the recipients and amounts.",
+                                 action='store_true')
+    query_parser = subparsers.add_parser("query", help="Lists the receipts matching the criteria.")
+    query_parser.add_argument("-r", "--recipient", help="Name of the recipient.", type=str)
+    query_parser.add_argument("-y", "--year", help="Year of the receipts (ex: 2022).", type=str)
+    query_parser.add_argument("-m", "--month", help="Month of the receipts (ex: 2022-03).", type=str)
+    query_parser.add_argument("-s", "--status", help="Status of the receipts (created, queued or sent).", type=str)
+    args = parser.parse_args()
+
+    catalog = ReceiptCatalog()
+    if args.command == "backfill":
+        orders = None
+        if args.with_sheet:
+            from retrieve import Retriever
+            orders = Retriever().get_history()
+        print(f"{catalog.backfill(orders=orders)} facture(s) ajoutée(s) au catalogue.")
+
+    else:
+        start = time.perf_counter()
+        receipts = catalog.query(args.recipient, args.year, args.month, args.status)
+        duration = (time.perf_counter() - start) * 1000
+        for r in receipts:
+            amount = f"{r['amount_cents'] / 100:.2f}€" if r['amount_cents'] is not None else "?"
+            print(f"{r['number']}  {r['recipient'] or '?':<25} {amount:>10}  {r['status']:<8} {r['path']}")
+        print(f"\n{len(receipts)} facture(s) trouvée(s) en {duration:.1f} ms.")
+    catalog.close()
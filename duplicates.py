@@ -0,0 +1,75 @@
+""" Detection of the orders entered twice in the spreadsheet, before they are invoiced.
+
+    Each order gets a fingerprint (hash of its beneficiary, date, quantities and total, once normalized),
+    computed for all the lines at once. The fingerprints of the orders invoiced recently and of the
+    orders of the batch are stored in a hash table: an order is a likely duplicate if its fingerprint
+    is already there (one lookup per order, even with years of history).
+"""
+
+from typing import List
+
+import pandas as pd
+
+import pricing
+import receipt_utils as ru
+from beneficiaries import normalize_name
+from retrieve import Retriever
+
+# the invoiced orders of this year and of the previous ones are compared to the new ones
+HISTORY_YEARS = 1
+
+
+def get_fingerprints(orders: pd.DataFrame) -> pd.Series:
+    """Returns the fingerprint of each order (same beneficiary, date, quantities & total -> same fingerprint)"""
+    dates = orders["Date"].fillna("").astype(str).str.strip()
+    # '5/1/2022' and '05/01/2022' are the same date (the invalid dates are compared as written)
+    parsed_dates = dates.map(ru.parse_order_date)
+    parts = {"beneficiary": orders["Bénéficiaire"].fillna("").map(normalize_name),
+             "date": parsed_dates.map(str).where(parsed_dates.notnull(), dates)}
+    for col in pricing.SERVICE_COLUMNS:
+        # '', '0' and '00' are the same quantity
+        parts[col] = orders[col].fillna("").astype(str).str.strip().str.lstrip("0")
+    parts["total"] = orders["Prix total"].map(pricing.parse_price).astype(str)
+    return pd.util.hash_pandas_object(pd.DataFrame(parts, index=orders.index), index=False)
+
+
+def get_recent_invoiced_orders(retriever: Retriever, nb_years: int = HISTORY_YEARS) -> pd.DataFrame:
+    """Returns the orders with a receipt of this year and of the nb_years previous ones (fetched or archived)"""
+    this_year = pd.Timestamp.today().year
+    years = [str(year) for year in range(this_year - nb_years, this_year + 1)]
+    if retriever.source is not None:
+        # the loaded orders may only be the unprocessed ones: the invoiced ones are read from the source
+        archived, invoiced = retriever.archive.load(years), retriever.source.fetch_invoiced_orders()
+        history = invoiced if archived.empty else pd.concat([archived, invoiced])
+    else:
+        history = retriever.get_history(years)
+    return history[history["№ facture"].notnull() & history["№ facture"].ne("")]
+
+
+def find_duplicates(orders: pd.DataFrame, invoiced_orders: pd.DataFrame = None) -> pd.DataFrame:
+    """Returns the orders that are likely duplicates, with the order they duplicate ('duplicate of').
+
+        The first of several identical orders of the batch is not a duplicate (it can be invoiced),
+        the orders identical to an invoiced one are all duplicates.
+
+        Args:
+            orders (pd.DataFrame) : the orders to invoice
+            invoiced_orders (pd.DataFrame) : the orders already invoiced
+    """
+    index = {}
+    if invoiced_orders is not None and not invoiced_orders.empty:
+        index = dict(zip(get_fingerprints(invoiced_orders), "facture " + invoiced_orders["№ facture"]))
+
+    duplicates_lines: List[int] = []
+    duplicate_of: List[str] = []
+    for line, fingerprint in get_fingerprints(orders).items():
+        original = index.get(fingerprint)
+        if original is None:
+            index[fingerprint] = f"ligne {line}"
+        else:
+            duplicates_lines.append(line)
+            duplicate_of.append(original)
+
+    duplicates = orders.loc[duplicates_lines].copy()
+    duplicates["duplicate of"] = duplicate_of
+    return duplicates
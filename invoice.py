@@ -0,0 +1,86 @@
+""" Thin client of the invoicing service (invoice_service.py): invoices one order or one recipient right away.
+
+    Only the standard library is imported, the receipt is created by the already running service.
+
+    Usage:
+        python invoice.py -l 42             # the order of the line 42 of the spreadsheet
+        python invoice.py -r "Jean Dupont"  # all the processable orders of this recipient
+    python invoice.py -l 42 --include-duplicates   # even if it looks like a duplicate
+        python invoice.py --status
+"""
+
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from typing import Dict, Tuple
+
+from dotenv import load_dotenv
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+INVOICE_SERVICE_PORT = int(os.getenv('INVOICE_SERVICE_PORT', 8765))
+# shared with the service (same header as invoice_service.TOKEN_HEADER)
+INVOICE_SERVICE_TOKEN = os.getenv('INVOICE_SERVICE_TOKEN', "")
+TOKEN_HEADER = "X-Invoice-Token"
+# creating the receipts of a recipient with many orders can take a while
+REQUEST_TIMEOUT = 120
+
+
+def call_service(path: str, data: Dict = None, port: int = INVOICE_SERVICE_PORT, token: str = None,
+                 timeout: float = REQUEST_TIMEOUT) -> Tuple[int, Dict]:
+    """Sends a request to the service (POST if there is data), returns the status code & the json answer"""
+    body = None if data is None else json.dumps(data).encode("utf-8")
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=body,
+                                     headers={"Content-Type": "application/json",
+                                              TOKEN_HEADER: token or INVOICE_SERVICE_TOKEN})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, json.load(e)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-l", "--line", help="Invoice the order of this line of the spreadsheet.", type=int)
+    group.add_argument("-r", "--recipient", help="Invoice all the processable orders of this recipient.",
+                       type=str, nargs="+")  # at least one word
+    group.add_argument("--status", help="Show the state of the service.", action='store_true')
+    parser.add_argument("-p", "--port", help="Port of the service (on localhost).", type=int, default=INVOICE_SERVICE_PORT)
+    parser.add_argument("--include-duplicates", help="Also invoice the orders that look like duplicates.",
+                        action='store_true')  # no arguments
+    args = parser.parse_args()
+
+    if args.status:
+        path, data = "/status", None
+    elif args.line is not None:
+        path, data = "/invoice/line", {"line": args.line, "include_duplicates": args.include_duplicates}
+    else:
+        path, data = "/invoice/recipient", {"name": " ".join(args.recipient), "include_duplicates": args.include_duplicates}
+
+    try:
+        status, answer = call_service(path, data, args.port)
+    except urllib.error.URLError:
+        print(f"Le service de facturation ne répond pas (port {args.port}) : lancez `python invoice_service.py`.")
+        sys.exit(2)
+
+    if status != 200:
+        print(f"Erreur : {answer['error']}")
+        for issue in answer.get("issues", []):
+            print(f" - {issue}")
+        for line, receipt_nb in answer.get("receipts", {}).items():
+            print(f"Facture {receipt_nb} créée (ligne {line}).")
+        sys.exit(1)
+    if args.status:
+        for name, value in answer.items():
+            print(f"{name} : {value}")
+    else:
+        for line, receipt_nb in answer["receipts"].items():
+            print(f"Facture {receipt_nb} créée (ligne {line}).")
@@ -0,0 +1,253 @@
+""" Local invoicing service: keeps everything warm to create one urgent receipt in under a second.
+
+    A cold run pays the imports, the OAuth & Sheets service discovery, a full download of the sheet,
+    the launch of Word and the SMTP login for a single pdf. This service pays them once, at startup,
+    and keeps the credentials, Sheets client, orders snapshot, receipt template, Word application and
+    SMTP connection between requests. The snapshot is only downloaded again when the sheet changed
+    (cheap signature) or got old, and is updated locally with the receipt numbers it writes.
+
+    It listens on localhost only, and handles the requests one at a time (Word, the SMTP connection
+    and the receipt numbering are not shared between concurrent requests). The requests must carry
+    the token of the .env (INVOICE_SERVICE_TOKEN) in the X-Invoice-Token header, and the POST ones
+    must be json: a web page opened in the browser can not send them (no CORS preflight is answered).
+        GET  /status                              number of orders, age of the snapshot
+        POST /invoice/line       {"line": 42}     invoices the order of this sheet line
+        POST /invoice/recipient  {"name": "bde"}  invoices all the processable orders of this recipient
+    The likely duplicates are refused, unless the request has "include_duplicates": true.
+
+    invoice.py is the thin client (no pandas, Google or Word import).
+
+    Usage:
+        python invoice_service.py              # then: python invoice.py -l 42 / python invoice.py -r bde
+        python invoice_service.py --outbox     # the emails are written to the outbox
+"""
+
+import argparse
+import hmac
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import preflight
+import process_all_orders as pao
+import receipt_creation as rc
+from duplicates import find_duplicates, get_recent_invoiced_orders
+from outbox import Outbox
+from retrieve import Retriever
+from watch import Watcher
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+INVOICE_SERVICE_PORT = int(os.getenv('INVOICE_SERVICE_PORT', 8765))
+# shared with invoice.py, sent in the TOKEN_HEADER header of each request
+INVOICE_SERVICE_TOKEN = os.getenv('INVOICE_SERVICE_TOKEN')
+TOKEN_HEADER = "X-Invoice-Token"
+# the snapshot is downloaded again after this time (in seconds), even if the last lines did not change
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 10 * 60))
+
+
+class InvoiceError(Exception):
+    """A request that can not be served (unknown line, order already invoiced, preflight issues...)"""
+
+    def __init__(self, message: str, issues: List[str] = None, receipts: Dict[int, str] = None) -> None:
+        super().__init__(message)
+        self.issues = issues or []
+        # the receipts created (and sent) anyway
+        self.receipts = receipts or {}
+
+
+class ReceiptFilesError(InvoiceError):
+    """The receipts were created & sent, but their files could not be written"""
+
+
+class InvoiceService(Watcher):
+    def __init__(self, retriever: Retriever = None, outbox: Outbox = None, max_age: float = SNAPSHOT_MAX_AGE) -> None:
+        """Service invoicing single orders or recipients (shares the warm resources of the watcher).
+
+            Args:
+                retriever (Retriever) : the retriever to use (connects to the spreadsheet by default)
+                outbox (Outbox) : if given, the emails are written to this outbox instead of being sent
+                max_age (float) : age (in seconds) after which the snapshot is downloaded again
+        """
+        super().__init__(retriever, max_age)
+        self.outbox = outbox
+        self.signature = self.retriever.fetch_sheet_signature() if self.retriever.source is None else None
+
+    def warm_up(self) -> None:
+        """Builds the receipt template, and launches Word & logs in to the SMTP server before the first request"""
+        rc.get_receipt_template()
+        self.get_word()
+        if self.outbox is None:
+            self.get_smtp()
+
+    def get_status(self) -> Dict:
+        return {"orders": len(self.retriever.orders),
+                "unprocessed orders": len(self.retriever.get_unprocessed_orders()),
+                "snapshot age (s)": round(time.monotonic() - self.fetched_at)}
+
+    def invoice_line(self, line: int, include_duplicates: bool = False) -> Dict[int, str]:
+        """Invoices the order of the given sheet line, returns its receipt number (by line)"""
+        self.refresh()
+        if line not in self.retriever.orders.index:
+            raise InvoiceError(f"la ligne {line} n'est pas une commande du tableur.")
+        orders = self.get_processable_orders(self.retriever.orders.loc[[line]])
+        if orders.empty:
+            raise InvoiceError(f"la ligne {line} ne peut pas être facturée (déjà facturée ou payée, "
+                               f"association inconnue ou email invalide).")
+        return self.invoice_orders(orders, include_duplicates)
+
+    def invoice_recipient(self, name: str, include_duplicates: bool = False) -> Dict[int, str]:
+        """Invoices all the processable orders of the given recipient, returns their receipt numbers (by line)"""
+        self.refresh()
+        orders = self.get_processable_orders(self.retriever.filter_by_recipient_name(self.retriever.orders, name.strip()))
+        if orders.empty:
+            raise InvoiceError(f"aucune commande de '{name}' ne peut être facturée.")
+        return self.invoice_orders(orders, include_duplicates)
+
+    def get_processable_orders(self, orders: pd.DataFrame) -> pd.DataFrame:
+        return pd.concat(pao.get_processable_orders(self.retriever, orders))
+
+    def invoice_orders(self, orders: pd.DataFrame, include_duplicates: bool = False) -> Dict[int, str]:
+        """Checks, creates & sends the receipts of the orders (one email per recipient).
+
+            The receipt number & payment of the orders are read again first: they may have been written
+            by another run in the middle of the sheet, which the signature does not cover. The likely
+            duplicates are refused (unless include_duplicates). The receipt numbers are written in one
+            request, and in the snapshot.
+        """
+        lines = orders.index.to_list()
+        self.retriever.fetch_lines_status(lines)
+        orders = self.retriever.get_unprocessed_orders(self.retriever.orders.loc[lines])
+        if orders.empty:
+            raise InvoiceError("la commande a déjà été facturée ou payée entre temps.")
+
+        issues = preflight.run_preflight(self.retriever, orders, outbox=self.outbox is not None)
+        if issues:
+            raise InvoiceError("la commande ne peut pas être facturée.", issues)
+        if not include_duplicates:
+            duplicates = find_duplicates(orders, get_recent_invoiced_orders(self.retriever))
+            if not duplicates.empty:
+                raise InvoiceError("doublon(s) probable(s), à confirmer avec --include-duplicates.",
+                                   [f"ligne {line} : identique à la {duplicate['duplicate of']}."
+                                    for line, duplicate in duplicates.iterrows()])
+
+        written_receipts = {}
+        sheet_receipt_names = self.retriever.get_receipt_numbers()
+        try:
+            for recip_name, recip_orders in self.retriever.group_by_recipient(orders):
+                pao.process_recipient_orders(self.retriever, recip_name, recip_orders, sheet_receipt_names,
+                                             None if self.outbox is not None else self.get_smtp(), self.get_word(),
+                                             outbox=self.outbox, catalog=self.catalog, written_receipts=written_receipts,
+                                             writer=self.writer)
+        finally:
+            # (also the receipts created before an error)
+            self.retriever.write_receipt_numbers(written_receipts)
+            if self.retriever.source is None:
+                for line, receipt_nb in written_receipts.items():
+                    self.retriever.orders.loc[line, "№ facture"] = receipt_nb
+        # the request is only answered once the receipts files are written
+        errors = self.flush_writer()
+        if errors:
+            raise ReceiptFilesError("les fichiers des factures n'ont pas pu être écrits.", errors, written_receipts)
+        return written_receipts
+
+
+class InvoiceRequestHandler(BaseHTTPRequestHandler):
+    """Serves the requests of invoice.py (the service & token are the server's 'service' & 'token' attributes)"""
+
+    def is_authorized(self) -> bool:
+        """Checks the token of the request, answers 403 if it is wrong"""
+        token = self.headers.get(TOKEN_HEADER, "")
+        if hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8")):
+            return True
+        self.send_json(403, {"error": "invalid token"})
+        return False
+
+    def do_GET(self) -> None:
+        if not self.is_authorized():
+            return
+        if self.path != "/status":
+            return self.send_json(404, {"error": f"unknown path '{self.path}'"})
+        self.send_json(200, self.server.service.get_status())
+
+    def do_POST(self) -> None:
+        # (a cross-origin 'simple' request can not have this content type)
+        if self.headers.get_content_type() != "application/json":
+            return self.send_json(415, {"error": "the requests must be sent as application/json"})
+        if not self.is_authorized():
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            include_duplicates = bool(body.get("include_duplicates", False))
+            if self.path == "/invoice/line":
+                receipts = self.server.service.invoice_line(int(body["line"]), include_duplicates)
+            elif self.path == "/invoice/recipient":
+                receipts = self.server.service.invoice_recipient(str(body["name"]), include_duplicates)
+            else:
+                return self.send_json(404, {"error": f"unknown path '{self.path}'"})
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send_json(400, {"error": f"invalid request ({e})"})
+        except InvoiceError as e:
+            return self.send_json(500 if isinstance(e, ReceiptFilesError) else 409,
+                                  {"error": str(e), "issues": e.issues, "receipts": {str(line): receipt_nb for line, receipt_nb in e.receipts.items()}})
+        except Exception as e:
+            return self.send_json(500, {"error": str(e)})
+        self.send_json(200, {"receipts": {str(line): receipt_nb for line, receipt_nb in receipts.items()}})
+
+    def send_json(self, status: int, data: Dict) -> None:
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args) -> None:
+        print(f"{self.log_date_time_string()} {format % args}")
+
+
+def create_server(service: InvoiceService, port: int = INVOICE_SERVICE_PORT, token: str = None) -> HTTPServer:
+    """Returns the HTTP server of the service, listening on localhost (port 0: any free port).
+
+        The requests must carry the given token (INVOICE_SERVICE_TOKEN by default).
+    """
+    token = token or INVOICE_SERVICE_TOKEN
+    if not token:
+        raise ValueError("INVOICE_SERVICE_TOKEN is not defined (.env)")
+    server = HTTPServer(("127.0.0.1", port), InvoiceRequestHandler)
+    server.service = service
+    server.token = token
+    return server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--outbox", help="Write the emails to the outbox instead of sending them (outbox.py sends them).",
+                        action='store_true')  # no arguments
+    parser.add_argument("-p", "--port", help="Port of the service (on localhost).", type=int, default=INVOICE_SERVICE_PORT)
+    args = parser.parse_args()
+
+    if not INVOICE_SERVICE_TOKEN:
+        print("La variable INVOICE_SERVICE_TOKEN n'est pas définie (.env) : elle protège le service des autres programmes.")
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    service = InvoiceService(outbox=Outbox() if args.outbox else None)
+    service.warm_up()
+    server = create_server(service, args.port)
+    print(f"Service de facturation prêt en {time.perf_counter() - start:.1f}s sur http://127.0.0.1:{args.port} "
+          f"({len(service.retriever.orders)} lignes).")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Ok!")
+    finally:
+        server.server_close()
+        service.close()
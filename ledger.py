@@ -0,0 +1,196 @@
+""" Year-end ledger export: every service (='prestation') with its receipt, amount and payment, for the accountants.
+
+    The orders are read by chunks (archive partitions batch by batch, then the fetched lines), each
+    chunk is joined with the receipts files through an index of the receipts directory (built with
+    one scan, not one per line), and written right away: the memory used does not depend on the
+    number of years exported.
+
+    Usage:
+        python ledger.py grand_livre.csv -y 2022 2023     # csv (Excel), only these years
+        python ledger.py grand_livre.parquet              # parquet, all the years
+        python ledger.py FEC.txt -f fec -y 2023           # French FEC layout (sales & payments entries)
+"""
+
+import argparse
+import csv
+import os
+from typing import Dict, Iterator, List, NamedTuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import pricing
+import receipt_utils as ru
+from archive import CHUNK_SIZE
+from catalog import RECEIPT_FILE_PATTERN
+from retrieve import PAYMENT_METHODS, Retriever
+
+LEDGER_COLUMNS = ["Ligne", "Date", "Inté / Exté", "Bénéficiaire", "Description", "№ facture", "Montant TTC (centimes)",
+                  "Encaissement", "Date encaissement", "Fichier facture", "Taille facture (octets)", "Date fichier facture"]
+LEDGER_SCHEMA = pa.schema([(col, pa.int64() if col in ["Ligne", "Montant TTC (centimes)", "Taille facture (octets)"] else pa.string())
+                          for col in LEDGER_COLUMNS])
+
+# French 'Fichier des Écritures Comptables' (article A47 A-1 of the Livre des procédures fiscales)
+FEC_COLUMNS = ["JournalCode", "JournalLib", "EcritureNum", "EcritureDate", "CompteNum", "CompteLib", "CompAuxNum",
+               "CompAuxLib", "PieceRef", "PieceDate", "EcritureLib", "Debit", "Credit", "EcritureLet", "DateLet",
+               "ValidDate", "Montantdevise", "Idevise"]
+FEC_ACCOUNTS = {"clients": ("411000", "Clients"), "sales": ("706000", "Prestations de services"),
+                "bank": ("512000", "Banque")}
+FEC_JOURNALS = {"sales": ("VE", "Ventes"), "bank": ("BQ", "Banque")}
+
+LEDGER_FORMATS = ["csv", "parquet", "fec"]
+
+
+class ReceiptFile(NamedTuple):
+    path: str
+    size: int
+    modified: str
+
+
+def build_receipts_index(receipts_path: str = None) -> Dict[str, ReceiptFile]:
+    """Returns the pdf file of each receipt number, with a single scan of the receipts directory (one directory per month)"""
+    receipts_path = receipts_path or ru.RECEIPTS_PATH
+    index = {}
+    if not receipts_path or not os.path.isdir(receipts_path):
+        return index
+    for entry in os.scandir(receipts_path):
+        if not entry.is_dir():
+            continue
+        for receipt in os.scandir(entry.path):
+            if RECEIPT_FILE_PATTERN.match(receipt.name):
+                stat = receipt.stat()
+                modified = pd.Timestamp(stat.st_mtime, unit="s").strftime("%Y-%m-%d %H:%M:%S")
+                index[receipt.name[:-len(".pdf")]] = ReceiptFile(receipt.path, stat.st_size, modified)
+    return index
+
+
+def get_ledger_years(orders: pd.DataFrame) -> pd.Series:
+    """Returns the accounting year of each order: the year of its receipt, or of its date if it has none"""
+    years = orders["№ facture"].fillna("").astype(str).str.extract(r"^(\d{4})-", expand=False)
+    dates_years = pd.to_datetime(orders["Date"], format="%d/%m/%Y", errors="coerce").dt.year
+    return years.fillna(dates_years.map(lambda y: str(int(y)) if pd.notnull(y) else None))
+
+
+def build_ledger_chunk(orders: pd.DataFrame, receipts_index: Dict[str, ReceiptFile], years: List[str] = None) -> pd.DataFrame:
+    """Returns the ledger lines of a chunk of orders: its services (of the given years) joined with their receipt file"""
+    services = orders[orders["Type"] == "Prestation"]
+    if years is not None:
+        services = services[get_ledger_years(services).isin(years)]
+    numbers = services["№ facture"].fillna("").astype(str)
+    files = numbers.map(receipts_index.get)
+
+    ledger = pd.DataFrame({
+        "Ligne": services.index.astype("int64"),
+        "Date": services["Date"].fillna("").astype(str).to_numpy(),
+        "Inté / Exté": services["Inté / Exté"].fillna("").astype(str).to_numpy(),
+        "Bénéficiaire": services["Bénéficiaire"].fillna("").astype(str).str.strip().to_numpy(),
+        "Description": services["Description"].fillna("").astype(str).to_numpy(),
+        "№ facture": numbers.to_numpy(),
+        "Montant TTC (centimes)": pd.array(services["Prix total"].map(pricing.parse_price), dtype="Int64"),
+        "Encaissement": services["Encaissement"].fillna("").astype(str).to_numpy(),
+        "Date encaissement": services["Date encaissement"].fillna("").astype(str).to_numpy(),
+        "Fichier facture": files.map(lambda f: f.path if f else "").to_numpy(),
+        "Taille facture (octets)": pd.array(files.map(lambda f: f.size if f else None), dtype="Int64"),
+        "Date fichier facture": files.map(lambda f: f.modified if f else "").to_numpy(),
+    })
+    return ledger
+
+
+def iter_ledger_chunks(retriever: Retriever, years: List[str] = None, receipts_index: Dict[str, ReceiptFile] = None,
+                       chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Yields the ledger by chunks (archived lines first, then the fetched ones)"""
+    if receipts_index is None:
+        receipts_index = build_receipts_index()
+    # the lines of a year can be archived in the next year's partition (receipt dated in January)
+    partitions = None if years is None else sorted(set(years) | {str(int(y) + 1) for y in years})
+    for orders in retriever.iter_history_chunks(partitions, chunk_size):
+        ledger = build_ledger_chunk(orders, receipts_index, years)
+        if not ledger.empty:
+            yield ledger
+
+
+def write_csv(chunks: Iterator[pd.DataFrame], path: str) -> int:
+    """Writes the ledger chunks in a csv file (readable by Excel), returns the number of lines written"""
+    nb_lines = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(LEDGER_COLUMNS)
+        for chunk in chunks:
+            chunk = chunk.astype(object).where(chunk.notnull(), "")
+            writer.writerows(chunk.itertuples(index=False, name=None))
+            nb_lines += len(chunk)
+    return nb_lines
+
+
+def write_parquet(chunks: Iterator[pd.DataFrame], path: str) -> int:
+    """Writes the ledger chunks in a parquet file (one row group per chunk), returns the number of lines written"""
+    nb_lines = 0
+    with pq.ParquetWriter(path, LEDGER_SCHEMA) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=LEDGER_SCHEMA, preserve_index=False))
+            nb_lines += len(chunk)
+    return nb_lines
+
+
+def format_fec_date(date: str) -> str:
+    """Returns the date of the spreadsheet (ex: 05/01/2022) in the FEC format (20220105), '' if it is not valid"""
+    date = ru.parse_order_date(date)
+    return date.strftime("%Y%m%d") if date is not None else ""
+
+
+def get_fec_entries(ledger: pd.DataFrame) -> Iterator[List[str]]:
+    """Yields the FEC lines of the invoiced services: the sale, and its payment if it is cashed"""
+    invoiced = ledger[ledger["№ facture"].ne("") & ledger["Montant TTC (centimes)"].notnull()]
+    for order in invoiced.itertuples(index=False, name=None):
+        order = dict(zip(LEDGER_COLUMNS, order))
+        number, amount = order["№ facture"], pricing.format_price(int(order["Montant TTC (centimes)"])).rstrip("€")
+        label = f"Facture {number} {order['Bénéficiaire']}"
+        date = format_fec_date(order["Date"])
+        for account, debit, credit in [("clients", amount, "0,00"), ("sales", "0,00", amount)]:
+            yield [*FEC_JOURNALS["sales"], number, date, *FEC_ACCOUNTS[account], "", "", number, date, label,
+                   debit, credit, "", "", date, "", ""]
+
+        payment_date = format_fec_date(order["Date encaissement"])
+        if order["Encaissement"] in PAYMENT_METHODS and payment_date:
+            label = f"Règlement {number} {order['Encaissement']}"
+            for account, debit, credit in [("bank", amount, "0,00"), ("clients", "0,00", amount)]:
+                yield [*FEC_JOURNALS["bank"], f"R{number}", payment_date, *FEC_ACCOUNTS[account], "", "", number,
+                       date, label, debit, credit, "", "", payment_date, "", ""]
+
+
+def write_fec(chunks: Iterator[pd.DataFrame], path: str) -> int:
+    """Writes the ledger chunks in the FEC layout (tab separated), returns the number of entries lines written"""
+    nb_lines = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(FEC_COLUMNS)
+        for chunk in chunks:
+            for entry in get_fec_entries(chunk):
+                writer.writerow(entry)
+                nb_lines += 1
+    return nb_lines
+
+
+def export_ledger(retriever: Retriever, path: str, ledger_format: str = None, years: List[str] = None,
+                  receipts_path: str = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Exports the ledger (format deduced from the file extension by default), returns the number of lines written"""
+    if ledger_format is None:
+        ledger_format = "parquet" if path.endswith(".parquet") else "csv"
+    chunks = iter_ledger_chunks(retriever, years, build_receipts_index(receipts_path), chunk_size)
+    writers = {"csv": write_csv, "parquet": write_parquet, "fec": write_fec}
+    return writers[ledger_format](chunks, path)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="Path of the exported ledger (.csv, .parquet or .txt for the FEC).", type=str)
+    parser.add_argument("-f", "--format", help="Format of the ledger (deduced from the extension by default).",
+                        choices=LEDGER_FORMATS)
+    parser.add_argument("-y", "--years", help="Accounting years to export (all of them by default).", type=str, nargs="+")
+    parser.add_argument("--receipts-path", help="Receipts directory (RECEIPTS_PATH by default).", type=str)
+    args = parser.parse_args()
+
+    nb_lines = export_ledger(Retriever(), args.path, args.format, args.years, args.receipts_path)
+    print(f"{nb_lines} ligne(s) exportée(s) dans {args.path}.")
@@ -24,7 +24,7 @@ def main(args):
     # retrieve column indexes
     col_indexes = su.get_all_col_indexes(spreadsheet)
     # retrieve all the data from the spreadsheet
-    data = su.fetch_all_data(spreadsheet, col_indexes)
+    data = su.fetch_all_data(spreadsheet, col_indexes, creds)
     # filter out the lines that already have a receipt or have been paid
     filtered_data = ut.filter_processed_orders(data)
 
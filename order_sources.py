@@ -0,0 +1,227 @@
+""" Local sources of orders (exports of the spreadsheet), that can replace the Google Sheet in the Retriever.
+
+    All the sources return the orders in the same form as the Retriever: a DataFrame of strings
+    (empty cells are ""), with at least the ORDER_COLUMNS, indexed by the line number of each order.
+    The receipt numbers of the csv & xlsx sources are written to a side file (<file>.receipts.csv),
+    which is read back with the orders so that an order is never invoiced twice.
+"""
+
+import contextlib
+import csv
+import datetime as dt
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator
+
+import pandas as pd
+
+import pricing
+from retrieve import PAYMENT_METHODS
+from spreadsheet_utils import ORDER_COLUMNS
+
+# number of lines read at once
+CHUNK_SIZE = 10_000
+# line of the columns names in the exports of the spreadsheet (the first one is the title)
+HEADER_LINE = 2
+
+
+def format_cell(value, col_name: str) -> str:
+    """Converts a typed value (xlsx cell, SQLite column) to the text shown in the spreadsheet"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, (int, float)):
+        if col_name == "Prix total":
+            return pricing.format_price(round(value * 100)).replace("€", " €")
+        if float(value).is_integer():
+            return str(int(value))
+    return str(value)
+
+
+def normalize_orders(orders: pd.DataFrame) -> pd.DataFrame:
+    """Returns the orders with all the ORDER_COLUMNS, as strings without missing values"""
+    for col_name in ORDER_COLUMNS:
+        if col_name not in orders.columns:
+            orders[col_name] = ""
+    for col_name in orders.columns[orders.dtypes != object]:
+        orders[col_name] = orders[col_name].map(lambda value: format_cell(value, col_name))
+    return orders.fillna("").astype(str)
+
+
+def concat_chunks(chunks: Iterator[pd.DataFrame]) -> pd.DataFrame:
+    chunks = list(chunks)
+    if not chunks:
+        return normalize_orders(pd.DataFrame(columns=ORDER_COLUMNS))
+    return pd.concat(chunks)
+
+
+def drop_empty_lines(orders: pd.DataFrame) -> pd.DataFrame:
+    """Removes the empty lines (after the line numbers are set: the next lines keep their number)"""
+    return orders[orders.ne("").any(axis=1)]
+
+
+def unprocessed_mask(orders: pd.DataFrame) -> pd.Series:
+    """Same predicate as Retriever.get_unprocessed_orders"""
+    return (orders["Type"] == "Prestation") & orders["№ facture"].eq("") & ~orders["Encaissement"].isin(PAYMENT_METHODS)
+
+
+class OrderSource(ABC):
+    """Base class of the order sources"""
+
+    @abstractmethod
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yields the orders, chunk by chunk"""
+
+    def fetch_orders(self, unprocessed_only: bool = False) -> pd.DataFrame:
+        """Returns all the orders (or only the unprocessed ones)"""
+        chunks = (chunk[unprocessed_mask(chunk)] if unprocessed_only else chunk for chunk in self.iter_chunks())
+        return concat_chunks(chunks)
+
+    def fetch_invoiced_orders(self) -> pd.DataFrame:
+        """Returns the orders that have a receipt number"""
+        return concat_chunks(chunk[chunk["№ facture"].ne("")] for chunk in self.iter_chunks())
+
+    def fetch_receipt_numbers(self) -> set:
+        """Returns all the receipt numbers already used"""
+        receipt_numbers = set()
+        for chunk in self.iter_chunks():
+            receipt_numbers.update(chunk["№ facture"].unique())
+        return receipt_numbers
+
+    @abstractmethod
+    def write_receipt_number(self, receipt_nb: str, line: int) -> None:
+        """Writes the receipt number of the order of the given line"""
+
+
+class LocalFileSource(OrderSource):
+    """Source reading a file that is not modified: the receipt numbers are written to a side file"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.receipts_path = path + ".receipts.csv"
+
+    def read_written_receipts(self) -> Dict[int, str]:
+        """Returns the receipt numbers written by previous runs, by line"""
+        if not os.path.exists(self.receipts_path):
+            return {}
+        with open(self.receipts_path, "r", encoding="utf-8", newline="") as f:
+            return {int(line): receipt_nb for line, receipt_nb in csv.reader(f)}
+
+    def apply_written_receipts(self, chunk: pd.DataFrame, written_receipts: Dict[int, str]) -> pd.DataFrame:
+        lines = chunk.index.intersection(list(written_receipts))
+        if len(lines):
+            chunk.loc[lines, "№ facture"] = [written_receipts[line] for line in lines]
+        return chunk
+
+    def write_receipt_number(self, receipt_nb: str, line: int) -> None:
+        with open(self.receipts_path, "a", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerow([line, receipt_nb])
+
+
+class CsvSource(LocalFileSource):
+    """Orders read from a csv export of the spreadsheet"""
+
+    def __init__(self, path: str, header_line: int = HEADER_LINE, sep: str = ",") -> None:
+        super().__init__(path)
+        self.header_line = header_line
+        self.sep = sep
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        written_receipts = self.read_written_receipts()
+        first_line = self.header_line + 1
+        # (the blank lines are read too: they count in the line numbers of the next ones)
+        reader = pd.read_csv(self.path, sep=self.sep, dtype=str, keep_default_na=False, skip_blank_lines=False,
+                             skiprows=self.header_line - 1, chunksize=chunk_size)
+        for chunk in reader:
+            # the index of the chunks continues from the previous one
+            chunk.index = pd.RangeIndex(first_line, first_line + len(chunk))
+            first_line += len(chunk)
+            yield self.apply_written_receipts(drop_empty_lines(normalize_orders(chunk)), written_receipts)
+
+
+class XlsxSource(LocalFileSource):
+    """Orders read from an xlsx export of the spreadsheet (in read-only mode, the file is streamed)"""
+
+    def __init__(self, path: str, sheet_name: str = None, header_line: int = HEADER_LINE) -> None:
+        super().__init__(path)
+        self.sheet_name = sheet_name
+        self.header_line = header_line
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        # imported here: openpyxl is only needed for xlsx files
+        import openpyxl
+
+        written_receipts = self.read_written_receipts()
+        workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            sheet = workbook[self.sheet_name] if self.sheet_name else workbook.worksheets[0]
+            rows = sheet.iter_rows(min_row=self.header_line, values_only=True)
+            columns = [format_cell(value, "") for value in next(rows)]
+            lines, first_line = [], self.header_line + 1
+            for row in rows:
+                lines.append([format_cell(value, col_name) for value, col_name in zip(row, columns)])
+                if len(lines) == chunk_size:
+                    yield self.build_chunk(columns, lines, first_line, written_receipts)
+                    first_line += len(lines)
+                    lines = []
+            if lines:
+                yield self.build_chunk(columns, lines, first_line, written_receipts)
+        finally:
+            workbook.close()
+
+    def build_chunk(self, columns, lines, first_line, written_receipts) -> pd.DataFrame:
+        # the rows may be shorter than the columns names
+        lines = [line + [""] * (len(columns) - len(line)) for line in lines]
+        chunk = pd.DataFrame(lines, columns=columns)
+        chunk.index += first_line
+        return self.apply_written_receipts(drop_empty_lines(normalize_orders(chunk)), written_receipts)
+
+
+class SqliteSource(OrderSource):
+    """Orders stored in a SQLite table, with the columns of the spreadsheet and a 'line' column"""
+
+    def __init__(self, path: str, table: str = "orders") -> None:
+        self.path = path
+        self.table = table
+
+    def query_chunks(self, where: str = "", chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            query = f'SELECT * FROM "{self.table}" {where} ORDER BY line'
+            for chunk in pd.read_sql_query(query, connection, index_col="line", chunksize=chunk_size):
+                chunk.index = chunk.index.astype(int).rename(None)
+                yield normalize_orders(chunk)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        return self.query_chunks(chunk_size=chunk_size)
+
+    def fetch_orders(self, unprocessed_only: bool = False) -> pd.DataFrame:
+        """Returns all the orders (or only the unprocessed ones, filtered by SQLite)"""
+        where = ""
+        if unprocessed_only:
+            payment_methods = ", ".join(f"'{method}'" for method in PAYMENT_METHODS)
+            where = (f"""WHERE "Type" = 'Prestation' AND COALESCE("№ facture", '') = '' """
+                     f"""AND COALESCE("Encaissement", '') NOT IN ({payment_methods})""")
+        return concat_chunks(self.query_chunks(where))
+
+    def fetch_receipt_numbers(self) -> set:
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            rows = connection.execute(f'SELECT DISTINCT "№ facture" FROM "{self.table}"').fetchall()
+        return {row[0] or "" for row in rows}
+
+    def write_receipt_number(self, receipt_nb: str, line: int) -> None:
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.execute(f'UPDATE "{self.table}" SET "№ facture" = ? WHERE line = ?', (receipt_nb, line))
+
+
+def open_order_source(path: str) -> OrderSource:
+    """Returns the source corresponding to the file extension (.csv, .xlsx, .sqlite / .db)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return CsvSource(path)
+    if extension == ".xlsx":
+        return XlsxSource(path)
+    if extension in (".sqlite", ".db"):
+        return SqliteSource(path)
+    raise Exception(f"Unknown order source format: '{extension}' (expected .csv, .xlsx or .sqlite)")
@@ -0,0 +1,295 @@
+""" On-disk outbox for the emails, and the rate-limited sender that empties it.
+
+    The outbox is a directory organised like a Maildir:
+     - tmp/  : messages being written,
+     - new/  : messages waiting to be sent,
+     - cur/  : messages being sent,
+     - sent/ : messages sent,
+     - failed/ : messages that could not be sent after several attempts.
+    Messages are moved between the directories with (atomic) renames, so that they are not
+    lost if a run is stopped. The number of attempts and the time before which
+    a message must not be retried are stored in its file name.
+"""
+
+import argparse
+import datetime as dt
+import email
+import email.policy
+import itertools
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import Callable, Iterable, List, Tuple
+
+from dotenv import load_dotenv
+
+import utils as ut
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', 'outbox')
+
+# default sending limits (gmail allows ~500 emails per day)
+CONCURRENCY = 2
+PER_MINUTE_QUOTA = 20
+PER_DAY_QUOTA = 450
+MAX_ATTEMPTS = 5
+# delay before the first retry (in seconds), doubled after each failure
+RETRY_DELAY = 60
+# a message claimed for longer than this (in seconds) was left in cur/ by a sender that was stopped
+CLAIM_TIMEOUT = 15 * 60
+
+SENT_LOG = "sent.log"
+# receipt numbers of a message, used to update the catalog once it is sent (removed before sending)
+RECEIPTS_HEADER = "X-Receipt-Numbers"
+
+
+class Outbox():
+    def __init__(self, path: str = OUTBOX_PATH) -> None:
+        self.path = path
+        for dir_name in ("tmp", "new", "cur", "sent", "failed"):
+            os.makedirs(os.path.join(path, dir_name), exist_ok=True)
+        self._counter = itertools.count()
+
+    def _dir(self, dir_name: str, file_name: str = "") -> str:
+        return os.path.join(self.path, dir_name, file_name)
+
+    @staticmethod
+    def build_file_name(key: str, attempts: int = 0, not_before: int = 0) -> str:
+        """Returns the name of a message file: key-attempts-not_before.eml"""
+        return f"{key}-{attempts}-{not_before}.eml"
+
+    @staticmethod
+    def parse_file_name(file_name: str) -> Tuple[str, int, int]:
+        """Returns the key, number of attempts and time before which not to send of a message file"""
+        key, attempts, not_before = file_name[:-len(".eml")].split("-")
+        return key, int(attempts), int(not_before)
+
+    def add(self, msg: EmailMessage, receipts_numbers: Iterable[str] = ()) -> str:
+        """Writes a message (containing the given receipts) to the outbox and returns its file name"""
+        if receipts_numbers:
+            msg[RECEIPTS_HEADER] = ",".join(receipts_numbers)
+        key = f"{time.time_ns()}_{os.getpid()}_{next(self._counter)}"
+        file_name = self.build_file_name(key)
+        tmp_path = self._dir("tmp", file_name)
+        with open(tmp_path, "wb") as f:
+            f.write(msg.as_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._dir("new", file_name))
+        return file_name
+
+    def pending(self, now: float = None) -> List[str]:
+        """Returns the messages waiting to be sent (oldest first), that can be sent now"""
+        now = time.time() if now is None else now
+        return sorted(f for f in os.listdir(self._dir("new"))
+                      if self.parse_file_name(f)[2] <= now)
+
+    def claim(self, file_name: str) -> bool:
+        """Moves a message to cur/ before sending it. Returns False if it was already claimed"""
+        try:
+            # (its modification time is the time it was claimed, see recover)
+            os.utime(self._dir("new", file_name))
+            os.replace(self._dir("new", file_name), self._dir("cur", file_name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def read(self, file_name: str) -> EmailMessage:
+        """Reads a claimed message"""
+        with open(self._dir("cur", file_name), "rb") as f:
+            return email.message_from_binary_file(f, policy=email.policy.default)
+
+    def mark_sent(self, file_name: str) -> None:
+        os.replace(self._dir("cur", file_name), self._dir("sent", file_name))
+
+    def mark_failed(self, file_name: str, max_attempts: int = MAX_ATTEMPTS, retry_delay: float = RETRY_DELAY) -> None:
+        """Puts a message back in new/ to be retried later, or in failed/ after max_attempts"""
+        key, attempts, _ = self.parse_file_name(file_name)
+        attempts += 1
+        if attempts >= max_attempts:
+            os.replace(self._dir("cur", file_name), self._dir("failed", file_name))
+            return
+        not_before = int(time.time() + retry_delay * 2 ** (attempts - 1))
+        os.replace(self._dir("cur", file_name), self._dir("new", self.build_file_name(key, attempts, not_before)))
+
+    def recover(self, claim_timeout: float = CLAIM_TIMEOUT) -> None:
+        """Puts back in new/ the messages left in cur/ by a sender that was stopped.
+
+            Only the messages claimed more than claim_timeout seconds ago are recovered: the other
+            ones may be being sent by another sender running at the same time.
+        """
+        now = time.time()
+        for file_name in os.listdir(self._dir("cur")):
+            try:
+                if now - os.path.getmtime(self._dir("cur", file_name)) > claim_timeout:
+                    os.replace(self._dir("cur", file_name), self._dir("new", file_name))
+            except FileNotFoundError:
+                # sent (or failed) in the meantime
+                pass
+
+    def log_sent(self, sent_time: float) -> None:
+        with open(os.path.join(self.path, SENT_LOG), "a") as f:
+            f.write(f"{sent_time}\n")
+
+    def read_sent_log(self, since: float) -> List[float]:
+        """Returns the times at which messages were sent after the given time"""
+        log_path = os.path.join(self.path, SENT_LOG)
+        if not os.path.exists(log_path):
+            return []
+        with open(log_path, "r") as f:
+            return [t for t in (float(line) for line in f if line.strip()) if t >= since]
+
+
+class RateLimiter():
+    """Limits the number of events per minute and per day (thread safe)"""
+
+    def __init__(self, per_minute: int, per_day: int, past_events: List[float] = ()) -> None:
+        self.limits = ((60, per_minute), (24 * 3600, per_day))
+        self.events = deque(sorted(past_events))
+        self.lock = threading.Lock()
+
+    def try_acquire(self, now: float = None) -> float:
+        """Records an event if the limits allow it and returns 0,
+            otherwise returns the time to wait before trying again (in seconds).
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            # forget the events older than the largest window
+            while self.events and self.events[0] <= now - self.limits[-1][0]:
+                self.events.popleft()
+            wait = 0
+            for window, limit in self.limits:
+                in_window = [t for t in self.events if t > now - window]
+                if len(in_window) >= limit:
+                    wait = max(wait, in_window[-limit] + window - now)
+            if wait == 0:
+                self.events.append(now)
+            return wait
+
+
+class OutboxSender():
+    def __init__(self, outbox: Outbox, concurrency: int = CONCURRENCY, per_minute: int = PER_MINUTE_QUOTA,
+                 per_day: int = PER_DAY_QUOTA, max_attempts: int = MAX_ATTEMPTS, retry_delay: float = RETRY_DELAY,
+                 max_wait: float = 120, smtp_factory: Callable = ut.open_smtp_connection, catalog=None) -> None:
+        """
+            Args:
+                outbox (Outbox) : the outbox to empty
+                concurrency (int) : number of emails sent at the same time (one SMTP connection each)
+                per_minute, per_day (int) : maximum number of emails sent per minute / day
+                max_attempts (int) : number of attempts before giving up on an email
+                retry_delay (float) : delay before retrying a failed email (doubled after each failure)
+                max_wait (float) : longest wait for the quotas, the sending stops if it is longer
+                smtp_factory : function returning a logged in SMTP connection
+                catalog (catalog.ReceiptCatalog) : if given, the receipts of the messages sent are marked as sent in it
+        """
+        self.outbox = outbox
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_wait = max_wait
+        self.smtp_factory = smtp_factory
+        self.catalog = catalog
+        # take into account the emails sent by previous runs
+        self.limiter = RateLimiter(per_minute, per_day, outbox.read_sent_log(time.time() - 24 * 3600))
+        self.quota_reached = threading.Event()
+        self.local = threading.local()
+        self.connections = []
+
+    def get_smtp(self):
+        """Returns the SMTP connection of the current thread"""
+        if getattr(self.local, "smtp", None) is None:
+            self.local.smtp = self.smtp_factory()
+            self.connections.append(self.local.smtp)
+        return self.local.smtp
+
+    def wait_for_quota(self) -> bool:
+        """Waits until an email can be sent. Returns False if the wait would be too long"""
+        while not self.quota_reached.is_set():
+            wait = self.limiter.try_acquire()
+            if wait == 0:
+                return True
+            if wait > self.max_wait:
+                self.quota_reached.set()
+                return False
+            time.sleep(wait)
+        return False
+
+    def send(self, file_name: str) -> bool:
+        """Sends one message of the outbox. Returns True if it was sent"""
+        if not self.wait_for_quota():
+            return False
+        if not self.outbox.claim(file_name):
+            return False
+
+        msg = self.outbox.read(file_name)
+        receipts_numbers = msg.get(RECEIPTS_HEADER, "")
+        del msg[RECEIPTS_HEADER]
+        try:
+            self.get_smtp().send_message(msg)
+        except (smtplib.SMTPException, OSError) as e:
+            print(f"Erreur lors de l'envoi à {msg['To']} : {e}")
+            # the connection may be broken: open a new one for the next email
+            self.local.smtp = None
+            self.outbox.mark_failed(file_name, self.max_attempts, self.retry_delay)
+            return False
+
+        sent_time = time.time()
+        self.outbox.mark_sent(file_name)
+        self.outbox.log_sent(sent_time)
+        if self.catalog is not None and receipts_numbers:
+            self.catalog.mark_sent(receipts_numbers.split(","), "sent",
+                                   dt.datetime.fromtimestamp(sent_time).isoformat(timespec="seconds"))
+        return True
+
+    def drain(self) -> int:
+        """Sends all the messages that are waiting, and returns the number of messages sent"""
+        self.outbox.recover()
+        pending = self.outbox.pending()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            nb_sent = sum(executor.map(self.send, pending))
+        self.close()
+
+        if self.quota_reached.is_set():
+            print("Quota d'envoi atteint, les emails restants seront envoyés plus tard.")
+        return nb_sent
+
+    def close(self) -> None:
+        """Closes the SMTP connections"""
+        for smtp in self.connections:
+            try:
+                smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.connections = []
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--concurrency", help="Number of emails sent at the same time.",
+                        type=int, default=CONCURRENCY)
+    parser.add_argument("--per-minute", help="Maximum number of emails sent per minute.",
+                        type=int, default=PER_MINUTE_QUOTA)
+    parser.add_argument("--per-day", help="Maximum number of emails sent per day.",
+                        type=int, default=PER_DAY_QUOTA)
+    parser.add_argument("-w", "--watch", help="Keep checking the outbox for new emails (every minute).",
+                        action='store_true')
+    args = parser.parse_args()
+
+    outbox = Outbox()
+    # imported here: only needed to update the catalog
+    from catalog import ReceiptCatalog
+    catalog = ReceiptCatalog()
+    while True:
+        sender = OutboxSender(outbox, args.concurrency, args.per_minute, args.per_day, catalog=catalog)
+        nb_sent = sender.drain()
+        print(f"{nb_sent} email(s) envoyé(s), {len(os.listdir(os.path.join(outbox.path, 'new')))} en attente.")
+        if not args.watch:
+            break
+        time.sleep(60)
@@ -0,0 +1,148 @@
+""" Checks done on the whole batch of orders before any receipt is created (or any email sent).
+
+    A bad line (non-numeric quantity, unknown asso...) used to stop the run after some receipts were
+    already created and sent. All the lines are now checked at once (column by column, not line by
+    line), with the configuration, assets and receipts directory, and every problem is reported.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+from typing import List, Set, Tuple
+
+import pandas as pd
+from dotenv import load_dotenv
+from PIL import Image
+
+import assets
+import pricing
+import receipt_creation as rc
+import receipt_utils as ru
+from retrieve import EMAIL_PATTERN, Retriever
+
+# loads environment variables from .env file
+load_dotenv(encoding='utf8')
+
+# written on the receipts
+RECEIPT_CONFIG = ['RECEIPTS_PATH', 'CSD_TRESURER_NAME', 'VR_TRESURER_NAME', 'VR_OFFICIAL_NAME', 'VR_INFO',
+                  'VR_ACCOUNT_NUMBER', 'VR_IBAN', 'VR_BIC']
+# needed to send the emails (not when they are written to the outbox)
+MAIL_CONFIG = ['SENDER_EMAIL', 'APP_PASSWORD', 'CSD_TRESURER_PHONE']
+# free space needed in the receipts directory
+MIN_FREE_SPACE_MB = int(os.getenv('MIN_FREE_SPACE_MB', 100))
+# beginning of the issues of a single order (the other issues concern the whole batch)
+LINE_ISSUE_PATTERN = re.compile(r"^ligne (\d+) : ")
+
+
+def check_quantities(orders: pd.DataFrame) -> List[str]:
+    """Returns the quantities that are not positive integers"""
+    quantities = orders[pricing.SERVICE_COLUMNS].fillna("").astype(str).apply(lambda col: col.str.strip())
+    numbers = quantities.replace("", "0").apply(pd.to_numeric, errors="coerce")
+    invalid = (numbers.isnull() | (numbers < 0) | (numbers % 1 != 0)).stack()
+    return [f"ligne {line} : la quantité '{quantities.loc[line, col]}' ({col}) n'est pas un nombre entier."
+            for line, col in invalid[invalid].index]
+
+
+def check_totals(orders: pd.DataFrame) -> List[str]:
+    """Returns the totals that do not match the catalog prices (for the lines with valid quantities)"""
+    quantities = orders[pricing.SERVICE_COLUMNS].fillna("").astype(str).apply(lambda col: col.str.strip())
+    valid = quantities.replace("", "0").apply(lambda col: col.str.fullmatch(r"\d+")).all(axis=1)
+    _, totals = pricing.price_orders(orders[valid])
+    wrong_totals = pricing.find_wrong_totals(orders[valid], totals)
+    return [f"ligne {line} : le prix total ({order['Prix total']}) ne correspond pas aux quantités "
+            f"({pricing.format_price(int(totals[line]))})." for line, order in wrong_totals.iterrows()]
+
+
+def check_recipients(retriever: Retriever, orders: pd.DataFrame) -> List[str]:
+    """Returns the unknown assos, and the recipients without a valid email address"""
+    issues = []
+    is_asso = orders["Inté / Exté"] == "Asso"
+
+    asso_names = orders.loc[is_asso, "Bénéficiaire"]
+    known_assos = {name: retriever.merged_names.get(name) or retriever.beneficiaries.match(name)
+                   for name in asso_names.unique()}
+    for line, name in asso_names[asso_names.map(known_assos).isnull()].items():
+        issues.append(f"ligne {line} : l'association '{name}' est inconnue.")
+
+    # the emails of the assos are the ones of their treasurers
+    mails = orders["Contact eventuel"].fillna("").astype(str)
+    treasurers_mails = retriever.asso_details["tresurer mail"]
+    mails[is_asso] = asso_names.map(known_assos).map(treasurers_mails).fillna("")
+    invalid_mails = ~mails.str.match(EMAIL_PATTERN)
+    # (the unknown assos are already reported)
+    invalid_mails &= ~(is_asso & orders["Bénéficiaire"].map(known_assos).isnull())
+    for line in orders.index[invalid_mails]:
+        issues.append(f"ligne {line} : l'adresse email de '{orders.loc[line, 'Bénéficiaire']}' n'est pas valide ('{mails[line]}').")
+    return issues
+
+
+def check_dates(orders: pd.DataFrame) -> List[str]:
+    """Returns the orders whose date can not be read (needed to invoice past months)"""
+    dates = pd.to_datetime(orders["Date"], format="%d/%m/%Y", errors="coerce")
+    return [f"ligne {line} : la date '{orders.loc[line, 'Date']}' n'est pas valide (jj/mm/aaaa)."
+            for line in orders.index[dates.isnull()]]
+
+
+def check_receipts_dir(receipts_path: str, nb_receipts: int, min_free_space_mb: int = MIN_FREE_SPACE_MB) -> List[str]:
+    """Checks that the receipts can be written in the receipts directory"""
+    if not receipts_path or not os.path.isdir(receipts_path):
+        return [f"le dossier des factures (RECEIPTS_PATH) n'existe pas : '{receipts_path}'."]
+    issues = []
+    try:
+        with tempfile.TemporaryFile(dir=receipts_path):
+            pass
+    except OSError as e:
+        issues.append(f"impossible d'écrire dans le dossier des factures '{receipts_path}' ({e}).")
+    needed_mb = max(min_free_space_mb, nb_receipts * 2 * assets.RECEIPT_SIZE_BUDGET_KB / 1024)
+    free_mb = shutil.disk_usage(receipts_path).free / 1024 ** 2
+    if free_mb < needed_mb:
+        issues.append(f"il ne reste que {free_mb:.0f} Mo dans le dossier des factures ({needed_mb:.0f} Mo nécessaires).")
+    return issues
+
+
+def check_environment(outbox: bool = False) -> List[str]:
+    """Checks the configuration (.env), the logo and the French locale"""
+    names = RECEIPT_CONFIG + ([] if outbox else MAIL_CONFIG)
+    issues = [f"la variable {name} n'est pas définie (.env)." for name in names if not os.getenv(name)]
+    try:
+        with Image.open(assets.LOGO_PATH) as logo:
+            logo.verify()
+    except (OSError, SyntaxError) as e:
+        issues.append(f"le logo '{assets.LOGO_PATH}' ne peut pas être lu ({e}).")
+    if not rc.HAS_FRENCH_LOCALE:
+        issues.append("la locale française n'est pas installée (les mois seraient écrits en anglais).")
+    return issues
+
+
+def split_issues(issues: List[str]) -> Tuple[List[str], Set[int]]:
+    """Returns the issues concerning the whole batch (configuration, receipts directory...), and the lines having an issue"""
+    batch_issues, lines = [], set()
+    for issue in issues:
+        match = LINE_ISSUE_PATTERN.match(issue)
+        if match is None:
+            batch_issues.append(issue)
+        else:
+            lines.add(int(match.group(1)))
+    return batch_issues, lines
+
+
+def run_preflight(retriever: Retriever, orders: pd.DataFrame, outbox: bool = False, backfill: bool = False,
+                  receipts_path: str = None) -> List[str]:
+    """Returns all the problems that would stop (or spoil) the processing of the orders, empty if there is none.
+
+        Args:
+            retriever (Retriever) : the retriever holding the assos details
+            orders (pd.DataFrame) : all the orders that will be processed
+            outbox (bool) : the emails will be written to the outbox (the SMTP config is not needed)
+            backfill (bool) : the receipts will be dated with the orders dates
+            receipts_path (str) : the receipts directory (RECEIPTS_PATH by default)
+    """
+    issues = check_environment(outbox)
+    issues += check_receipts_dir(receipts_path or ru.RECEIPTS_PATH, len(orders))
+    issues += check_quantities(orders)
+    issues += check_totals(orders)
+    issues += check_recipients(retriever, orders)
+    if backfill:
+        issues += check_dates(orders)
+    return issues
@@ -0,0 +1,98 @@
+""" Pricing of CS Design's services.
+
+    Prices are stored as integer numbers of cents, to avoid float rounding errors
+    (ex: 7 stickers at 0.15€ must cost 1,05€ and not 1,0499999999999998€).
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# CSD services, keyed by the name of their quantity column in the spreadsheet
+SERVICES = {"A1": {"designation": "Impression affiche A1", "price": 400},
+            "A2": {"designation": "Impression affiche A2", "price": 200},
+            "A3": {"designation": "Impression affiche A3", "price": 100},
+            "Sticker": {"designation": "Impression sticker", "price": 15},
+            "T-shirt": {"designation": "Impression t-shirt", "price": 600}, }
+
+SERVICE_COLUMNS = list(SERVICES)
+SERVICE_PRICES = pd.Series({col: SERVICES[col]["price"] for col in SERVICE_COLUMNS}, dtype="int64")
+
+
+@lru_cache(maxsize=None)
+def format_price(cents: int) -> str:
+    """Returns a string corresponding to the input price (in cents), ex: 105 -> '1,05€', -45 -> '-0,45€' """
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100},{cents % 100:02d}€"
+
+
+def parse_price(price: str) -> Optional[int]:
+    """Returns the number of cents of a price written in the spreadsheet (ex: '1,05 €'),
+        or None if it can not be read.
+    """
+    digits = re.sub(r"[\s€  ]", "", str(price)).replace(",", ".")
+    match = re.fullmatch(r"(\d+)(?:\.(\d{1,2}))?", digits)
+    if match is None:
+        return None
+    return int(match.group(1)) * 100 + int((match.group(2) or "0").ljust(2, "0"))
+
+
+def get_quantities(orders: pd.DataFrame) -> pd.DataFrame:
+    """Returns the quantities of each service of the orders as integers (0 for empty cells).
+
+        Raises a ValueError if a quantity is not a number, or not a positive integer (ex: '1.5', '-2').
+    """
+    quantities = orders[SERVICE_COLUMNS].fillna("").astype(str).apply(lambda col: col.str.strip())
+    quantities = quantities.replace("", "0").apply(pd.to_numeric)
+    invalid = ((quantities < 0) | (quantities % 1 != 0)).stack()
+    if invalid.any():
+        line, col = invalid[invalid].index[0]
+        raise ValueError(f"Invalid quantity '{orders.loc[line, col]}' ({col}) on line {line}: it must be a positive integer")
+    return quantities.astype("int64")
+
+
+def price_orders(orders: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    """Computes the line items and total price of all the orders at once.
+
+        Args:
+            orders (pd.DataFrame) : orders data, with one column per service
+
+        Returns:
+            The line items (one row per ordered service, indexed by order line, in the catalog order)
+            and the total price of each order (in cents).
+    """
+    quantities = get_quantities(orders)
+    totals = (quantities * SERVICE_PRICES).sum(axis=1)
+
+    # one row per (order, service) with a non zero quantity
+    long_quantities = quantities.stack()
+    long_quantities = long_quantities[long_quantities != 0]
+    services = long_quantities.index.get_level_values(1)
+    unit_prices = SERVICE_PRICES.reindex(services).to_numpy()
+
+    line_items = pd.DataFrame({
+        "service": services,
+        "quantity": long_quantities.to_numpy(),
+        "unit cents": unit_prices,
+        "line cents": long_quantities.to_numpy() * unit_prices,
+    }, index=long_quantities.index.get_level_values(0))
+    line_items["designation"] = line_items["service"].map(lambda s: SERVICES[s]["designation"])
+    line_items["unit price"] = line_items["unit cents"].map(format_price) + " HT"
+    line_items["line total price"] = line_items["line cents"].map(format_price) + " TTC"
+
+    return line_items, totals
+
+
+def get_orders_lists(line_items: pd.DataFrame) -> Dict[int, List[Dict]]:
+    """Returns, for each order line, the list of its services details used to build the receipt"""
+    records = line_items[["quantity", "designation", "unit price", "line total price"]]
+    return {idx: group.to_dict(orient="records") for idx, group in records.groupby(level=0, sort=False)}
+
+
+def find_wrong_totals(orders: pd.DataFrame, totals: pd.Series) -> pd.DataFrame:
+    """Returns the orders whose 'Prix total' is not equal to the price computed from the catalog"""
+    sheet_totals = orders["Prix total"].map(parse_price)
+    return orders[sheet_totals != totals]
@@ -3,36 +3,313 @@
 import warnings
 warnings.simplefilter(action='ignore')
 
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
 import pandas as pd
 
+import assets
+import preflight
+import pricing
+from catalog import ReceiptCatalog
+from duplicates import find_duplicates, get_recent_invoiced_orders
 import receipt_creation as rc
 import receipt_utils as ru
-import spreadsheet_utils as su
 import utils as ut
+from async_retrieve import AsyncRetriever
+from order_sources import open_order_source
+from outbox import Outbox
+from receipt_writer import ReceiptWriter
+from render_service import MIN_POOL_RECEIPTS, RenderJob, RenderService
 from retrieve import Retriever
 
+# number of months processed at the same time by the backfill (one Word application each)
+BACKFILL_WORKERS = 4
 
 
-def main():
-    retriever = Retriever()
-    all_orders = retriever.orders
+def get_processable_orders(retriever: Retriever, orders: pd.DataFrame = None, auto_merge: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Returns the asso, individual and extern orders that can be processed (in this order).
 
+        Args:
+            retriever (Retriever) : the retriever holding the orders data
+            orders (pd.DataFrame) : the orders to filter (defaults to all the retriever's orders)
+            auto_merge (bool) : process the unknown assos names that are very close to a known one
+    """
     # get unprocessed receipts
-    to_be_processed = retriever.get_unprocessed_orders()
-    print(f"{len(to_be_processed)} commande(s) sans facture ni paiement.")
+    to_be_processed = retriever.get_unprocessed_orders(orders)
 
     # retrieve the asso orders that could be processed
     asso_orders = retriever.filter_by_client_type(to_be_processed, "Asso")
-    can_be_processed_asso = retriever.filter_unknown_assos(asso_orders)
+    can_be_processed_asso = retriever.filter_unknown_assos(asso_orders, auto_merge)
     # Same for individual & extern orders
     valid_email_orders = retriever.filter_invalid_mails(to_be_processed)
     can_be_processed_indiv = retriever.filter_by_client_type(valid_email_orders, "Inté")
     can_be_processed_etern = retriever.filter_by_client_type(valid_email_orders, "Exté")
 
+    return can_be_processed_asso, can_be_processed_indiv, can_be_processed_etern
+
+
+def get_receipt_recipient_info(retriever: Retriever, recip_name: str, recip_orders: pd.DataFrame) -> str:
+    """Returns the recipient data written on the receipts (different depending on the recipient type)"""
+    if recip_orders["Inté / Exté"].iloc[0] == "Asso":
+        asso_details = retriever.get_asso_details(recip_name)
+        return asso_details["official name"] + "\n" + asso_details["address"]
+    # if it is an individual or an extern order
+    return recip_orders["Bénéficiaire"].iloc[0]
+
+
+def process_recipient_orders(retriever: Retriever, recip_name: str, recip_orders: pd.DataFrame, sheet_receipt_names: set, smtp=None, word=None, orders_lists: dict = None, outbox: Outbox = None, catalog: ReceiptCatalog = None,
+                             backfill: bool = False, written_receipts: dict = None, writer: ReceiptWriter = None,
+                             prerendered: dict = None) -> None:
+    """Creates, exports and sends the receipts of all the orders of one recipient.
+
+        Args:
+            retriever (Retriever) : the retriever used to write the receipt numbers
+            recip_name (str) : name of the recipient
+            recip_orders (pd.DataFrame) : the orders of this recipient to process
+            sheet_receipt_names (set) : receipt numbers already used (updated with the new ones)
+            smtp : an already logged-in SMTP connection to reuse (optional)
+            word : an already running Word application to reuse (optional)
+            orders_lists (dict) : the services details of each order, computed with pricing (optional)
+            outbox (Outbox) : if given, the email is written to this outbox instead of being sent
+            catalog (ReceiptCatalog) : if given, the receipts are recorded in this catalog
+            backfill (bool) : date & number each receipt in the month of its order, instead of the current month
+            written_receipts (dict) : if given, the receipt numbers are stored in it (by line) to be written
+                in the spreadsheet later, instead of being written one by one
+            writer (ReceiptWriter) : if given, the receipts are rendered & converted in memory,
+                attached from memory, and their files are written in the background by the writer
+            prerendered (dict) : the receipt number & docx being rendered (future) of each order, by line
+                (see prerender_receipts, requires a writer)
+    """
+    if orders_lists is None:
+        line_items, _ = pricing.price_orders(recip_orders)
+        orders_lists = pricing.get_orders_lists(line_items)
+
+    # check if it is an association or other
+    recip_type = recip_orders["Inté / Exté"].iloc[0]
+    if recip_type == "Asso":
+        # get asso details (address, email, etc.)
+        asso_details = retriever.get_asso_details(recip_name)
+    receipt_recipient_info = get_receipt_recipient_info(retriever, recip_name, recip_orders)
+
+    # will store the pdf receipts paths to attach them to emails
+    receipts_paths = []
+    receipts_numbers = []
+
+    # process the orders
+    for order_idx, order in recip_orders.iterrows():
+
+        # get the order(s) details
+        total_print_price = order["Prix total"] + " TTC"
+
+        # the details of each type of print (A1, A2, A3, sticker, t-shirt) ordered
+        orders_list = orders_lists.get(order_idx, [])
+
+        # the receipt of a past order is dated on the day of the order
+        receipt_date = ru.parse_order_date(order["Date"]) if backfill else None
+
+        if prerendered is not None:
+            receipt_nb, docx_future = prerendered[order_idx]
+        else:
+            # get the next receipt number
+            receipt_nb = ru.get_receipt_number(sheet_receipt_names, date=receipt_date)
+            sheet_receipt_names.add(receipt_nb)
+
+        docx_file_name = rc.build_receipt_path(
+            ru.RECEIPTS_PATH, ru.get_this_months_dir_name(receipt_date), receipt_nb + ".docx")
+        pdf_file_name = rc.build_receipt_path(
+            ru.RECEIPTS_PATH, ru.get_this_months_dir_name(receipt_date), receipt_nb + ".pdf")
+
+        if writer is not None:
+            # no round-trip through the receipts directory: the files are written once, in the background
+            if prerendered is not None:
+                docx_data = docx_future.result()
+            else:
+                docx_data = rc.render_receipt_docx(
+                    receipt_recipient_info, orders_list, receipt_nb, total_print_price, receipt_date)
+            pdf_data = rc.convert_docx_to_pdf(docx_data, word)
+            writer.write(docx_file_name, docx_data)
+            writer.write(pdf_file_name, pdf_data)
+            receipts_paths.append((receipt_nb + ".pdf", pdf_data))
+        else:
+            rc.create_receipt_docx(
+                receipt_recipient_info, orders_list, receipt_nb, total_print_price, docx_file_name, receipt_date)
+            # export to pdf
+            rc.export_receipt_to_pdf(docx_file_name, pdf_file_name, word)
+            receipts_paths.append(pdf_file_name)
+            pdf_data = None
+        print(f" - Facture {receipt_nb} exportée.")
+        size_warning = assets.check_receipt_size(pdf_file_name, size=None if pdf_data is None else len(pdf_data))
+        if size_warning is not None:
+            print(size_warning)
+        receipts_numbers.append(receipt_nb)
+        if catalog is not None:
+            catalog.add(receipt_nb, pdf_file_name, recip_name, pricing.parse_price(order["Prix total"]), order_idx, data=pdf_data)
+
+        # update the spreadsheet
+        if written_receipts is not None:
+            written_receipts[order_idx] = receipt_nb
+        else:
+            retriever.write_receipt_number(receipt_nb, order_idx)
+
+    # send an email with the receipts attached
+    if recip_type == "Asso":
+        recip_mail = asso_details["tresurer mail"]
+        recipient_first_name = asso_details["tresurer first name"]
+
+    else:
+        recip_mail = order["Contact eventuel"]
+        recipient_first_name = None
+
+    ut.send_receipts_by_mail(
+        recip_name,
+        recip_mail,
+        recip_type,
+        receipts_paths,
+        recip_orders.to_dict(orient="records"),
+        recipient_first_name,
+        smtp=smtp,
+        outbox=outbox,
+        receipts_numbers=receipts_numbers
+    )
+    if catalog is not None:
+        catalog.mark_sent(receipts_numbers, "sent" if outbox is None else "queued")
+    if outbox is None:
+        print(f"Email envoyé à {recip_mail} ({recip_name}).\n")
+    else:
+        print(f"Email pour {recip_mail} ({recip_name}) ajouté à la boîte d'envoi.\n")
+
+
+def prerender_receipts(retriever: Retriever, recipients_orders: List[Tuple[str, pd.DataFrame]], sheet_receipt_names: set,
+                       orders_lists: dict, renderer: RenderService) -> dict:
+    """Numbers all the receipts (in the order of the recipients & of their orders) and submits them to the render service.
+
+        Returns the receipt number & docx future of each order, by line: the receipts are rendered by all
+        the workers while the first ones are converted & sent.
+    """
+    lines, jobs = [], []
+    for recip_name, recip_orders in recipients_orders:
+        receipt_recipient_info = get_receipt_recipient_info(retriever, recip_name, recip_orders)
+        for order_idx, order in recip_orders.iterrows():
+            receipt_nb = ru.get_receipt_number(sheet_receipt_names)
+            sheet_receipt_names.add(receipt_nb)
+            lines.append(order_idx)
+            jobs.append(RenderJob(receipt_recipient_info, orders_lists.get(order_idx, []), receipt_nb,
+                                  order["Prix total"] + " TTC"))
+    futures = renderer.submit_all(jobs)
+    return {line: (job.receipt_nb, future) for line, job, future in zip(lines, jobs, futures)}
+
+
+def process_orders(retriever: Retriever, can_be_processed: pd.DataFrame, smtp=None, word=None, outbox: Outbox = None,
+                   catalog: ReceiptCatalog = None, writer: ReceiptWriter = None, renderer: RenderService = None) -> None:
+    """Processes the given orders, grouped by recipient (one email per recipient).
+
+        If a render service is given (with a writer), all the receipts are rendered in its worker processes.
+    """
+    # get the already created receipt numbers
+    sheet_receipt_names = retriever.get_receipt_numbers()
+    # compute the details of all the orders at once
+    line_items, _ = pricing.price_orders(can_be_processed)
+    orders_lists = pricing.get_orders_lists(line_items)
+
+    # get the orders of each recipient
+    # (the variants of the name of an asso, or names differing only by their case, are the same recipient)
+    recipients_orders = retriever.group_by_recipient(can_be_processed)
+
+    prerendered = None
+    if renderer is not None and writer is not None:
+        prerendered = prerender_receipts(retriever, recipients_orders, sheet_receipt_names, orders_lists, renderer)
+
+    # for each recipient, process the orders
+    for recip_name, recip_orders in recipients_orders:
+        process_recipient_orders(retriever, recip_name, recip_orders, sheet_receipt_names, smtp, word, orders_lists, outbox, catalog,
+                                 writer=writer, prerendered=prerendered)
+
+
+def process_month_orders(retriever: Retriever, month_orders: pd.DataFrame, sheet_receipt_names: set, orders_lists: dict,
+                         written_receipts: dict, outbox: Outbox = None, catalog: ReceiptCatalog = None,
+                         writer: ReceiptWriter = None) -> dict:
+    """Processes the orders of one past month in a worker thread, with its own Word application & SMTP connection.
+
+        The receipt numbers created are stored in written_receipts (by line) as soon as each receipt is
+        created, so that the main thread writes them in the spreadsheet even if the month fails. Returns it.
+    """
+    smtp = ut.open_smtp_connection() if outbox is None else None
+    try:
+        with rc.word_in_thread() as word:
+            for recip_name, recip_orders in retriever.group_by_recipient(month_orders):
+                process_recipient_orders(retriever, recip_name, recip_orders, sheet_receipt_names, smtp, word, orders_lists,
+                                         outbox, catalog, backfill=True, written_receipts=written_receipts, writer=writer)
+    finally:
+        if smtp is not None:
+            smtp.quit()
+    return written_receipts
+
+
+def process_orders_by_month(retriever: Retriever, can_be_processed: pd.DataFrame, outbox: Outbox = None,
+                            catalog: ReceiptCatalog = None, max_workers: int = BACKFILL_WORKERS, writer: ReceiptWriter = None) -> None:
+    """Processes past orders: each receipt is numbered & dated in the month of its order.
+
+        The months are independent (each one has its own receipt numbers), so they are processed concurrently,
+        one worker per month. The receipt numbers of a month are written in the spreadsheet (in one request)
+        as soon as it is done, even if it failed. The first error is raised once all the months are written.
+    """
+    line_items, _ = pricing.price_orders(can_be_processed)
+    orders_lists = pricing.get_orders_lists(line_items)
+
+    orders_by_month = retriever.get_orders_by_month(can_be_processed)
+    invalid_dates = orders_by_month.pop(None, None)
+    if invalid_dates is not None:
+        print(f"{len(invalid_dates)} commande(s) ignorée(s), leur date n'est pas valide (lignes {', '.join(map(str, invalid_dates.index))}).")
+    # the numbers of past years may be archived: load the years of the backfilled months
+    sheet_receipt_names = retriever.get_receipt_numbers(sorted({month[:4] for month in orders_by_month}))
+
+    first_error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for month, month_orders in orders_by_month.items():
+            # each worker only needs (and updates) the numbers of its month
+            month_receipt_names = {name for name in sheet_receipt_names if str(name).startswith(month)}
+            # (only filled by the worker of the month, and read here once it is done)
+            written_receipts = {}
+            futures[executor.submit(process_month_orders, retriever, month_orders, month_receipt_names,
+                                    orders_lists, written_receipts, outbox, catalog, writer)] = (month, written_receipts)
+        for future in as_completed(futures):
+            month, written_receipts = futures[future]
+            try:
+                future.result()
+                print(f"Mois {month} terminé : {len(written_receipts)} facture(s).\n")
+            except Exception as e:
+                print(f"Erreur pour le mois {month} ({len(written_receipts)} facture(s) déjà créée(s)) : {e}\n")
+                first_error = first_error or e
+            finally:
+                # the receipts already created (and sent) must never be created again by the next run
+                retriever.write_receipt_numbers(written_receipts)
+    if first_error is not None:
+        raise first_error
+
+
+def main(args, retriever: Retriever = None):
+    """Processes all the orders that can be processed.
+
+        Args:
+            args : the command line arguments
+            retriever (Retriever) : the retriever to use instead of reading the spreadsheet (ex: tests)
+    """
+    if retriever is None and args.source:
+        # only the unprocessed orders of the local export are loaded
+        retriever = Retriever(source=open_order_source(args.source), unprocessed_only=True)
+    elif retriever is None:
+        # the orders and the associations details are loaded concurrently
+        retriever = asyncio.run(AsyncRetriever.create())
+
+    print(f"{len(retriever.get_unprocessed_orders())} commande(s) sans facture ni paiement.")
+    can_be_processed_asso, can_be_processed_indiv, can_be_processed_etern = get_processable_orders(retriever, auto_merge=args.auto_merge)
+
     # group them into one array
     can_be_processed = pd.concat([can_be_processed_asso, can_be_processed_indiv, can_be_processed_etern])
-    # list all the different recipientsof the orders that will be processed (to group the orders by recipient)
-    unique_recipient_names = can_be_processed['Bénéficiaire'].unique()
 
     # print the overview and ask the user to confirm
     print(f"\n{len(can_be_processed)} prestations peuvent être traitées, dont:")
@@ -40,94 +317,75 @@ def main():
     print(f" - {len(can_be_processed_indiv)} pour des étudiants,")
     print(f" - {len(can_be_processed_etern)} pour des clients extérieurs.")
 
-    answer = input("\nVoulez-vous continuer? (O/N)\n")
+    # show the closest known asso of the unknown ones
+    asso_orders = retriever.filter_by_client_type(retriever.get_unprocessed_orders(), "Asso")
+    for _, unknown in retriever.get_unknown_assos(asso_orders).iterrows():
+        if unknown["suggestion"] is not None:
+            print(f"Asso inconnue : '{unknown['name']}' (proche de '{unknown['suggestion']}', score {unknown['score']:.2f})")
+        else:
+            print(f"Asso inconnue : '{unknown['name']}'")
+
+    # check the whole batch before creating any receipt
+    issues = preflight.run_preflight(retriever, can_be_processed, outbox=args.outbox, backfill=args.backfill)
+    if issues:
+        print(f"\n{len(issues)} problème(s) à corriger avant de créer les factures :")
+        for issue in issues:
+            print(f" - {issue}")
+        print("Aucune facture n'a été créée.")
+        return
+
+    # hold back the orders entered twice (unless confirmed)
+    duplicates = find_duplicates(can_be_processed, get_recent_invoiced_orders(retriever))
+    if len(duplicates):
+        print(f"\n{len(duplicates)} doublon(s) probable(s) :")
+        for line, duplicate in duplicates.iterrows():
+            print(f" - ligne {line} ({duplicate['Bénéficiaire']}, {duplicate['Date']}, {duplicate['Prix total']}) "
+                  f"identique à la {duplicate['duplicate of']}")
+        keep_duplicates = args.include_duplicates or \
+            (not args.yes and input("Facturer aussi ces commandes ? (O/N)\n").lower() == 'o')
+        if not keep_duplicates:
+            can_be_processed = can_be_processed.drop(duplicates.index)
+            print(f"Ces commandes ne seront pas facturées ({len(can_be_processed)} prestation(s) restante(s)).")
+
+    answer = 'o' if args.yes else input("\nVoulez-vous continuer? (O/N)\n")
     if answer.lower() == 'o':
         print("Let's go!\n")
     else:
         print("Ok!")
         return
 
-    # for each asso, process the orders
-    for recip_name in unique_recipient_names:
-        
-        # get the orders for this recipient
-        recip_orders = retriever.filter_by_recipient_name(can_be_processed, recip_name)
-
-        # check if it is an association or other
-        recip_type = recip_orders["Inté / Exté"].iloc[0]
-        if recip_type == "Asso":
-            # get asso details (address, email, etc.)
-            asso_details = retriever.get_asso_details(recip_name)
-            # get recipient data that will be used to create the receipt
-            # is different depending on the recipient type
-            receipt_recipient_info = asso_details["official name"] + "\n" + asso_details["address"]
-
-        # if it is an individual or an extern order
+    outbox = Outbox() if args.outbox else None
+    catalog = ReceiptCatalog()
+    # the receipts files are written in the background, while the next ones are rendered
+    with ReceiptWriter() as writer:
+        if args.backfill:
+            process_orders_by_month(retriever, can_be_processed, outbox=outbox, catalog=catalog, max_workers=args.workers,
+                                    writer=writer)
+        elif len(can_be_processed) >= MIN_POOL_RECEIPTS:
+            # enough receipts to render them on all the cores
+            with RenderService() as renderer:
+                process_orders(retriever, can_be_processed, outbox=outbox, catalog=catalog, writer=writer, renderer=renderer)
         else:
-            receipt_recipient_info = recip_orders["Bénéficiaire"].iloc[0]
-
-        # will store the pdf receipts paths to attach them to emails
-        receipts_paths = []
-
-        # process the orders
-        for order_idx, order in recip_orders.iterrows():
-
-            # get the order(s) details
-            total_print_price = order["Prix total"] + " TTC"
-
-            # will store the details of the order
-            orders_list = []
-
-            # iterate over each type of print (A1, A2, A3, sticker, t-shirt)
-            for q_id, qtity_st in enumerate(list(order[order_key] for order_key in ("A1", "A2", "A3", "Sticker", "T-shirt"))):
-                # if there is an order
-                if qtity_st:
-                    # compute the total price of each service type
-                    element_price = int(qtity_st) * \
-                        su.SERVICES_DATA[q_id]["price"]
-                    order_dict = {"quantity": qtity_st, "designation": su.SERVICES_DATA[q_id]["designation"],
-                                  "unit price": su.format_price_string(su.SERVICES_DATA[q_id]["price"]) + " HT",
-                                  "line total price": su.format_price_string(element_price) + " TTC"}
-                    orders_list.append(order_dict)
-
-            # get the already created receipt numbers
-            sheet_receipt_names = all_orders["№ facture"].unique()
-            receipt_nb = ru.get_receipt_number(sheet_receipt_names)
-
-            docx_file_name = rc.build_receipt_path(
-                ru.RECEIPTS_PATH, ru.get_this_months_dir_name(), receipt_nb + ".docx")
-
-            rc.create_receipt_docx(
-                receipt_recipient_info, orders_list, receipt_nb, total_print_price, docx_file_name)
-            pdf_file_name = rc.build_receipt_path(
-                ru.RECEIPTS_PATH, ru.get_this_months_dir_name(), receipt_nb + ".pdf")
+            process_orders(retriever, can_be_processed, outbox=outbox, catalog=catalog, writer=writer)
+    catalog.close()
 
-            # export to pdf
-            rc.export_receipt_to_pdf(docx_file_name, pdf_file_name)
-            print(f" - Facture {receipt_nb} exportée.")
-            receipts_paths.append(pdf_file_name)
-
-            # update the spreadsheet
-            retriever.write_receipt_number(receipt_nb, order_idx)
-
-        # send an email with the receipts attached
-        if order["Inté / Exté"] == "Asso":
-            recip_mail = asso_details["tresurer mail"]
-            recipient_first_name = asso_details["tresurer first name"]
+if __name__ == '__main__':
 
-        else:
-            recip_mail = order["Contact eventuel"]
-            recipient_first_name = None
-
-        ut.send_receipts_by_mail(
-            recip_name, 
-            recip_mail, 
-            recip_type, 
-            receipts_paths, 
-            recip_orders.to_dict(orient="records"), 
-            recipient_first_name
-        )
-        print(f"Email envoyé à {recip_mail} ({recip_name}).\n")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--outbox", help="Write the emails to the outbox instead of sending them (outbox.py sends them).",
+                        action='store_true')  # no arguments
+    parser.add_argument("--auto-merge", help="Process the orders of unknown assos whose name is very close to a known one.",
+                        action='store_true')  # no arguments
+    parser.add_argument("-y", "--yes", help="Do not ask for confirmation before processing the orders.",
+                        action='store_true')  # no arguments
+    parser.add_argument("--include-duplicates", help="Also invoice the orders that look like duplicates.",
+                        action='store_true')  # no arguments
+    parser.add_argument("--backfill", help="Invoice past orders: each receipt is numbered and dated in the month of its order.",
+                        action='store_true')  # no arguments
+    parser.add_argument("--workers", help="Number of months processed at the same time with --backfill.",
+                        type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--source", help="Read the orders from a local export (.csv, .xlsx or .sqlite) instead of the spreadsheet.",
+                        type=str)
+    args = parser.parse_args()
 
-if __name__ == '__main__':
-    main()
+    main(args)
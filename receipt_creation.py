@@ -4,13 +4,33 @@ from docx.shared import Cm, Pt, RGBColor
 from docx.enum.style import WD_STYLE_TYPE
 import locale
 import datetime as dt
+import io
 import os
-import win32com.client
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
 from dotenv import load_dotenv
 
 from receipt_utils import *
+import assets
 
-locale.setlocale(locale.LC_ALL, 'fr_FR')
+# names of the French locale (Windows, Linux & macOS)
+FRENCH_LOCALES = ['fr_FR', 'fr_FR.UTF-8', 'French_France.1252']
+
+
+def set_french_locale() -> bool:
+    """Sets the French locale (for the months names), returns False if it is not available"""
+    for locale_name in FRENCH_LOCALES:
+        try:
+            locale.setlocale(locale.LC_ALL, locale_name)
+            return True
+        except locale.Error:
+            continue
+    return False
+
+
+# checked by the preflight (without it, the months are written in English)
+HAS_FRENCH_LOCALE = set_french_locale()
 
 # loads environment variables from .env file
 load_dotenv(encoding='utf8')
@@ -53,6 +73,8 @@ def set_document_styles(styles):
     # custom footer
     new_footer_style = styles.add_style('New Footer', WD_STYLE_TYPE.PARAGRAPH)
     set_style(new_footer_style, FONT_FAMILY, Pt(8), DARK_GREY)
+    # orders table
+    add_table_style(styles)
 
 
 def add_header_section(document: Document):
@@ -64,26 +86,31 @@ def add_header_section(document: Document):
     table = document.add_table(1, 2)
     par = table.cell(0, 0).paragraphs[0]
     run = par.add_run()
-    run.add_picture('logo.png', width=Cm(3))
+    run.add_picture(assets.get_logo(), width=Cm(assets.LOGO_WIDTH_CM))
     p = table.cell(0, 1).paragraphs[0]
     p.add_run(VR_OFFICIAL_NAME).bold = True
     p.add_run("\n" + VR_INFO)
     table.cell(0, 1).paragraphs[0].alignment = 2
 
 
-def add_details_section(receipt_number, document):
-    """Adds a section with the receipt number, current and due date, and payment methods """
-    today = dt.date.today()
+def format_date(date: dt.date) -> str:
+    """Returns the date as written on the receipts, ex: 5 janv. 2022 (the day without leading zero, on every OS)"""
+    return f"{date.day} {date.strftime('%b %Y')}"
+
+
+def add_details_section(receipt_number, document, date: dt.date = None):
+    """Adds a section with the receipt number, current (or given) and due date, and payment methods """
+    today = date if date is not None else dt.date.today()
     due_date = today + dt.timedelta(weeks=2)
 
     document.add_paragraph('Détails', style="New Heading")
     p = document.add_paragraph()
     p.add_run(f"Numéro de facture ...............{receipt_number}\n")
     p.add_run(
-        f"Date de la facture ................{today.strftime('%#d %b %Y')}\n")
+        f"Date de la facture ................{format_date(today)}\n")
     p.add_run("Mode de règlement .............chèque ou virement\n")
     p.add_run(
-        f"Date d'échéance .................{due_date.strftime('%#d %b %Y')}")
+        f"Date d'échéance .................{format_date(due_date)}")
 
 
 def add_footer_section(document):
@@ -98,68 +125,48 @@ def add_footer_section(document):
 
 
 def add_orders_table(orders, total_price: str, document):
-    """Adds a table filled with the order's details"""
-    # create the table
-    table = document.add_table(rows=1, cols=5)
-
-    # fill out the columns names
-    hdr_cells = table.rows[0].cells
-    table_cols = table.columns
-    hdr_cells[0].text = 'Qté'
-    hdr_cells[0].paragraphs[0].runs[0].font.bold = True
-    hdr_cells[1].text = 'Désignation'
-    hdr_cells[2].text = 'Prix unitaire'
-    hdr_cells[3].text = 'TVA'
-    hdr_cells[4].text = 'Tot. ligne'
-
+    """Adds a table filled with the order's details (built in one pass, even for hundreds of lines)"""
+    # columns names
+    rows = [['Qté', 'Désignation', 'Prix unitaire', 'TVA', 'Tot. ligne']]
     for order in orders:
-        row_cells = table.add_row().cells
-        row_cells[0].text = str(order["quantity"])
-        row_cells[0].paragraphs[0].alignment = 2
-        row_cells[1].text = order["designation"]
-        row_cells[2].text = order["unit price"]
-        row_cells[3].text = "Non applicable"
-        row_cells[4].text = order["line total price"]
+        rows.append([str(order["quantity"]), order["designation"], order["unit price"],
+                     "Non applicable", order["line total price"]])
     # add blank lines under the real orders
-    table.add_row()
-    table.add_row()
+    rows += [[""] * 5, [""] * 5]
     # add the last row = sum of prices
-    row_cells = table.add_row().cells
-    row_cells[3].text = "Net à payer"
-    row_cells[4].text = total_price
-    # make first and last rows' text bold
-    make_rows_bold(table.rows[0])
-    make_rows_bold(table.rows[-1])
-    # set columns width
-    table_cols = table.columns
-    set_col_width(table_cols[0], Cm(0.5))
-    set_col_width(table_cols[1], Cm(10))
-    set_col_width(table_cols[2], Cm(3))
-    set_col_width(table_cols[3], Cm(3))
-    set_col_width(table_cols[4], Cm(3))
-
-
-def create_receipt_docx(recipient_info: str, orders: List[Dict], receipt_nb: str, total_price: str, file_name: str):
-    """Defines and saves a .docx file 
+    rows.append(["", "", "", "Net à payer", total_price])
+    # the first and last rows are bold (table style), the quantities are right-aligned
+    return build_table(document, rows, [Cm(0.5), Cm(10), Cm(3), Cm(3), Cm(3)], body_alignments={0: "right"})
 
-        Args:
-            file_name (str): the path and name of the receipt to be created
-    """
 
-    # Create a new document
+@lru_cache(maxsize=None)
+def get_receipt_template() -> bytes:
+    """Returns the part common to all the receipts (styles, title, logo and address), built once per process"""
     document = Document()
-    styles = document.styles
+    set_document_styles(document.styles)
+    add_header_section(document)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
 
-    set_document_styles(styles)
 
-    add_header_section(document)
+def build_receipt_document(recipient_info: str, orders: List[Dict], receipt_nb: str, total_price: str,
+                           date: dt.date = None) -> Document:
+    """Defines the receipt document (without saving it)
+
+        Args:
+            date (dt.date): date of the receipt (today by default)
+    """
+
+    # Create a new document from the template (styles & header)
+    document = Document(io.BytesIO(get_receipt_template()))
 
     # Address of recipient
     document.add_paragraph('Facturé à', style="New Heading")
     document.add_paragraph(recipient_info)
 
     # Receipt details
-    add_details_section(receipt_nb, document)
+    add_details_section(receipt_nb, document, date)
 
     # responsables
     document.add_paragraph('Responsables', style="New Heading")
@@ -176,15 +183,88 @@ def create_receipt_docx(recipient_info: str, orders: List[Dict], receipt_nb: str
     document.add_paragraph()
     add_footer_section(document)
 
+    return document
+
+
+def create_receipt_docx(recipient_info: str, orders: List[Dict], receipt_nb: str, total_price: str, file_name: str,
+                        date: dt.date = None):
+    """Defines and saves a .docx file 
+
+        Args:
+            file_name (str): the path and name of the receipt to be created
+            date (dt.date): date of the receipt (today by default)
+    """
+    document = build_receipt_document(recipient_info, orders, receipt_nb, total_price, date)
     document.save(file_name)
 
 
-def export_receipt_to_pdf(docx_file_name, pdf_file_name):
-    """Exports the receipt to a PDF file"""
+def render_receipt_docx(recipient_info: str, orders: List[Dict], receipt_nb: str, total_price: str,
+                        date: dt.date = None) -> bytes:
+    """Returns the content of the .docx receipt, rendered in memory"""
+    document = build_receipt_document(recipient_info, orders, receipt_nb, total_price, date)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def start_word(new_instance: bool = False):
+    """Launches a Word application, that can be reused for several exports
+
+        Args:
+            new_instance (bool): launch a separate application instead of reusing the running one
+                (ex: one per worker thread)
+    """
+    # imported here: COM is only needed to export the receipts (not to render them, ex: in the render workers)
+    import win32com.client
+
+    if new_instance:
+        return win32com.client.DispatchEx('Word.Application')
+    return win32com.client.Dispatch('Word.Application')
+
+
+@contextmanager
+def word_in_thread():
+    """Runs a separate Word application for the current (worker) thread, and quits it at the end"""
+    import pythoncom
+
+    pythoncom.CoInitialize()
+    word = start_word(new_instance=True)
+    try:
+        yield word
+    finally:
+        word.Quit()
+        pythoncom.CoUninitialize()
+
+
+def export_receipt_to_pdf(docx_file_name, pdf_file_name, word=None):
+    """Exports the receipt to a PDF file
+
+        If a running Word application is given, it is used (and left open),
+        otherwise a new one is launched for this export only.
+    """
     wdFormatPDF = 17
 
-    word = win32com.client.Dispatch('Word.Application')
+    quit_word = word is None
+    if quit_word:
+        word = start_word()
     doc = word.Documents.Open(docx_file_name)
     doc.SaveAs(pdf_file_name, FileFormat=wdFormatPDF)
     doc.Close()
-    word.Quit()
+    if quit_word:
+        word.Quit()
+
+
+def convert_docx_to_pdf(docx_data: bytes, word=None) -> bytes:
+    """Converts a .docx receipt to pdf, from & to bytes
+
+        Word only converts files: they are written in a local temporary directory
+        (not in the receipts directory, which may be on a slow network share).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        docx_file_name = os.path.join(tmp_dir, "receipt.docx")
+        pdf_file_name = os.path.join(tmp_dir, "receipt.pdf")
+        with open(docx_file_name, "wb") as f:
+            f.write(docx_data)
+        export_receipt_to_pdf(docx_file_name, pdf_file_name, word)
+        with open(pdf_file_name, "rb") as f:
+            return f.read()
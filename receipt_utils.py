@@ -1,7 +1,11 @@
 import datetime as dt
 import os
 import json
-from typing import Set
+from typing import Dict, List, Optional, Set
+from xml.sax.saxutils import escape
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from docx.table import Table
 from dotenv import load_dotenv
 
 # loads environment variables from .env file
@@ -24,10 +28,19 @@ def get_asso_address(asso_name: str):
     return asso_data["official name"], asso_data["address"], asso_data["tresurer first name"], asso_data["tresurer mail"]
 
 
-def get_this_months_dir_name():
-    """Returns the name of the directory for this month"""
-    today = dt.date.today()
-    return today.strftime("%Y-%m")
+def get_this_months_dir_name(date: dt.date = None):
+    """Returns the name of the directory for this month (or for the month of the given date)"""
+    if date is None:
+        date = dt.date.today()
+    return date.strftime("%Y-%m")
+
+
+def parse_order_date(order_date: str) -> Optional[dt.date]:
+    """Returns the date written in the spreadsheet (ex: 05/01/2022), or None if it is not a valid date"""
+    try:
+        return dt.datetime.strptime(order_date.strip(), "%d/%m/%Y").date()
+    except (AttributeError, ValueError):
+        return None
 
 
 def get_receipt_name(dir_name, receipt_number):
@@ -37,7 +50,7 @@ def get_receipt_name(dir_name, receipt_number):
     return dir_name + "-" + str_number
 
 
-def get_receipt_number(sheet_receipts_names: Set[str], receipts_dir: str = RECEIPTS_PATH) -> str:
+def get_receipt_number(sheet_receipts_names: Set[str], receipts_dir: str = None, date: dt.date = None) -> str:
     """Checks how many receipts have been created this month (if any)
         and returns the number (/ name) of the next receipt to be done
 
@@ -45,12 +58,16 @@ def get_receipt_number(sheet_receipts_names: Set[str], receipts_dir: str = RECEI
 
         Args:
             sheet_receipts_names (Set[str]): the list of the names of the receipts written in the online sheet
+            receipts_dir (str): the directory containing one directory of receipts per month (RECEIPTS_PATH by default)
+            date (dt.date): date of the receipt, its month is used instead of this one (to invoice past orders)
     """
+    if receipts_dir is None:
+        receipts_dir = RECEIPTS_PATH
     # list all the receipts directories in the path
     month_dirs = os.listdir(receipts_dir)
 
     # get this month's directory name
-    todays_dir_name = get_this_months_dir_name()
+    todays_dir_name = get_this_months_dir_name(date)
     if todays_dir_name in month_dirs:
         # list the receipts already created
         receipt_files = os.listdir(os.path.join(receipts_dir, todays_dir_name))
@@ -64,7 +81,7 @@ def get_receipt_number(sheet_receipts_names: Set[str], receipts_dir: str = RECEI
         next_r_name = get_receipt_name(todays_dir_name, receipt_number)
     else:
         # create a new directory
-        os.mkdir(os.path.join(RECEIPTS_PATH, todays_dir_name))
+        os.mkdir(os.path.join(receipts_dir, todays_dir_name))
         print(f"Directory {todays_dir_name} created")
         # get the first receipt's name
         receipt_number = 1
@@ -82,21 +99,6 @@ def get_receipt_number(sheet_receipts_names: Set[str], receipts_dir: str = RECEI
 
 # receipt doc creation utility functions
 
-def make_rows_bold(*rows) -> None:
-    """Set text weight to bold for each cell of the input rows"""
-    for row in rows:
-        for cell in row.cells:
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.bold = True
-
-
-def set_col_width(col, width) -> None:
-    """Sets the width of a table's column by setting each cell's width """
-    for cell in col.cells:
-        cell.width = width
-
-
 def set_style(style, font_name: str, font_size, font_color: str, bold: bool = False):
     """Sets the style properties """
     font = style.font
@@ -104,3 +106,61 @@ def set_style(style, font_name: str, font_size, font_color: str, bold: bool = Fa
     font.size = font_size
     font.color.rgb = font_color
     font.bold = bold
+
+
+# tables built in one pass (for receipts & statements with many lines)
+
+# table style making the first (columns names) and last (total) rows bold
+TABLE_STYLE_ID = "ReceiptTable"
+TABLE_STYLE_XML = (
+    f'<w:style {nsdecls("w")} w:type="table" w:customStyle="1" w:styleId="{TABLE_STYLE_ID}">'
+    '<w:name w:val="Receipt Table"/>'
+    '<w:tblPr><w:tblCellMar><w:left w:w="108" w:type="dxa"/><w:right w:w="108" w:type="dxa"/></w:tblCellMar></w:tblPr>'
+    '<w:tblStylePr w:type="firstRow"><w:rPr><w:b/><w:bCs/></w:rPr></w:tblStylePr>'
+    '<w:tblStylePr w:type="lastRow"><w:rPr><w:b/><w:bCs/></w:rPr></w:tblStylePr>'
+    '</w:style>')
+
+
+def add_table_style(styles) -> None:
+    """Adds the table style used by build_table to the document styles (once)"""
+    if styles.element.get_by_id(TABLE_STYLE_ID) is None:
+        styles.element.append(parse_xml(TABLE_STYLE_XML))
+
+
+def build_table(document, rows: List[List[str]], widths: List, body_alignments: Dict[int, str] = None) -> Table:
+    """Adds a table to the document, generating its XML in one pass (instead of adding the rows & cells one by one)
+
+        The columns widths are set in the table grid (and written with each cell, as Word expects),
+        and the first and last rows are made bold by the table style (see add_table_style).
+
+        Args:
+            rows (List[List[str]]): the text of the cells, row by row (the first row contains the columns names)
+            widths (List[Length]): the width of each column (ex: Cm(3))
+            body_alignments (Dict[int, str]): the alignment ('left', 'center' or 'right') of some columns,
+                except in the first row
+    """
+    add_table_style(document.styles)
+    body_alignments = body_alignments or {}
+    paragraph_properties = {col: f'<w:pPr><w:jc w:val="{alignment}"/></w:pPr>' for col, alignment in body_alignments.items()}
+
+    xml = [f'<w:tbl {nsdecls("w")}><w:tblPr><w:tblStyle w:val="{TABLE_STYLE_ID}"/>'
+           '<w:tblW w:w="0" w:type="auto"/><w:tblLayout w:type="fixed"/>'
+           '<w:tblLook w:val="0060" w:firstRow="1" w:lastRow="1" w:firstColumn="0" w:lastColumn="0"'
+           ' w:noHBand="1" w:noVBand="1"/></w:tblPr><w:tblGrid>']
+    xml += [f'<w:gridCol w:w="{width.twips}"/>' for width in widths]
+    xml.append('</w:tblGrid>')
+    for i, row in enumerate(rows):
+        xml.append('<w:tr>')
+        for col, text in enumerate(row):
+            p_pr = paragraph_properties.get(col, "") if i > 0 else ""
+            run = f'<w:r><w:t xml:space="preserve">{escape(str(text))}</w:t></w:r>' if text != "" else ""
+            xml.append(f'<w:tc><w:tcPr><w:tcW w:w="{widths[col].twips}" w:type="dxa"/></w:tcPr><w:p>{p_pr}{run}</w:p></w:tc>')
+        xml.append('</w:tr>')
+    xml.append('</w:tbl>')
+
+    # (the empty table is added where python-docx adds tables, then its content is replaced)
+    table = document.add_table(0, len(widths))
+    for child in list(table._tbl):
+        table._tbl.remove(child)
+    table._tbl.extend(list(parse_xml("".join(xml))))
+    return table
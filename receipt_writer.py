@@ -0,0 +1,56 @@
+""" Writes the receipts files in the background, so that the (network) receipts share is not on the critical path.
+
+    The receipts are rendered & attached to the emails from memory: their files are only written once,
+    by a background thread, while the next receipts are rendered.
+"""
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import List
+
+
+def write_file(path: str, data: bytes) -> str:
+    """Writes a file atomically (a partially written receipt is never visible)"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ReceiptWriter():
+    def __init__(self, max_workers: int = 1) -> None:
+        """
+            Args:
+                max_workers (int) : number of files written at the same time
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="receipt-writer")
+        self.futures: List[Future] = []
+
+    def write(self, path: str, data: bytes) -> Future:
+        """Schedules the writing of a file and returns immediately"""
+        future = self.executor.submit(write_file, path, data)
+        self.futures.append(future)
+        return future
+
+    def flush(self) -> List[str]:
+        """Waits for all the scheduled files to be written and returns their paths.
+
+            Raises the first error that happened while writing them (once all of them are done).
+        """
+        futures, self.futures = self.futures, []
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def close(self) -> List[str]:
+        try:
+            return self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self) -> "ReceiptWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
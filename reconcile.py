@@ -0,0 +1,236 @@
+""" Reconciliation of a bank (or Lydia) statement with the receipts that are not paid yet.
+
+    The open receipts are indexed (hash tables) by receipt number and amount, then the statement is
+    read line by line and each credit is looked up in the indexes (a hash join):
+        - a credit whose reference contains receipt numbers pays them if the amounts match,
+        - otherwise it pays the only open receipt with the same amount whose beneficiary (or asso
+          official name) is the payer, or is written in the reference,
+    in both cases only if the credit is dated in the window following the order.
+    The payment method and date of all the matched receipts are written in one request.
+    The rows that may be credits but can not be read (amount or date) are reported, not skipped.
+
+    Usage:
+        python reconcile.py releve.csv                    # bank statement (Virement)
+        python reconcile.py export_lydia.csv -f lydia     # Lydia export (Lydia Pro)
+        python reconcile.py releve.csv --dry-run          # only shows the matches
+"""
+
+import argparse
+import csv
+import datetime as dt
+import re
+from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import pandas as pd
+
+import pricing
+from beneficiaries import normalize_name
+from retrieve import PAYMENT_METHODS, Retriever
+
+# columns of the statements exports (can be changed with the command line options)
+STATEMENT_FORMATS = {
+    "banque": {"method": "Virement", "sep": ";", "encoding": "utf-8-sig", "date": "Date", "amount": "Crédit",
+               "reference": "Libellé", "payer": None, "date_format": "%d/%m/%Y"},
+    "lydia": {"method": "Lydia Pro", "sep": ",", "encoding": "utf-8-sig", "date": "Date", "amount": "Montant",
+              "reference": "Message", "payer": "Nom", "date_format": "%d/%m/%Y"},
+}
+# a credit can pay an order up to this number of days after it
+DATE_WINDOW_DAYS = 120
+
+RECEIPT_NUMBER_PATTERN = re.compile(r"\d{4}-\d{2}-\d{4}")
+
+
+class Transaction(NamedTuple):
+    """A credit of the statement"""
+    line: int
+    date: dt.date
+    amount_cents: int
+    reference: str
+    payer: str
+
+
+class UnreadableRow(NamedTuple):
+    """A row of the statement that may be a credit, but whose amount or date can not be read"""
+    line: int
+    column: str
+    value: str
+
+
+class Match(NamedTuple):
+    transaction: Transaction
+    # sheet lines of the receipts paid by the transaction
+    lines: List[int]
+    # 'référence' (receipt numbers found in the reference) or 'montant & nom'
+    rule: str
+
+
+def parse_amount(amount: str) -> Optional[int]:
+    """Returns the number of cents of an amount of the statement, negative for a debit, or None if it can not be read.
+
+        The amounts can be signed, and have thousands separators (ex: '1.234,50', '1 234,50', '+12,00', '-12,00').
+    """
+    amount = re.sub(r"[\s€  ]", "", amount)
+    sign = -1 if amount.startswith("-") else 1
+    amount = amount[1:] if amount[:1] in ("+", "-") else amount
+    if "," in amount and "." in amount:
+        # the last separator is the decimal one
+        thousands_sep = "." if amount.rindex(",") > amount.rindex(".") else ","
+        amount = amount.replace(thousands_sep, "")
+    cents = pricing.parse_price(amount)
+    return None if cents is None else sign * cents
+
+
+def read_statement(path: str, statement_format: Dict, unreadable: List[UnreadableRow] = None) -> Iterator[Transaction]:
+    """Yields the credits of a statement file, one by one (the file is not loaded at once).
+
+        The rows that can not be read are added to the unreadable list (if given), only the debits are skipped.
+    """
+    unreadable = unreadable if unreadable is not None else []
+    with open(path, "r", encoding=statement_format["encoding"], newline="") as f:
+        for i, row in enumerate(csv.DictReader(f, delimiter=statement_format["sep"]), start=2):
+            raw_amount = (row.get(statement_format["amount"]) or "").strip()
+            # (the debits have an empty credit in the bank exports)
+            if not raw_amount:
+                continue
+            amount = parse_amount(raw_amount)
+            if amount is None:
+                unreadable.append(UnreadableRow(i, statement_format["amount"], raw_amount))
+                continue
+            # debits
+            if amount <= 0:
+                continue
+            raw_date = (row.get(statement_format["date"]) or "").strip()
+            try:
+                date = dt.datetime.strptime(raw_date, statement_format["date_format"]).date()
+            except ValueError:
+                unreadable.append(UnreadableRow(i, statement_format["date"], raw_date))
+                continue
+            payer = row.get(statement_format["payer"], "") if statement_format["payer"] else ""
+            yield Transaction(i, date, amount, row.get(statement_format["reference"], ""), payer)
+
+
+class OpenReceiptsIndex():
+    def __init__(self, orders: pd.DataFrame, asso_details: pd.DataFrame = None, window_days: int = DATE_WINDOW_DAYS) -> None:
+        """Indexes the receipts that are not paid yet.
+
+            Args:
+                orders (pd.DataFrame) : the orders of the spreadsheet
+                asso_details (pd.DataFrame) : the assos details (their official names are also used as payer names)
+                window_days (int) : number of days after the order during which it can be paid
+        """
+        self.window = dt.timedelta(days=window_days)
+        has_receipt = orders["№ facture"].notnull() & orders["№ facture"].ne("")
+        unpaid = ~orders["Encaissement"].isin(PAYMENT_METHODS)
+        open_receipts = orders[(orders["Type"] == "Prestation") & has_receipt & unpaid]
+
+        self.amounts = open_receipts["Prix total"].map(pricing.parse_price).to_dict()
+        self.dates = pd.to_datetime(open_receipts["Date"], format="%d/%m/%Y", errors="coerce").dt.date.to_dict()
+        self.by_number = {number: line for line, number in open_receipts["№ facture"].items()}
+        self.by_amount = defaultdict(set)
+        for line, amount in self.amounts.items():
+            self.by_amount[amount].add(line)
+
+        # names the payer may use: the beneficiary, and the official name of the assos
+        official_names = {}
+        if asso_details is not None:
+            official_names = {normalize_name(name): normalize_name(official) for name, official in asso_details["official name"].items()}
+        self.payer_names = {}
+        for line, name in open_receipts["Bénéficiaire"].items():
+            name = normalize_name(name)
+            self.payer_names[line] = {n for n in (name, official_names.get(name)) if n}
+        self.paid = set()
+
+    def __len__(self) -> int:
+        return len(self.by_number)
+
+    def can_be_paid_by(self, line: int, transaction: Transaction) -> bool:
+        order_date = self.dates.get(line)
+        in_window = order_date is None or pd.isnull(order_date) or order_date <= transaction.date <= order_date + self.window
+        return line not in self.paid and in_window
+
+    def match(self, transaction: Transaction) -> Optional[Match]:
+        """Returns the receipts paid by the transaction (and marks them as paid), or None"""
+        # receipt numbers written in the transfer reference
+        lines = [self.by_number[number] for number in set(RECEIPT_NUMBER_PATTERN.findall(transaction.reference))
+                 if number in self.by_number]
+        if lines and all(self.can_be_paid_by(line, transaction) for line in lines) \
+                and sum(self.amounts[line] or 0 for line in lines) == transaction.amount_cents:
+            return self.mark_paid(Match(transaction, sorted(lines), "référence"))
+
+        # same amount & payer name (only if there is no ambiguity)
+        payer = normalize_name(transaction.payer)
+        reference = f" {normalize_name(transaction.reference)} "
+        # (the names are never empty, so an empty payer never matches)
+        candidates = [line for line in self.by_amount.get(transaction.amount_cents, ())
+                      if self.can_be_paid_by(line, transaction)
+                      and any(name == payer or f" {name} " in reference for name in self.payer_names[line])]
+        if len(candidates) == 1:
+            return self.mark_paid(Match(transaction, candidates, "montant & nom"))
+        return None
+
+    def mark_paid(self, match: Match) -> Match:
+        self.paid.update(match.lines)
+        return match
+
+
+def reconcile(orders: pd.DataFrame, transactions: Iterator[Transaction], asso_details: pd.DataFrame = None,
+              window_days: int = DATE_WINDOW_DAYS) -> (List[Match], List[Transaction]):
+    """Returns the matches between the transactions and the open receipts, and the transactions not matched"""
+    index = OpenReceiptsIndex(orders, asso_details, window_days)
+    matches, unmatched = [], []
+    for transaction in transactions:
+        match = index.match(transaction)
+        if match is not None:
+            matches.append(match)
+        else:
+            unmatched.append(transaction)
+    return matches, unmatched
+
+
+def get_payments_values(matches: List[Match], method: str) -> Dict[str, Dict[int, str]]:
+    """Returns the cells to write in the spreadsheet for the matched receipts (by column, then line)"""
+    values = {"Encaissement": {}, "Date encaissement": {}}
+    for match in matches:
+        for line in match.lines:
+            values["Encaissement"][line] = method
+            values["Date encaissement"][line] = match.transaction.date.strftime("%d/%m/%Y")
+    return values
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("statement", help="Path of the statement (csv).", type=str)
+    parser.add_argument("-f", "--format", help="Format of the statement.", choices=list(STATEMENT_FORMATS), default="banque")
+    parser.add_argument("--window", help="Number of days after the order during which it can be paid.",
+                        type=int, default=DATE_WINDOW_DAYS)
+    parser.add_argument("--dry-run", help="Only show the matches, without writing them in the spreadsheet.",
+                        action='store_true')
+    for option in ["sep", "date", "amount", "reference", "payer"]:
+        parser.add_argument(f"--{option}", help=f"Statement '{option}' (column name or separator).", type=str)
+    args = parser.parse_args()
+
+    statement_format = dict(STATEMENT_FORMATS[args.format])
+    statement_format.update({option: getattr(args, option) for option in ["sep", "date", "amount", "reference", "payer"]
+                             if getattr(args, option) is not None})
+
+    retriever = Retriever()
+    unreadable = []
+    matches, unmatched = reconcile(retriever.orders, read_statement(args.statement, statement_format, unreadable),
+                                   retriever.asso_details, args.window)
+    for match in matches:
+        t = match.transaction
+        numbers = ", ".join(retriever.orders.loc[match.lines, "№ facture"])
+        print(f"{t.date:%d/%m/%Y}  {pricing.format_price(t.amount_cents):>10}  {numbers}  ({match.rule}) {t.reference}")
+    print(f"\n{sum(len(m.lines) for m in matches)} facture(s) payée(s), {len(unmatched)} crédit(s) non rapproché(s).")
+    for t in unmatched:
+        print(f" - ligne {t.line} : {t.date:%d/%m/%Y} {pricing.format_price(t.amount_cents)} {t.payer} {t.reference}")
+    if unreadable:
+        print(f"\n{len(unreadable)} ligne(s) du relevé illisible(s), à rapprocher à la main :")
+        for row in unreadable:
+            print(f" - ligne {row.line} : {row.column} '{row.value}'")
+
+    if matches and not args.dry_run:
+        retriever.write_columns(get_payments_values(matches, statement_format["method"]))
+        print("Encaissements enregistrés dans le tableur.")
@@ -0,0 +1,81 @@
+""" Renders the receipts (.docx) in a pool of processes, to use all the cores.
+
+    Building a receipt with python-docx is pure-Python XML manipulation (CPU-bound): rendering
+    hundreds of receipts in the main process only uses one core. Each worker builds the receipt
+    template (styles, logo...) once when it starts, then only receives small job descriptors
+    and sends back the rendered bytes (or writes them and sends back the path).
+"""
+
+import datetime as dt
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import receipt_creation as rc
+from receipt_writer import write_file
+
+# below this number of receipts, starting the workers takes longer than rendering them in the main process
+MIN_POOL_RECEIPTS = 20
+
+
+class RenderJob(NamedTuple):
+    """What a worker needs to render one receipt"""
+    recipient_info: str
+    orders: List[Dict]
+    receipt_nb: str
+    total_price: str
+    date: Optional[dt.date] = None
+    # if given, the receipt is written there and its path is returned instead of its content
+    path: Optional[str] = None
+
+
+def warm_up(initializer: Callable = None, initargs: Tuple = ()) -> None:
+    """Builds the receipt template once per worker (the first receipt should not pay for it).
+
+        The initializer is called first: the workers are spawned on Windows, they do not inherit
+        the state of the main process (ex: values patched by the tests).
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    try:
+        rc.get_receipt_template()
+    except Exception:
+        # a failing initializer breaks the whole pool: the error is raised again (with its message) by the jobs
+        pass
+
+
+def render_job(job: RenderJob) -> Union[bytes, str]:
+    """Renders a receipt, returns its content (or its path if the job has one)"""
+    docx_data = rc.render_receipt_docx(job.recipient_info, job.orders, job.receipt_nb, job.total_price, job.date)
+    if job.path is not None:
+        return write_file(job.path, docx_data)
+    return docx_data
+
+
+class RenderService():
+    def __init__(self, max_workers: int = None, initializer: Callable = None, initargs: Tuple = (), mp_context=None) -> None:
+        """
+            Args:
+                max_workers (int) : number of worker processes (the number of cores by default)
+                initializer (Callable) : called with initargs in each worker, before the template is built
+                mp_context : multiprocessing context of the workers (the platform's default if None)
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context,
+                                            initializer=warm_up, initargs=(initializer, initargs))
+
+    def submit(self, job: RenderJob) -> Future:
+        return self.executor.submit(render_job, job)
+
+    def submit_all(self, jobs: Iterable[RenderJob]) -> List[Future]:
+        """Submits all the jobs at once, returns their futures in the same order"""
+        return [self.submit(job) for job in jobs]
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self) -> "RenderService":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -4,8 +4,9 @@
 import os
 import re
 import string
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
 import json
+import hashlib
 
 import pandas as pd
 from dotenv import load_dotenv
@@ -16,6 +17,9 @@ from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from pyparsing import Optional
 
+from archive import CHUNK_SIZE, Archive
+from beneficiaries import AUTO_MERGE_SCORE, BeneficiaryIndex, normalize_name
+
 
 load_dotenv(encoding='utf8')
 
@@ -25,7 +29,18 @@ SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 # data ranges (the columns names span between A2 and R2)
 FEATURES_LINE_RANGE = 'A2:R2'
 ALL_RANGE = "A:S" 
+HEADER_RANGE = "A2:S2"
+# range used to count the order lines cheaply (the date is only filled out if there is an order)
+ROW_COUNT_RANGE = "A:A"
+# number of lines at the end of the sheet used to detect changes
+TAIL_SIZE = 50
+
+PAYMENT_METHODS = ['Virement', 'Lydia Pro', 'Chèque']
 
+# valid email addresses
+EMAIL_PATTERN = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
+
+ASSO_DETAILS_PATH = "associations_addresses.json"
 ASSO_DETAILS_FEATURES = ['official name', 'address', 'tresurer first name', 'tresurer mail']
 
 
@@ -53,37 +68,119 @@ def connect_to_spreadsheet(scopes=SCOPES):
     return creds
 
 
+def get_open_range(first_line: int) -> str:
+    """Returns the range of the lines of the spreadsheet starting from the given line"""
+    first_col, last_col = ALL_RANGE.split(":")
+    return f"{first_col}{first_line}:{last_col}"
+
+
+def build_orders_frame(columns: List[str], lines: List[List[str]], first_line: int = 3) -> pd.DataFrame:
+    """Converts the values of the lines of the spreadsheet to a DataFrame indexed by the online line numbers"""
+    # the API omits the empty cells at the end of the lines
+    nb_columns = len(columns)
+    lines = [line[:nb_columns] + [""] * (nb_columns - len(line)) for line in lines]
+    df = pd.DataFrame(lines, columns=columns)
+    # set the index to the online one
+    df.index += first_line
+    return df
+
+
 class Retriever():
-    def __init__(self) -> None:
-        self.creds = connect_to_spreadsheet(SCOPES)
-        self.fetch_orders_data(self.creds)
+    def __init__(self, archive: Archive = None, backend = None, asso_details_path: str = ASSO_DETAILS_PATH,
+                 source = None, unprocessed_only: bool = False) -> None:
+        """
+            Args:
+                archive (Archive) : archive of the closed lines (not fetched)
+                backend : object replacing the Google Sheets service (ex: sheets_backend.InMemorySheetsBackend),
+                    no authentication is done if it is given
+                asso_details_path (str) : path of the json file containing the assos details
+                source (order_sources.OrderSource) : local source of the orders (csv, xlsx, SQLite),
+                    read instead of the spreadsheet
+                unprocessed_only (bool) : only load the unprocessed orders of the source
+        """
+        self.archive = archive if archive is not None else Archive()
+        self.asso_details_path = asso_details_path
+        self.source = source
+        if source is not None:
+            self.creds = None
+            self.orders = source.fetch_orders(unprocessed_only)
+        else:
+            if backend is not None:
+                self.creds = None
+                self.spreadsheet = backend.spreadsheets()
+            else:
+                self.creds = connect_to_spreadsheet(SCOPES)
+            self.fetch_orders_data(self.creds)
         self.fetch_asso_details()
 
     def fetch_orders_data(self, creds) -> pd.DataFrame:
         """Returns all the orders data as a panda Dataframe
         """
-        # fetch the spreadsheet object
-        service = build('sheets', 'v4', credentials=creds)
-        self.spreadsheet = service.spreadsheets()
+        # fetch the spreadsheet object (only once, service discovery is slow)
+        if getattr(self, "spreadsheet", None) is None:
+            service = build('sheets', 'v4', credentials=creds)
+            self.spreadsheet = service.spreadsheets()
 
         # fetch the data & convert it to a panda Dataframe
-        data = self.spreadsheet.values().get(spreadsheetId=SPREADSHEET_ID,
-                        range=ALL_RANGE).execute()['values']
-        df = pd.DataFrame(data[2:], columns=data[1])
-        # set the index to the online one
-        df.index += 3
+        first_line = self.archive.first_open_line
+        if first_line <= 3:
+            data = self.spreadsheet.values().get(spreadsheetId=SPREADSHEET_ID,
+                            range=ALL_RANGE).execute()['values']
+            df = build_orders_frame(data[1], data[2:])
+        else:
+            # the lines above first_line are archived: only fetch the columns names & the open lines
+            header, lines = self.spreadsheet.values().batchGet(spreadsheetId=SPREADSHEET_ID,
+                            ranges=[HEADER_RANGE, get_open_range(first_line)]).execute()['valueRanges']
+            df = build_orders_frame(header['values'][0], lines.get('values', []), first_line)
 
         # later : remove empty lines at the end 
         self.orders = df
         return self.orders
 
+    def fetch_sheet_signature(self, tail_size: int = TAIL_SIZE) -> Tuple[int, str]:
+        """Returns a cheap signature of the sheet: its number of lines & a hash of its last lines.
+
+            Used to detect changes without downloading the whole sheet.
+        """
+        nb_lines = len(self.spreadsheet.values().get(spreadsheetId=SPREADSHEET_ID,
+                        range=ROW_COUNT_RANGE).execute().get('values', []))
+        first_tail_line = max(3, nb_lines - tail_size + 1)
+        tail_range = f"{ALL_RANGE[0]}{first_tail_line}:{ALL_RANGE[-1]}{nb_lines}"
+        tail = self.spreadsheet.values().get(spreadsheetId=SPREADSHEET_ID,
+                        range=tail_range).execute().get('values', [])
+        tail_hash = hashlib.sha1(json.dumps(tail).encode('utf-8')).hexdigest()
+        return nb_lines, tail_hash
+
     def fetch_asso_details(self) -> pd.DataFrame:
-        with open("associations_addresses.json", "r", encoding='utf-8') as f:
+        with open(self.asso_details_path, "r", encoding='utf-8') as f:
             data_dict = json.load(f)
         # convert to df (later : store as csv instead of json)
         self.asso_details = pd.DataFrame([data_dict[a].values() for a in data_dict], columns=ASSO_DETAILS_FEATURES, index=data_dict.keys())
+        # index used to match the beneficiaries names with the known assos (built once per run)
+        self.beneficiaries = BeneficiaryIndex(self.asso_details.index)
+        # beneficiaries names merged with a known asso, filled by filter_unknown_assos
+        self.merged_names = {}
         return self.asso_details
 
+    def fetch_lines_status(self, lines: List[int], columns: List[str] = ("№ facture", "Encaissement")) -> pd.DataFrame:
+        """Reads again (with one request) the given columns of the given lines, and updates the orders with them.
+
+            Used to check that orders were not invoiced or paid since the orders were fetched
+            (the sheet signature only covers its last lines). Returns the updated lines.
+        """
+        if self.source is not None or not len(lines):
+            return self.orders.loc[lines]
+        col_letters = {col: string.ascii_uppercase[self.orders.columns.to_list().index(col)] for col in columns}
+        ranges = [f"{col_letters[col]}{line}" for line in lines for col in columns]
+        value_ranges = self.spreadsheet.values().batchGet(spreadsheetId=SPREADSHEET_ID,
+                            ranges=ranges).execute()['valueRanges']
+        values = iter(value_ranges)
+        for line in lines:
+            for col in columns:
+                cell = next(values).get('values', [[""]])
+                self.orders.loc[line, col] = cell[0][0] if cell and cell[0] else ""
+        return self.orders.loc[lines]
+
     def get_unprocessed_orders(self, orders = None) -> pd.DataFrame:
         """Returns a DataFrame containing only the service (='prestations') lines that are either unpaid or that don't have any receipts
         """
@@ -93,37 +190,155 @@ class Retriever():
         # get boolean series corresponding to 
         presta_orders = orders["Type"] == "Prestation"
         orders_wo_receipt =  orders["№ facture"].isnull() | orders["№ facture"].eq("")
-        unpaid_orders = ~ orders["Encaissement"].isin(['Virement','Lydia Pro', 'Chèque'])
+        unpaid_orders = ~ orders["Encaissement"].isin(PAYMENT_METHODS)
 
         return orders[presta_orders & orders_wo_receipt & unpaid_orders]
 
-    def filter_unknown_assos(self, orders:pd.DataFrame) -> pd.DataFrame:
+    def get_closed_orders_mask(self, orders = None) -> pd.Series:
+        """Returns a boolean series, True for the lines that will not change anymore:
+            services (='prestations') with a receipt & a payment, and other filled out lines (expenses...)
+        """
+        if orders is None:
+            orders = self.orders
+
+        filled_lines = orders["Date"].notnull() & orders["Date"].ne("")
+        presta_orders = orders["Type"] == "Prestation"
+        has_receipt = orders["№ facture"].notnull() & orders["№ facture"].ne("")
+        paid_orders = orders["Encaissement"].isin(PAYMENT_METHODS)
+
+        return filled_lines & (~presta_orders | (has_receipt & paid_orders))
+
+    def archive_closed_orders(self) -> int:
+        """Moves to the archive the closed lines that are above the first open line,
+            so that they are not fetched anymore. Returns the number of archived lines.
+        """
+        closed = self.get_closed_orders_mask()
+        open_lines = self.orders.index[~closed]
+        first_open_line = open_lines.min() if len(open_lines) else self.orders.index.max() + 1
+        to_archive = self.orders[self.orders.index < first_open_line]
+        if to_archive.empty:
+            return 0
+
+        # the year of the receipt, or of the order date for the lines without receipt
+        years = to_archive["№ facture"].fillna("").str.extract(r"^(\d{4})-", expand=False)
+        dates_years = pd.to_datetime(to_archive["Date"], dayfirst=True, errors="coerce").dt.year
+        years = years.fillna(dates_years.map(lambda y: str(int(y)) if pd.notnull(y) else "inconnu"))
+
+        self.archive.add(to_archive, years, first_open_line)
+        self.orders = self.orders[self.orders.index >= first_open_line]
+        return len(to_archive)
+
+    def get_history(self, years: List[str] = None) -> pd.DataFrame:
+        """Returns the archived lines (of the given years, or all of them) followed by the fetched ones.
+
+            The archive is only read when this is called.
+        """
+        archived = self.archive.load(years)
+        if archived.empty:
+            return self.orders
+        return pd.concat([archived, self.orders])
+
+    def iter_history_chunks(self, years: List[str] = None, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yields the archived lines (of the given years, or all of them) then the fetched ones, by chunks.
+
+            Unlike get_history, the archive is never loaded at once.
+        """
+        yield from self.archive.iter_chunks(years, chunk_size)
+        for start in range(0, len(self.orders), chunk_size):
+            yield self.orders.iloc[start:start + chunk_size]
+
+    def get_receipt_numbers(self, years: List[str] = None) -> set:
+        """Returns the receipt numbers already used (fetched, or archived in the given years: this year by default)"""
+        if years is None:
+            years = [str(pd.Timestamp.today().year)]
+        archived = self.archive.load(years)
+        receipt_numbers = set(self.orders["№ facture"].unique())
+        if self.source is not None:
+            # the loaded orders may only be the unprocessed ones
+            receipt_numbers.update(self.source.fetch_receipt_numbers())
+        if not archived.empty:
+            receipt_numbers.update(archived["№ facture"].unique())
+        return receipt_numbers
+
+    def filter_unknown_assos(self, orders:pd.DataFrame, auto_merge: bool = False, min_score: float = AUTO_MERGE_SCORE) -> pd.DataFrame:
         """Drops the order lines of assos for which we don't know the information.
 
+            Names are compared once normalized (case, accents, spaces).
+
             Args:
                 orders (pd.DataFrame) : dataframe containing associations orders data
+                auto_merge (bool) : also keep the names whose closest known asso has a score of at least min_score
         """
-        known_assos = self.asso_details.index.tolist()
-        orders_assos = orders['Bénéficiaire'].str.lower()
+        resolved = self.beneficiaries.resolve_all(orders['Bénéficiaire'], auto_merge, min_score)
+        self.merged_names.update((name, asso) for name, asso in resolved.items() if asso is not None)
+
+        return orders[orders['Bénéficiaire'].map(resolved).notnull()]
 
-        return orders[orders_assos.isin(known_assos)]
+    def get_unknown_assos(self, orders:pd.DataFrame) -> pd.DataFrame:
+        """Returns the assos names of the orders that are not known, with the closest known asso and its score.
+
+            Args:
+                orders (pd.DataFrame) : dataframe containing associations orders data
+        """
+        unknown_names = [name for name, asso in self.beneficiaries.resolve_all(orders['Bénéficiaire']).items() if asso is None]
+        suggestions = []
+        for name in sorted(unknown_names):
+            closest = self.beneficiaries.suggest(name)
+            suggestions.append((name, *(closest[0] if closest else (None, 0.0))))
+        return pd.DataFrame(suggestions, columns=["name", "suggestion", "score"])
 
     def filter_invalid_mails(self, orders:pd.DataFrame) -> pd.DataFrame:
         """Returns the orders dataframe with only the lines that have valid email addresses.
         """
         # use a regular expression to match valid email addresses
-        pattern=r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-        return orders[orders['Contact eventuel'].map(lambda i: bool(re.match(pattern, i)))]
+        # (the mask is boolean even when there is no order)
+        return orders[orders['Contact eventuel'].map(lambda i: bool(re.match(EMAIL_PATTERN, i))).astype(bool)]
 
     def filter_by_client_type(self, orders:pd.DataFrame, recipient_type:Literal["Asso", "Inté", "Exté"]) -> pd.DataFrame:
         """Returns the orders dataframe with only the lines that have the given recipient type.
         """
         return orders[orders["Inté / Exté"] == recipient_type]
 
+    def get_recipient_key(self, name: str, recipient_type: str = "Asso") -> str:
+        """Returns the key identifying a recipient: its known asso (merged names included) for an asso,
+            its normalized name otherwise (or if the asso is unknown)
+        """
+        asso = (self.merged_names.get(name) or self.beneficiaries.match(name)) if recipient_type == "Asso" else None
+        return f"asso:{asso}" if asso is not None else normalize_name(name)
+
+    def get_recipient_keys(self, orders:pd.DataFrame) -> pd.Series:
+        """Returns the recipient key of each order (see get_recipient_key)"""
+        return pd.Series([self.get_recipient_key(name, recipient_type) for name, recipient_type
+                          in zip(orders["Bénéficiaire"].fillna("").astype(str), orders["Inté / Exté"])],
+                         index=orders.index, dtype=object)
+
+    def group_by_recipient(self, orders:pd.DataFrame) -> List[Tuple[str, pd.DataFrame]]:
+        """Returns the orders of each recipient (in the order of their first order), with the first name written for it.
+
+            The names of the same asso ('BDE ', 'B.D.E' merged with 'bde'...), or equal once normalized,
+            are the same recipient (one email).
+        """
+        return [(recip_orders["Bénéficiaire"].iloc[0], recip_orders)
+                for _, recip_orders in orders.groupby(self.get_recipient_keys(orders), sort=False)]
+
     def filter_by_recipient_name(self, orders:pd.DataFrame, name:str) -> pd.DataFrame:
-        """Returns the orders dataframe with only the lines that correspond to the given recipient.
+        """Returns the orders dataframe with only the lines that correspond to the given recipient
+            (same asso, or same name once normalized).
         """
-        return orders[orders["Bénéficiaire"].str.lower() == name.lower()]
+        name_keys = {self.get_recipient_key(name, "Asso"), normalize_name(name)}
+        return orders[self.get_recipient_keys(orders).isin(name_keys)]
+
+    def get_orders_by_month(self, orders:pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Returns the orders grouped by the month of their date (ex: '2022-03'), in chronological order.
+
+            The orders whose date is not valid are grouped under None.
+        """
+        dates = pd.to_datetime(orders["Date"], format="%d/%m/%Y", errors="coerce")
+        months = dates.dt.strftime("%Y-%m").where(dates.notnull(), None)
+        by_month = {month: orders[months == month] for month in sorted(months.dropna().unique())}
+        if months.isnull().any():
+            by_month[None] = orders[months.isnull()]
+        return by_month
 
     def get_asso_details(self, name:str) -> pd.Series:
         """Returns the details of an association.
@@ -131,18 +346,23 @@ class Retriever():
             Args:
                 name (str) : name of the association
         """
-        if name.lower() in self.asso_details.index:
-            return self.asso_details.loc[name.lower(), ASSO_DETAILS_FEATURES]
-        
+        asso = self.merged_names.get(name) or self.beneficiaries.match(name)
+        if asso is not None:
+            return self.asso_details.loc[asso, ASSO_DETAILS_FEATURES]
+
         raise Exception(f"{name} not found in the list of associations")
 
     def write_receipt_number(self, receipt_nb: str, line: int) -> None:
-        """Writes the receipt number in the spreadsheet.
+        """Writes the receipt number in the spreadsheet (or in the order source).
 
             Args:
                 receipt_nb (str) : the receipt number
                 line (int) : the line number
         """
+        if self.source is not None:
+            self.source.write_receipt_number(receipt_nb, line)
+            self.orders.loc[line, "№ facture"] = receipt_nb
+            return
         receipt_col_letter = string.ascii_uppercase[self.orders.columns.to_list().index('№ facture')]
         receipt_nb_cell_id = f"{receipt_col_letter}{line}"
         self.spreadsheet.values().update(spreadsheetId=SPREADSHEET_ID,
@@ -150,6 +370,36 @@ class Retriever():
                             valueInputOption="RAW",
                             body={"values": [[receipt_nb]]}).execute()
 
+    def write_receipt_numbers(self, receipts: Dict[int, str]) -> None:
+        """Writes several receipt numbers in the spreadsheet with a single request.
+
+            Args:
+                receipts (Dict[int, str]) : the receipt number of each line
+        """
+        if not receipts:
+            return
+        if self.source is not None:
+            for line, receipt_nb in receipts.items():
+                self.write_receipt_number(receipt_nb, line)
+            return
+        self.write_columns({"№ facture": receipts})
+
+    def write_columns(self, values: Dict[str, Dict[int, str]]) -> None:
+        """Writes cells of several columns in the spreadsheet with a single request.
+
+            Args:
+                values (Dict[str, Dict[int, str]]) : for each column name, the value of each line
+        """
+        if self.source is not None:
+            raise Exception("Only the receipt numbers can be written in a local order source")
+        data = []
+        for col_name, col_values in values.items():
+            col_letter = string.ascii_uppercase[self.orders.columns.to_list().index(col_name)]
+            data += [{"range": f"{col_letter}{line}", "values": [[value]]} for line, value in col_values.items()]
+        if not data:
+            return
+        self.spreadsheet.values().batchUpdate(spreadsheetId=SPREADSHEET_ID,
+                            body={"valueInputOption": "RAW", "data": data}).execute()
 
 if __name__ == "__main__":
     r = Retriever()
@@ -0,0 +1,170 @@
+""" In-memory implementation of the (small) part of the Google Sheets API used by this project.
+
+    It can replace the object returned by `build('sheets', 'v4', ...)` in the Retriever and the
+    spreadsheet_utils functions, to run them without network (tests, benchmarks...). It can also
+    simulate the API latency and quota errors.
+"""
+
+import csv
+import re
+import threading
+import time
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+A1_CELL_PATTERN = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+def column_index(letters: str) -> int:
+    """Returns the index of a column from its letters (A -> 0, Z -> 25, AA -> 26...)"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def parse_a1_range(a1_range: str) -> Tuple[int, int, Optional[int], Optional[int]]:
+    """Returns the first row, first column, last row & last column (0-based, None if unbounded) of a range
+
+        ex: 'A:S' -> (0, 0, None, 18), 'C5' -> (4, 2, 4, 2), 'Feuille 1'!A3:S -> (2, 0, None, 18)
+    """
+    a1_range = a1_range.split("!")[-1]
+    start, _, end = a1_range.partition(":")
+    end = end or start
+    start_col, start_row = A1_CELL_PATTERN.match(start).groups()
+    end_col, end_row = A1_CELL_PATTERN.match(end).groups()
+    return (int(start_row) - 1 if start_row else 0,
+            column_index(start_col) if start_col else 0,
+            int(end_row) - 1 if end_row else None,
+            column_index(end_col) if end_col else None)
+
+
+def trim_values(values: List[List[str]]) -> List[List[str]]:
+    """Removes the empty cells at the end of the rows, and the empty rows at the end (like the API)"""
+    trimmed = []
+    for row in values:
+        row = list(row)
+        while row and row[-1] in ("", None):
+            row.pop()
+        trimmed.append(row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+class QuotaError(HttpError):
+    """Error raised when the simulated quota is exceeded (same as the API: HTTP 429)"""
+
+    def __init__(self) -> None:
+        super().__init__(httplib2.Response({"status": 429}), b"Quota exceeded for quota metric 'Read requests'")
+
+
+class InMemoryRequest():
+    """Request returned by the values() methods, executed with execute() like the API ones"""
+
+    def __init__(self, backend: "InMemorySheetsBackend", method: str, function) -> None:
+        self.backend = backend
+        self.method = method
+        self.function = function
+
+    def execute(self):
+        return self.backend.execute(self.method, self.function)
+
+
+class InMemoryValues():
+    def __init__(self, backend: "InMemorySheetsBackend") -> None:
+        self.backend = backend
+
+    def get(self, spreadsheetId: str = None, range: str = None, **kwargs) -> InMemoryRequest:
+        return InMemoryRequest(self.backend, "get", lambda: self.backend.get_range(range))
+
+    def batchGet(self, spreadsheetId: str = None, ranges: List[str] = (), **kwargs) -> InMemoryRequest:
+        return InMemoryRequest(self.backend, "batchGet", lambda: {
+            "spreadsheetId": spreadsheetId,
+            "valueRanges": [self.backend.get_range(data_range) for data_range in ranges]})
+
+    def update(self, spreadsheetId: str = None, range: str = None, valueInputOption: str = None,
+               body: dict = None, **kwargs) -> InMemoryRequest:
+        return InMemoryRequest(self.backend, "update", lambda: self.backend.set_range(range, body["values"]))
+
+    def batchUpdate(self, spreadsheetId: str = None, body: dict = None, **kwargs) -> InMemoryRequest:
+        def batch_update():
+            responses = [self.backend.set_range(data["range"], data["values"]) for data in body["data"]]
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                    "responses": responses}
+        return InMemoryRequest(self.backend, "batchUpdate", batch_update)
+
+
+class InMemorySheetsBackend():
+    def __init__(self, values: List[List[str]] = None, latency: float = 0.0, max_requests_per_minute: int = None) -> None:
+        """
+            Args:
+                values (List[List[str]]) : the content of the sheet, one list per line (starting at line 1)
+                latency (float) : time taken by each request (in seconds)
+                max_requests_per_minute (int) : quota of requests, QuotaError is raised above it
+        """
+        self.cells = [list(row) for row in (values or [])]
+        self.latency = latency
+        self.max_requests_per_minute = max_requests_per_minute
+        # number of requests executed, by method
+        self.calls = Counter()
+        self.requests_times = []
+        self.nb_failures_to_simulate = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_csv(cls, path: str, **kwargs) -> "InMemorySheetsBackend":
+        """Returns a backend whose sheet content is read from a csv file (one line per sheet line)"""
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return cls(list(csv.reader(f)), **kwargs)
+
+    def spreadsheets(self) -> "InMemorySheetsBackend":
+        """Same as service.spreadsheets() for the API"""
+        return self
+
+    def values(self) -> InMemoryValues:
+        return InMemoryValues(self)
+
+    def fail_next_requests(self, nb_requests: int = 1) -> None:
+        """The next requests will raise a QuotaError"""
+        self.nb_failures_to_simulate = nb_requests
+
+    def execute(self, method: str, function):
+        """Executes a request, simulating the latency & quota"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[method] += 1
+            now = time.monotonic()
+            self.requests_times = [t for t in self.requests_times if t > now - 60] + [now]
+            if self.nb_failures_to_simulate > 0:
+                self.nb_failures_to_simulate -= 1
+                raise QuotaError()
+            if self.max_requests_per_minute is not None and len(self.requests_times) > self.max_requests_per_minute:
+                raise QuotaError()
+            return function()
+
+    def get_range(self, a1_range: str) -> dict:
+        first_row, first_col, last_row, last_col = parse_a1_range(a1_range)
+        rows = self.cells[first_row:None if last_row is None else last_row + 1]
+        values = trim_values([row[first_col:None if last_col is None else last_col + 1] for row in rows])
+        response = {"range": a1_range, "majorDimension": "ROWS"}
+        if values:
+            response["values"] = values
+        return response
+
+    def set_range(self, a1_range: str, values: List[List[str]]) -> dict:
+        first_row, first_col, _, _ = parse_a1_range(a1_range)
+        for i, row_values in enumerate(values):
+            while len(self.cells) <= first_row + i:
+                self.cells.append([])
+            row = self.cells[first_row + i]
+            for j, value in enumerate(row_values):
+                while len(row) <= first_col + j:
+                    row.append("")
+                row[first_col + j] = value
+        return {"updatedRange": a1_range, "updatedRows": len(values),
+                "updatedCells": sum(len(row) for row in values)}
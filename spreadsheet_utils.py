@@ -1,11 +1,19 @@
 import os
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator
+import codecs
+import contextlib
+import json
+import re
 import string
+from urllib.parse import quote
 from dotenv import load_dotenv
+import pandas as pd
+
+import pricing
 
 # loads environment variables from .env file
 load_dotenv(encoding='utf8')
@@ -18,12 +26,13 @@ SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 FEATURES_LINE_RANGE = 'A2:R2'
 ALL_RANGE = "A:S"
 
-# CSD services
-SERVICES_DATA = [{"designation": "Impression affiche A1", "price": 4.0},
-                 {"designation": "Impression affiche A2", "price": 2.0},
-                 {"designation": "Impression affiche A3", "price": 1.0},
-                 {"designation": "Impression sticker", "price": 0.15},
-                 {"designation": "Impression t-shirt", "price": 6.0}, ]
+SHEETS_API_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+# size of the chunks read from the API response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# columns used to generate the receipts
+ORDER_COLUMNS = ["Date", "Type", "Inté / Exté", "Bénéficiaire", "Contact eventuel", "Description",
+                 "A1", "A2", "A3", "Sticker", "T-shirt", "Prix total", "№ facture", "Encaissement"]
 
 
 def connect_to_spreadsheet(scopes=SCOPES):
@@ -50,8 +59,13 @@ def connect_to_spreadsheet(scopes=SCOPES):
     return creds
 
 
-def get_spreadsheet(creds):
-    """Returns the spreadsheet object"""
+def get_spreadsheet(creds, backend=None):
+    """Returns the spreadsheet object
+
+        If a backend is given (ex: sheets_backend.InMemorySheetsBackend), it is used instead of the API.
+    """
+    if backend is not None:
+        return backend.spreadsheets()
     service = build('sheets', 'v4', credentials=creds)
     sheet = service.spreadsheets()
     return sheet
@@ -59,45 +73,124 @@ def get_spreadsheet(creds):
 
 # data fetching
 
-def fetch_all_data(sheet, column_idx: Dict[str, int]) -> List[Dict[str, str]]:
+class OrderLine():
+    """Compact representation of a line of the spreadsheet (only the ORDER_COLUMNS values are kept).
+
+        Its values are accessed like a dictionary: line['Bénéficiaire'], line['line']...
+    """
+    __slots__ = ("line", "values")
+    _positions = {col_name: i for i, col_name in enumerate(ORDER_COLUMNS)}
+
+    def __init__(self, line: int, values: tuple) -> None:
+        self.line = line
+        self.values = values
+
+    def __getitem__(self, key: str) -> str:
+        if key == "line":
+            return self.line
+        return self.values[self._positions[key]]
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> List[str]:
+        return ["line"] + ORDER_COLUMNS
+
+    def to_dict(self) -> Dict[str, str]:
+        return {key: self[key] for key in self.keys()}
+
+    def __repr__(self) -> str:
+        return f"OrderLine({self.to_dict()})"
+
+
+def iter_values_rows(chunks: Iterable[bytes]) -> Iterator[List[str]]:
+    """Yields the rows of the 'values' array of a Sheets API response, as soon as they are received.
+
+    Args:
+        chunks (Iterable[bytes]): the response body, in chunks of any size
+    """
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    values_key = re.compile(r'"values"\s*:\s*\[')
+    buffer = ""
+    in_values = False
+
+    for chunk in chunks:
+        buffer += utf8_decoder.decode(chunk)
+        pos = 0
+        if not in_values:
+            match = values_key.search(buffer)
+            if match is None:
+                continue
+            in_values = True
+            pos = match.end()
+
+        while True:
+            # skip the separators between rows
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                row, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # the row is not complete yet
+                break
+            yield row
+        buffer = buffer[pos:]
+
+
+def stream_values(creds, data_range: str = ALL_RANGE, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[List[str]]:
+    """Yields the rows of a range of the spreadsheet while they are downloaded"""
+    url = f"{SHEETS_API_URL}/{SPREADSHEET_ID}/values/{quote(data_range)}"
+    with AuthorizedSession(creds).get(url, stream=True) as response:
+        response.raise_for_status()
+        yield from iter_values_rows(response.iter_content(chunk_size))
+
+
+def iter_order_lines(rows: Iterable[List[str]], column_idx: Dict[str, int]) -> Iterator[OrderLine]:
+    """Converts the rows of the spreadsheet to OrderLine, and stops at the first line without date
+
+    Args:
+        rows (Iterable[List[str]]): all the rows of the spreadsheet, including the title & columns names
+        column_idx (Dict[str, int]): dictionnary of column names -> column indexes
+    """
+    indexes = [column_idx[col_name] for col_name in ORDER_COLUMNS]
+    date_idx = column_idx["Date"]
+    for line_nb, line in enumerate(rows, start=1):
+        # strip the headers
+        if line_nb < 3:
+            continue
+        # stop at the first empty line
+        if date_idx >= len(line) or not line[date_idx]:
+            return
+        # if a cell is empty for a col, the line is shorter
+        yield OrderLine(line_nb, tuple(line[i] if i < len(line) else "" for i in indexes))
+
+
+def fetch_all_data(sheet, column_idx: Dict[str, int], creds=None) -> List[OrderLine]:
     """Retrieves all the relevant data of the spreadsheet to limit the number of requests to a minimum.
-       Later : return a numpy array
 
     Args:
         sheet (_type_): googleapiclient spreadsheets object
         column_idx (Dict[str, int]): dictionnary of column names -> column indexes
+        creds: if given, the response is parsed while it is downloaded,
+            and the download stops at the first empty line
 
     Returns:
-        A list of dictionnaries that represent lines 
+        A list of OrderLine (that can be used as dictionnaries) that represent lines
     """
-    # fetch all the lines data
-    data = sheet.values().get(spreadsheetId=SPREADSHEET_ID,
-                              range=ALL_RANGE).execute()['values']
-
-    # remove headers / columns names
-    col_names = data[1]
-
-    # strip the headers and empty end lines
-    i = 3
-    while i < len(data) and data[i][0]:
-        i += 1
-    first_empty_line = i
-    data = data[2:first_empty_line]
-
-    # convert to dictionnary, with the relevant data
-    data_dicts = []
-    for line_nb, line in enumerate(data):
-        line_dict = {'line': line_nb+3}
-        for col_name in column_idx:
-            col_id = column_idx[col_name]
-            # if a cell is empty for a col :
-            if col_id >= len(line):
-                line_dict[col_name] = ""
-            else:
-                line_dict[col_name] = line[col_id]
-        data_dicts.append(line_dict)
+    if creds is not None:
+        # closing the stream stops the download
+        with contextlib.closing(stream_values(creds, ALL_RANGE)) as rows:
+            return list(iter_order_lines(rows, column_idx))
 
-    return data_dicts
+    rows = sheet.values().get(spreadsheetId=SPREADSHEET_ID,
+                              range=ALL_RANGE).execute()['values']
+    return list(iter_order_lines(rows, column_idx))
 
 
 def find_column_index(columns_names, column_name: str) -> int:
@@ -113,7 +206,7 @@ def get_all_col_indexes(sheet) -> Dict[str, int]:
     columns_names = sheet.values().get(spreadsheetId=SPREADSHEET_ID,
                                        range=FEATURES_LINE_RANGE).execute()['values'][0]
     col_indexes = {}
-    for col_name in ["Date", "Type", "Inté / Exté", "Bénéficiaire", "Contact eventuel", "Description", "A1", "A2", "A3", "Sticker", "T-shirt", "Prix total", "№ facture", "Encaissement"]:
+    for col_name in ORDER_COLUMNS:
         col_indexes[col_name] = find_column_index(columns_names, col_name)
     return col_indexes
 
@@ -167,14 +260,6 @@ def get_no_receipt_lines(sheet, columns_idx) -> List[int]:
     return no_receipt_lines
 
 
-def format_price_string(price: float) -> str:
-    """Returns a string corresponding to the input price """
-    if int(10 * price) == 10 * price:
-        return f"{str(float(price)).replace('.', ',')}0€"
-    else:
-        return f"{str(float(price)).replace('.', ',')}€"
-
-
 def has_receipt(line_nb: int, sheet, columns_idx) -> bool:
     """Returns True if the entry has a receipt number, False otherwise"""
     line_data = sheet.values().get(spreadsheetId=SPREADSHEET_ID,
@@ -197,17 +282,11 @@ def get_order_data(line_nb: int, sheet, column_idx):
     recipient_name = line_data[column_idx["Bénéficiaire"]]
     total_print_price = line_data[column_idx["Prix total"]] + " TTC"
 
-    orders_list = []
-    # iterate over each type of print (A1, A2, A3, sticker, t-shirt)
-    for q_id, qtity_st in enumerate(line_data[column_idx["A1"]:column_idx["Prix total"]]):
-        # if there is an order
-        if qtity_st:
-            # compute the total price of each service type
-            element_price = int(qtity_st) * SERVICES_DATA[q_id]["price"]
-            order_dict = {"quantity": qtity_st, "designation": SERVICES_DATA[q_id]["designation"],
-                          "unit price": format_price_string(SERVICES_DATA[q_id]["price"]) + " HT",
-                          "line total price": format_price_string(element_price) + " TTC"}
-            orders_list.append(order_dict)
+    # get the quantity of each type of print (A1, A2, A3, sticker, t-shirt)
+    quantities = {col: line_data[column_idx[col]] if column_idx[col] < len(line_data) else ""
+                  for col in pricing.SERVICE_COLUMNS}
+    line_items, _ = pricing.price_orders(pd.DataFrame([quantities], index=[line_nb]))
+    orders_list = pricing.get_orders_lists(line_items).get(line_nb, [])
     return orders_list, total_print_price, recipient_name
 
 
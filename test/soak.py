@@ -0,0 +1,280 @@
+""" Soak test: runs process_all_orders end to end on a synthetic sheet, and checks throughput & resources.
+
+    The Google Sheet, the SMTP server and Word are replaced by local stand-ins (in-memory sheet,
+    fake SMTP connections and a fake Word writing minimal pdfs), everything else is the real code.
+    Leaks (Word applications or SMTP connections never closed, file handles...) and throughput
+    regressions are reported before they hit a real month-end run.
+
+    Usage:
+        python -m test.soak --orders 5000 --recipients 2000 --min-receipts-per-second 20 --max-rss-mb 800
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest import mock
+
+import psutil
+from PIL import Image
+
+import assets
+import pricing
+import process_all_orders as pao
+import receipt_creation as rc
+import receipt_utils as ru
+import utils as ut
+from archive import Archive
+from retrieve import Retriever
+from sheets_backend import InMemorySheetsBackend
+
+SHEET_COLUMNS = ['Date', 'Type', 'Inté / Exté', 'Bénéficiaire', 'Contact eventuel', 'Description', 'A1', 'A2', 'A3',
+                 'Sticker', 'T-shirt', 'Prix total', '№ facture', 'Encaissement', 'Date encaissement', 'Montant',
+                 'Catégorie', 'Commentaire']
+# .env values used during the run
+SOAK_CONFIG = {'CSD_TRESURER_NAME': 'Jean Dupont', 'VR_TRESURER_NAME': 'Pierre Dubois', 'VR_OFFICIAL_NAME': 'Association',
+               'VR_INFO': '1, rue de la République\n75015 Paris', 'VR_ACCOUNT_NUMBER': '12345', 'VR_IBAN': 'FR43 1234',
+               'VR_BIC': 'ABCDEFGH', 'SENDER_EMAIL': 'csd@example.com', 'APP_PASSWORD': 'password',
+               'CSD_TRESURER_PHONE': '0123456789'}
+# minimal pdf written by the fake Word
+FAKE_PDF = b"%PDF-1.4\n%%EOF\n"
+
+
+def build_synthetic_sheet(nb_orders: int, nb_recipients: int, skew: float = 1.1, seed: int = 0) -> (List[List[str]], Dict):
+    """Returns the lines of a sheet (title, columns names & orders) and the assos details.
+
+        The recipients follow a Zipf-like distribution (a few of them order a lot), 20% of them are assos.
+        One line out of ten is already paid (not processed).
+    """
+    rng = random.Random(seed)
+    recipients = []
+    asso_details = {}
+    for k in range(nb_recipients):
+        if k % 5 == 0:
+            name = f"asso {k}"
+            asso_details[name] = {"official name": f"Association {k}", "address": f"{k} rue Joliot-Curie\n91190 Gif",
+                                  "tresurer first name": f"Trésorier {k}", "tresurer mail": f"tresorier{k}@example.com"}
+            recipients.append((name, "Asso", ""))
+        elif k % 5 == 4:
+            recipients.append((f"Entreprise {k}", "Exté", f"contact{k}@example.com"))
+        else:
+            recipients.append((f"Etudiant {k}", "Inté", f"etudiant{k}@example.com"))
+    weights = [1 / (k + 1) ** skew for k in range(nb_recipients)]
+
+    today = time.strftime("%d/%m/%Y")
+    lines = [["Comptabilité CS Design"], SHEET_COLUMNS]
+    for i in range(nb_orders):
+        name, recipient_type, contact = rng.choices(recipients, weights)[0]
+        quantities = {col: rng.choice(["", "", "1", "2", "10"]) for col in pricing.SERVICE_COLUMNS}
+        if not any(quantities.values()):
+            quantities["A3"] = "1"
+        total = sum(int(q or 0) * pricing.SERVICES[col]["price"] for col, q in quantities.items())
+        line_type, payment = ("Prestation", "") if i % 10 else ("Prestation", "Virement")
+        lines.append([today, line_type, recipient_type, name, contact, f"Commande {i}",
+                      *quantities.values(), pricing.format_price(total).replace("€", " €"), "", payment,
+                      "", "", "Impression", ""])
+    return lines, asso_details
+
+
+class FakeSMTP():
+    """SMTP connection that only counts the messages"""
+    opened = 0
+    closed = 0
+    sent = 0
+    lock = threading.Lock()
+
+    def __init__(self) -> None:
+        with FakeSMTP.lock:
+            FakeSMTP.opened += 1
+
+    def send_message(self, msg) -> None:
+        with FakeSMTP.lock:
+            FakeSMTP.sent += 1
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self) -> None:
+        with FakeSMTP.lock:
+            FakeSMTP.closed += 1
+
+    def __enter__(self) -> "FakeSMTP":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.quit()
+
+
+class FakeDocument():
+    def __init__(self, path: str) -> None:
+        with open(path, "rb"):
+            pass
+
+    def SaveAs(self, pdf_file_name: str, FileFormat: int = None) -> None:
+        with open(pdf_file_name, "wb") as f:
+            f.write(FAKE_PDF)
+
+    def Close(self) -> None:
+        pass
+
+
+class FakeWord():
+    """Word application converting the documents to minimal pdfs, counting the launched applications"""
+    started = 0
+    quit = 0
+
+    def __init__(self) -> None:
+        FakeWord.started += 1
+        self.Documents = SimpleNamespace(Open=FakeDocument)
+
+    def Quit(self) -> None:
+        FakeWord.quit += 1
+
+
+class ResourceMonitor():
+    """Samples the memory (of the process & its render workers) and the open files during the run"""
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_open_files = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample_forever, daemon=True)
+
+    def get_open_files(self) -> int:
+        return self.process.num_handles() if os.name == "nt" else self.process.num_fds()
+
+    def sample(self) -> None:
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            with contextlib.suppress(psutil.Error):
+                rss += child.memory_info().rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_open_files = max(self.peak_open_files, self.get_open_files())
+
+    def sample_forever(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "ResourceMonitor":
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+
+def run_soak(nb_orders: int = 500, nb_recipients: int = 200, skew: float = 1.1, seed: int = 0) -> Dict:
+    """Runs process_all_orders on a synthetic sheet and returns the measures of the run"""
+    FakeSMTP.opened = FakeSMTP.closed = FakeSMTP.sent = 0
+    FakeWord.started = FakeWord.quit = 0
+    lines, asso_details = build_synthetic_sheet(nb_orders, nb_recipients, skew, seed)
+    backend = InMemorySheetsBackend(lines)
+
+    previous_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, contextlib.ExitStack() as stack:
+        # the run writes relative files (logo cache, catalog, outbox...): everything stays in work_dir
+        os.chdir(work_dir)
+        stack.callback(os.chdir, previous_dir)
+        receipts_path = os.path.join(work_dir, "receipts")
+        os.makedirs(receipts_path)
+        Image.new("RGB", (600, 300), (200, 30, 30)).save(assets.LOGO_PATH)
+        asso_details_path = os.path.join(work_dir, "associations_addresses.json")
+        with open(asso_details_path, "w", encoding="utf-8") as f:
+            json.dump(asso_details, f)
+
+        stack.enter_context(mock.patch.dict(os.environ, dict(SOAK_CONFIG, RECEIPTS_PATH=receipts_path)))
+        stack.enter_context(mock.patch.object(ru, "RECEIPTS_PATH", receipts_path))
+        for name in ["VR_OFFICIAL_NAME", "VR_INFO", "VR_IBAN", "VR_BIC", "VR_ACCOUNT_NUMBER"]:
+            stack.enter_context(mock.patch.object(rc, name, SOAK_CONFIG[name]))
+        # the months names do not matter here
+        stack.enter_context(mock.patch.object(rc, "HAS_FRENCH_LOCALE", True))
+        stack.enter_context(mock.patch.object(rc, "start_word", lambda new_instance=False: FakeWord()))
+        stack.enter_context(mock.patch.object(ut, "open_smtp_connection", FakeSMTP))
+        rc.get_receipt_template.cache_clear()
+        assets.get_optimized_image.cache_clear()
+        stack.callback(rc.get_receipt_template.cache_clear)
+        stack.callback(assets.get_optimized_image.cache_clear)
+
+        retriever = Retriever(archive=Archive(os.path.join(work_dir, "archive")), backend=backend,
+                              asso_details_path=asso_details_path)
+        # (the synthetic orders of a recipient may be identical by chance)
+        args = argparse.Namespace(outbox=False, auto_merge=False, yes=True, include_duplicates=True, backfill=False,
+                                  workers=1, source=None)
+        devnull = stack.enter_context(open(os.devnull, "w", encoding="utf-8"))
+        with ResourceMonitor() as monitor:
+            open_files_before = monitor.get_open_files()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                pao.main(args, retriever)
+            duration = time.perf_counter() - start
+            monitor.sample()
+            open_files_after = monitor.get_open_files()
+
+        nb_receipts = sum(len(files) for _, _, files in os.walk(receipts_path) if files) // 2
+        return {
+            "orders": nb_orders,
+            "receipts": nb_receipts,
+            "duration (s)": round(duration, 2),
+            "receipts per second": round(nb_receipts / duration, 1),
+            "peak rss (MB)": round(monitor.peak_rss / 1024 ** 2),
+            "peak open files": monitor.peak_open_files,
+            "leaked open files": open_files_after - open_files_before,
+            "leaked word applications": FakeWord.started - FakeWord.quit,
+            "leaked smtp connections": FakeSMTP.opened - FakeSMTP.closed,
+            "emails sent": FakeSMTP.sent,
+            "api calls": dict(Counter(backend.calls)),
+        }
+
+
+def check_slos(measures: Dict, min_receipts_per_second: float = 0, max_rss_mb: float = None,
+               max_leaked_files: int = 0, max_api_calls: int = None) -> List[str]:
+    """Returns the service level objectives that are not met (empty if all of them are)"""
+    failures = []
+    if measures["receipts per second"] < min_receipts_per_second:
+        failures.append(f"débit : {measures['receipts per second']} factures/s < {min_receipts_per_second}")
+    if max_rss_mb is not None and measures["peak rss (MB)"] > max_rss_mb:
+        failures.append(f"mémoire : {measures['peak rss (MB)']} Mo > {max_rss_mb}")
+    if measures["leaked open files"] > max_leaked_files:
+        failures.append(f"fichiers non fermés : {measures['leaked open files']}")
+    if measures["leaked word applications"]:
+        failures.append(f"applications Word non fermées : {measures['leaked word applications']}")
+    if measures["leaked smtp connections"]:
+        failures.append(f"connexions SMTP non fermées : {measures['leaked smtp connections']}")
+    nb_api_calls = sum(measures["api calls"].values())
+    if max_api_calls is not None and nb_api_calls > max_api_calls:
+        failures.append(f"requêtes à l'API : {nb_api_calls} > {max_api_calls}")
+    return failures
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", help="Number of lines of the synthetic sheet.", type=int, default=2000)
+    parser.add_argument("--recipients", help="Number of distinct recipients.", type=int, default=1000)
+    parser.add_argument("--skew", help="Skew of the orders distribution among the recipients.", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-receipts-per-second", type=float, default=0)
+    parser.add_argument("--max-rss-mb", type=float, default=None)
+    parser.add_argument("--max-leaked-files", type=int, default=0)
+    parser.add_argument("--max-api-calls", type=int, default=None)
+    args = parser.parse_args()
+
+    measures = run_soak(args.orders, args.recipients, args.skew, args.seed)
+    for name, value in measures.items():
+        print(f"{name:<28} {value}")
+    failures = check_slos(measures, args.min_receipts_per_second, args.max_rss_mb, args.max_leaked_files, args.max_api_calls)
+    for failure in failures:
+        print(f"ÉCHEC : {failure}")
+    raise SystemExit(1 if failures else 0)
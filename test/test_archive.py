@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from archive import Archive
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_empty_archive(self):
+        archive = Archive(self.tmp_dir.name)
+        self.assertEqual(archive.first_open_line, 3)
+        self.assertTrue(archive.load().empty)
+
+    def test_add_and_load(self):
+        lines = pd.DataFrame({'Date': ['01/12/2021', '03/01/2022', '04/01/2022'],
+                              '№ facture': ['2021-12-0001', '2022-01-0001', None],
+                              'Encaissement': ['Virement', 'Chèque', '']}, index=[3, 4, 5])
+        archive = Archive(self.tmp_dir.name)
+        archive.add(lines, pd.Series(['2021', '2022', '2022'], index=lines.index), first_open_line=6)
+
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "orders-2021.parquet")))
+
+        # a new archive object reads the manifest & loads the partitions lazily
+        archive = Archive(self.tmp_dir.name)
+        self.assertEqual(archive.first_open_line, 6)
+        self.assertEqual(archive.years(), ['2021', '2022'])
+        self.assertEqual(archive.load(['2022']).index.tolist(), [4, 5])
+        self.assertEqual(archive.load(['2022']).loc[5, '№ facture'], '')
+        self.assertEqual(archive.load().index.tolist(), [3, 4, 5])
+
+        # lines added later to an existing year are merged into its partition
+        new_lines = pd.DataFrame({'Date': ['05/01/2022'], '№ facture': ['2022-01-0002'], 'Encaissement': ['Lydia Pro']}, index=[6])
+        archive.add(new_lines, pd.Series(['2022'], index=new_lines.index), first_open_line=7)
+        self.assertEqual(Archive(self.tmp_dir.name).load(['2022']).index.tolist(), [4, 5, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
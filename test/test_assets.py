@@ -0,0 +1,52 @@
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+import assets
+
+
+class TestAssets(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # a large logo with transparency
+        self.logo_path = os.path.join(self.tmp_dir.name, "logo.png")
+        image = Image.new("RGBA", (3000, 1500), (255, 255, 255, 0))
+        image.paste((200, 30, 30, 255), (500, 300, 2500, 1200))
+        image.save(self.logo_path)
+        self.cache_path = os.path.join(self.tmp_dir.name, "cache")
+
+    def tearDown(self):
+        assets.get_optimized_image.cache_clear()
+        self.tmp_dir.cleanup()
+
+    def test_logo_is_resized_to_printed_width(self):
+        optimized = assets.get_optimized_image(self.logo_path, 3, 300, self.cache_path)
+        image = Image.open(io.BytesIO(optimized))
+
+        # 3 cm at 300 dpi
+        self.assertEqual(image.size, (354, 177))
+        self.assertEqual(image.mode, "RGBA")
+        self.assertLess(len(optimized), os.path.getsize(self.logo_path))
+
+    def test_logo_is_cached_on_disk(self):
+        optimized = assets.get_optimized_image(self.logo_path, 3, 300, self.cache_path)
+        self.assertEqual(len(os.listdir(self.cache_path)), 1)
+
+        # another run reads it from the cache
+        assets.get_optimized_image.cache_clear()
+        self.assertEqual(assets.get_optimized_image(self.logo_path, 3, 300, self.cache_path), optimized)
+        self.assertEqual(len(os.listdir(self.cache_path)), 1)
+
+    def test_check_receipt_size(self):
+        receipt_path = os.path.join(self.tmp_dir.name, "2022-03-0001.pdf")
+        with open(receipt_path, "wb") as f:
+            f.write(b"0" * 3000)
+        self.assertIsNone(assets.check_receipt_size(receipt_path, budget_kb=10))
+        self.assertIn("2022-03-0001.pdf", assets.check_receipt_size(receipt_path, budget_kb=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from async_retrieve import AsyncRetriever
+from retrieve import Retriever
+from sheets_backend import InMemorySheetsBackend
+
+SHEET_VALUES = {
+    "A:S": [["Comptabilité"],
+            ["Date", "Type", "Inté / Exté", "Bénéficiaire", "№ facture", "Encaissement"],
+            ["01/03/2022", "Prestation", "Asso", "bde", "", ""],
+            ["02/03/2022", "Prestation", "Inté", "Jean Dupont", "2022-03-0001", "Virement"],
+            ["03/03/2022", "Commande", "", "", "", ""]],
+    "Paiements!A:B": [["Date", "Montant"], ["04/03/2022", "4,00 €"]],
+}
+
+
+class TestAsyncRetriever(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        async def get_values(request):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            # simulate the network latency
+            await asyncio.sleep(0.05)
+            self.in_flight -= 1
+            data_range = request.match_info["range"]
+            if data_range not in SHEET_VALUES:
+                raise web.HTTPBadRequest()
+            return web.json_response({"range": data_range, "values": SHEET_VALUES[data_range]})
+
+        app = web.Application()
+        app.router.add_get("/{spreadsheet_id}/values/{range}", get_values)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.close()
+
+    def build_retriever(self, max_concurrent_requests=4):
+        return AsyncRetriever(base_url=str(self.server.make_url("")).rstrip("/"), spreadsheet_id="test",
+                              max_concurrent_requests=max_concurrent_requests)
+
+    async def test_fetch_orders_data(self):
+        retriever = self.build_retriever()
+        orders = await retriever.fetch_orders_data_async(self.session)
+
+        self.assertEqual(orders.index.tolist(), [3, 4, 5])
+        self.assertEqual(retriever.get_unprocessed_orders().index.tolist(), [3])
+        self.assertEqual(len(retriever.filter_by_client_type(orders, "Inté")), 1)
+
+    async def test_sync_api_is_kept(self):
+        self.assertIs(AsyncRetriever.fetch_orders_data, Retriever.fetch_orders_data)
+        self.assertIs(AsyncRetriever.fetch_asso_details, Retriever.fetch_asso_details)
+
+        # (as the Watcher refreshes it)
+        retriever = self.build_retriever()
+        retriever.spreadsheet = InMemorySheetsBackend(SHEET_VALUES["A:S"]).spreadsheets()
+        orders = retriever.fetch_orders_data(retriever.creds)
+        self.assertEqual(orders.index.tolist(), [3, 4, 5])
+        self.assertIsNone(retriever.source)
+
+    async def test_fetch_ranges_concurrently(self):
+        retriever = self.build_retriever(max_concurrent_requests=2)
+        results = await retriever.fetch_ranges(self.session, "A:S", "Paiements!A:B", "A:S", "Paiements!A:B")
+
+        self.assertEqual(results[1], SHEET_VALUES["Paiements!A:B"])
+        self.assertEqual(results[2], SHEET_VALUES["A:S"])
+        # requests are concurrent, but bounded by the semaphore
+        self.assertEqual(self.max_in_flight, 2)
+
+    async def test_fetch_unknown_range(self):
+        retriever = self.build_retriever()
+        with self.assertRaises(aiohttp.ClientResponseError):
+            await retriever.fetch_range(self.session, "Inconnu!A:A")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from beneficiaries import BeneficiaryIndex, normalize_name
+
+
+class TestBeneficiaryIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.index = BeneficiaryIndex(["bde", "bda", "bds", "forum cs", "club théâtre", "junior entreprise"])
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("  Club  THÉÂTRE "), "club theatre")
+        self.assertEqual(normalize_name("BDE "), "bde")
+
+    def test_match(self):
+        self.assertEqual(self.index.match("BDE "), "bde")
+        self.assertEqual(self.index.match("Club Theatre"), "club théâtre")
+        self.assertIsNone(self.index.match("Junior Entreprize"))
+
+    def test_suggest(self):
+        name, score = self.index.suggest("Junior Entreprize")[0]
+        self.assertEqual(name, "junior entreprise")
+        self.assertGreater(score, 0.7)
+        self.assertEqual(self.index.suggest("zzz"), [])
+
+    def test_resolve(self):
+        self.assertIsNone(self.index.resolve("Junior Entreprize"))
+        self.assertEqual(self.index.resolve("Junior Entreprize", auto_merge=True, min_score=0.7), "junior entreprise")
+        # too far from any known asso to be merged
+        self.assertIsNone(self.index.resolve("bdx", auto_merge=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from catalog import ReceiptCatalog
+
+
+class TestReceiptCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.receipts_path = os.path.join(self.tmp_dir.name, "receipts")
+        for number in ["2021-12-0001", "2022-01-0001", "2022-01-0002", "2022-03-0001"]:
+            month_dir = os.path.join(self.receipts_path, number[:7])
+            os.makedirs(month_dir, exist_ok=True)
+            for extension in (".docx", ".pdf"):
+                with open(os.path.join(month_dir, number + extension), "wb") as f:
+                    f.write(number.encode())
+        self.catalog = ReceiptCatalog(os.path.join(self.tmp_dir.name, "catalog.sqlite"))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp_dir.cleanup()
+
+    def test_backfill_and_query(self):
+        orders = pd.DataFrame({'Bénéficiaire': ['BDE', 'bda', 'bde'], 'Prix total': ['4,00 €', '1,05 €', '2,00 €'],
+                               '№ facture': ['2021-12-0001', '2022-01-0001', '2022-01-0002']}, index=[3, 4, 5])
+        self.assertEqual(self.catalog.backfill(self.receipts_path, orders), 4)
+        # already known receipts are not added twice
+        self.assertEqual(self.catalog.backfill(self.receipts_path, orders), 0)
+
+        bde_2022 = self.catalog.query(recipient="bde", year="2022")
+        self.assertEqual([r["number"] for r in bde_2022], ["2022-01-0002"])
+        self.assertEqual(bde_2022[0]["amount_cents"], 200)
+        self.assertEqual(bde_2022[0]["sheet_line"], 5)
+        self.assertEqual(bde_2022[0]["size"], 12)
+        self.assertEqual([r["number"] for r in self.catalog.query(month="2022-01")], ["2022-01-0001", "2022-01-0002"])
+        self.assertIsNone(self.catalog.query(month="2022-03")[0]["recipient"])
+
+    def test_add_and_mark_sent(self):
+        path = os.path.join(self.receipts_path, "2022-03", "2022-03-0001.pdf")
+        self.catalog.add("2022-03-0001", path, "Jean Dupont", 400, 12)
+        self.assertEqual(len(self.catalog.query(status="created")), 1)
+
+        self.catalog.mark_sent(["2022-03-0001"])
+        receipt = self.catalog.query(recipient="jean dupont")[0]
+        self.assertEqual(receipt["status"], "sent")
+        self.assertIsNotNone(receipt["sent_at"])
+
+    def test_queued_receipts_are_not_sent(self):
+        path = os.path.join(self.receipts_path, "2022-03", "2022-03-0001.pdf")
+        self.catalog.add("2022-03-0001", path, "Jean Dupont", 400, 12)
+
+        self.catalog.mark_sent(["2022-03-0001"], "queued")
+        receipt = self.catalog.query(status="queued")[0]
+        self.assertIsNone(receipt["sent_at"])
+
+        self.catalog.mark_sent(["2022-03-0001"], "sent", "2022-03-02T10:00:00")
+        self.assertEqual(self.catalog.query(status="sent")[0]["sent_at"], "2022-03-02T10:00:00")
+
+    def test_recipient_variants(self):
+        for number, recipient in [("2022-03-0001", "BDE "), ("2022-03-0002", "bde"), ("2022-03-0003", "Bdé")]:
+            self.catalog.add(number, os.path.join(self.receipts_path, "2022-03", number + ".pdf"), recipient)
+
+        self.assertEqual(len(self.catalog.query(recipient="bde")), 3)
+        self.assertEqual(len(self.catalog.query(recipient=" BDÉ")), 3)
+
+    def test_add_receipt_not_written_yet(self):
+        path = os.path.join(self.receipts_path, "2022-04", "2022-04-0001.pdf")
+        self.catalog.add("2022-04-0001", path, "bde", 400, 12, data=b"%PDF-1.4")
+
+        receipt = self.catalog.query(month="2022-04")[0]
+        self.assertEqual(receipt["size"], 8)
+        self.assertIsNotNone(receipt["sha256"])
+
+
+if __name__ == '__main__':
+    unittest.main()
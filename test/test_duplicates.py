@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+
+import pandas as pd
+
+import duplicates
+from archive import Archive
+from order_sources import CsvSource
+from retrieve import Retriever
+from test.test_retrieve import ASSO_DETAILS_FIXTURE, ORDERS_FIXTURE, build_test_retriever
+
+
+class TestDuplicates(unittest.TestCase):
+    def build_orders(self, lines, **columns):
+        orders = {'Date': '04/02/2022', 'Bénéficiaire': 'Jean Dupont', 'A1': '', 'A2': '', 'A3': '',
+                  'Sticker': '100', 'T-shirt': '', 'Prix total': '15,00 €', '№ facture': ''}
+        orders.update(columns)
+        return pd.DataFrame({col: value if isinstance(value, list) else [value] * len(lines)
+                             for col, value in orders.items()}, index=lines)
+
+    def test_fingerprints(self):
+        orders = self.build_orders([3, 4, 5, 6, 7], Date=['04/02/2022', '4/2/2022', '04/02/2022', '04/02/2022', '05/02/2022'],
+                                   **{'Bénéficiaire': ['Jean Dupont', ' jean  DUPONT', 'Jean Dupont', 'Jean Dupont', 'Jean Dupont'],
+                                      'Sticker': ['100', '100', '0100', '10', '100'],
+                                      'Prix total': ['15,00 €', '15 €', '15,00 €', '1,50 €', '15,00 €']})
+        fingerprints = duplicates.get_fingerprints(orders)
+        self.assertEqual(fingerprints[3], fingerprints[4])
+        self.assertEqual(fingerprints[3], fingerprints[5])
+        self.assertNotEqual(fingerprints[3], fingerprints[6])
+        self.assertNotEqual(fingerprints[3], fingerprints[7])
+
+    def test_find_duplicates(self):
+        orders = self.build_orders([20, 21, 22, 23], Date=['04/02/2022', '04/02/2022', '05/02/2022', '10/02/2022'],
+                                   **{'Bénéficiaire': ['Jean Dupont', 'jean dupont', 'Jean Dupont', 'Mairie'],
+                                      'Sticker': ['100', '100', '100', ''], 'T-shirt': ['', '', '', '4'],
+                                      'Prix total': ['15,00 €', '15,00 €', '15,00 €', '24,00 €']})
+        retriever = build_test_retriever()
+        found = duplicates.find_duplicates(orders, retriever.orders[retriever.orders["№ facture"].ne("")])
+
+        # the Mairie order was already invoiced (line 7 of the fixture)
+        self.assertEqual(found.index.tolist(), [21, 23])
+        self.assertEqual(found["duplicate of"].tolist(), ["ligne 20", "facture 2022-02-0001"])
+        self.assertTrue(duplicates.find_duplicates(orders.loc[[20, 22]]).empty)
+
+    def test_invoiced_orders_of_a_source(self):
+        # only the unprocessed orders of the source are loaded
+        retriever = Retriever(archive=Archive(tempfile.mkdtemp()), asso_details_path=ASSO_DETAILS_FIXTURE,
+                              source=CsvSource(ORDERS_FIXTURE), unprocessed_only=True)
+        self.assertTrue(retriever.orders["№ facture"].eq("").all())
+
+        invoiced = duplicates.get_recent_invoiced_orders(retriever)
+        self.assertIn("2022-02-0001", invoiced["№ facture"].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import contextlib
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from PIL import Image
+
+import assets
+import receipt_utils as ru
+import utils as ut
+from invoice import call_service
+from test.soak import SOAK_CONFIG, FakeSMTP, FakeWord
+from sheets_backend import InMemorySheetsBackend
+from test.test_retrieve import ORDERS_FIXTURE, build_test_retriever
+
+try:
+    import receipt_creation as rc
+    from invoice_service import InvoiceError, InvoiceService, ReceiptFilesError, create_server
+except Exception:  # Windows-only dependencies (Word, fr_FR locale)
+    rc = None
+
+
+@unittest.skipIf(rc is None, "receipt_creation cannot be imported on this platform")
+class TestInvoiceService(unittest.TestCase):
+    def setUp(self):
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        # the service writes relative files (logo cache, catalog...)
+        work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.callback(os.chdir, os.getcwd())
+        os.chdir(work_dir)
+        Image.new("RGB", (600, 300), (200, 30, 30)).save(assets.LOGO_PATH)
+        receipts_path = os.path.join(work_dir, "receipts")
+        os.makedirs(receipts_path)
+
+        stack.enter_context(mock.patch.dict(os.environ, dict(SOAK_CONFIG, RECEIPTS_PATH=receipts_path)))
+        stack.enter_context(mock.patch.object(ru, "RECEIPTS_PATH", receipts_path))
+        for name in ["VR_OFFICIAL_NAME", "VR_INFO", "VR_IBAN", "VR_BIC", "VR_ACCOUNT_NUMBER"]:
+            stack.enter_context(mock.patch.object(rc, name, SOAK_CONFIG[name]))
+        stack.enter_context(mock.patch.object(rc, "HAS_FRENCH_LOCALE", True))
+        stack.enter_context(mock.patch.object(rc, "start_word", lambda new_instance=False: FakeWord()))
+        stack.enter_context(mock.patch.object(ut, "open_smtp_connection", FakeSMTP))
+        stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")))
+        rc.get_receipt_template.cache_clear()
+        assets.get_optimized_image.cache_clear()
+        stack.callback(rc.get_receipt_template.cache_clear)
+        stack.callback(assets.get_optimized_image.cache_clear)
+
+        self.backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        self.retriever = build_test_retriever(self.backend)
+        self.service = InvoiceService(self.retriever)
+        self.service.warm_up()
+        stack.callback(self.service.close)
+
+    def test_invoice_line(self):
+        FakeSMTP.sent = 0
+        receipts = self.service.invoice_line(6)
+
+        self.assertEqual(list(receipts), [6])
+        self.assertEqual(self.retriever.orders.loc[6, "№ facture"], receipts[6])
+        self.assertEqual(FakeSMTP.sent, 1)
+        # the snapshot is up to date: the order is not invoiced twice
+        with self.assertRaises(InvoiceError):
+            self.service.invoice_line(6)
+        with self.assertRaises(InvoiceError):
+            self.service.invoice_line(1000)
+
+    def test_duplicates_are_refused(self):
+        receipts = self.service.invoice_line(6)
+        # the same order entered again
+        self.backend.cells.append(list(self.backend.cells[5]))
+        self.backend.cells[-1][12] = ""
+        line = len(self.backend.cells)
+
+        with self.assertRaises(InvoiceError) as context:
+            self.service.invoice_line(line)
+        self.assertEqual(context.exception.issues, [f"ligne {line} : identique à la facture {receipts[6]}."])
+        self.assertEqual(list(self.service.invoice_line(line, include_duplicates=True)), [line])
+
+    def test_write_errors_are_reported(self):
+        with mock.patch("receipt_writer.write_file", side_effect=OSError("disque plein")), \
+                self.assertRaises(ReceiptFilesError) as context:
+            self.service.invoice_line(6)
+        self.assertEqual(list(context.exception.receipts), [6])
+        self.assertIn("disque plein", context.exception.issues[0])
+        self.assertEqual(self.service.writer.futures, [])
+
+    def test_invoiced_by_another_run(self):
+        # written by another run in the middle of the sheet: the signature (last lines) does not change
+        self.backend.set_range("M6", [["2022-02-0002"]])
+        FakeSMTP.sent = 0
+        with mock.patch.object(self.service, "has_changed", return_value=False), self.assertRaises(InvoiceError):
+            self.service.invoice_line(6)
+        self.assertEqual(FakeSMTP.sent, 0)
+        self.assertEqual(self.retriever.orders.loc[6, "№ facture"], "2022-02-0002")
+
+    def test_http_requests(self):
+        server = create_server(self.service, port=0, token="secret")
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+
+        # a web page can send a 'simple' text/plain request, without the token
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/invoice/line", data=b'{"line": 6}',
+                                         headers={"Content-Type": "text/plain"})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+        context.exception.close()
+        self.assertEqual(context.exception.code, 415)
+        status, _ = call_service("/invoice/line", {"line": 6}, port, token="wrong")
+        self.assertEqual(status, 403)
+
+        status, answer = call_service("/invoice/recipient", {"name": "jean dupont"}, port, token="secret")
+        self.assertEqual(status, 200)
+        self.assertEqual(list(answer["receipts"]), ["6"])
+        # no valid email address
+        status, answer = call_service("/invoice/line", {"line": 9}, port, token="secret")
+        self.assertEqual(status, 409)
+        status, answer = call_service("/invoice/line", {"line": "neuf"}, port, token="secret")
+        self.assertEqual(status, 400)
+        status, answer = call_service("/status", port=port, token="secret")
+        self.assertEqual(status, 200)
+        self.assertEqual(answer["orders"], len(self.retriever.orders))
+
+
+if __name__ == '__main__':
+    unittest.main()
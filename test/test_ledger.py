@@ -0,0 +1,75 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import ledger
+from test.test_retrieve import build_test_retriever
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.receipts_path = os.path.join(self.tmp_dir.name, "receipts")
+        for number in ["2022-01-0001", "2022-02-0001"]:
+            os.makedirs(os.path.join(self.receipts_path, number[:7]), exist_ok=True)
+            with open(os.path.join(self.receipts_path, number[:7], number + ".pdf"), "wb") as f:
+                f.write(b"%PDF-1.4\n%%EOF\n")
+        self.retriever = build_test_retriever()
+        # the first lines (closed) are archived: the ledger reads the archive and the fetched lines
+        self.retriever.archive_closed_orders()
+
+    def test_receipts_index(self):
+        index = ledger.build_receipts_index(self.receipts_path)
+        self.assertEqual(sorted(index), ["2022-01-0001", "2022-02-0001"])
+        self.assertEqual(index["2022-02-0001"].size, 15)
+
+    def test_chunks(self):
+        chunks = list(ledger.iter_ledger_chunks(self.retriever, receipts_index=ledger.build_receipts_index(self.receipts_path),
+                                                chunk_size=2))
+        self.assertGreater(len(chunks), 1)
+        lines = pd.concat(chunks).set_index("Ligne")
+        # only the services
+        self.assertNotIn(4, lines.index)
+        self.assertEqual(lines.loc[3, "Montant TTC (centimes)"], 800)
+        self.assertTrue(lines.loc[3, "Fichier facture"].endswith("2022-01-0001.pdf"))
+        self.assertEqual(lines.loc[6, "Fichier facture"], "")
+
+    def test_years(self):
+        chunks = ledger.iter_ledger_chunks(self.retriever, years=["2021"], receipts_index={})
+        self.assertEqual(list(chunks), [])
+
+    def test_export_formats(self):
+        csv_path = os.path.join(self.tmp_dir.name, "ledger.csv")
+        parquet_path = os.path.join(self.tmp_dir.name, "ledger.parquet")
+        nb_lines = ledger.export_ledger(self.retriever, csv_path, receipts_path=self.receipts_path, chunk_size=3)
+        self.assertEqual(ledger.export_ledger(self.retriever, parquet_path, receipts_path=self.receipts_path, chunk_size=3),
+                         nb_lines)
+
+        exported = pd.read_parquet(parquet_path)
+        self.assertEqual(exported.columns.tolist(), ledger.LEDGER_COLUMNS)
+        self.assertEqual(len(exported), nb_lines)
+        with open(csv_path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f, delimiter=";"))
+        self.assertEqual(len(rows), nb_lines + 1)
+        self.assertEqual(rows[1][:2], ["3", "05/01/2022"])
+
+    def test_fec(self):
+        fec_path = os.path.join(self.tmp_dir.name, "FEC.txt")
+        ledger.export_ledger(self.retriever, fec_path, "fec", receipts_path=self.receipts_path)
+        with open(fec_path, encoding="utf-8", newline="") as f:
+            entries = list(csv.DictReader(f, delimiter="\t"))
+
+        # 2 receipts (sale), one of them paid (payment)
+        self.assertEqual(len(entries), 6)
+        self.assertEqual([e["CompteNum"] for e in entries[:4]], ["411000", "706000", "512000", "411000"])
+        self.assertEqual(entries[0]["EcritureDate"], "20220105")
+        self.assertEqual(entries[0]["Debit"], "8,00")
+        self.assertEqual(entries[2]["EcritureDate"], "20220120")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import openpyxl
+import pandas as pd
+
+from archive import Archive
+from order_sources import CsvSource, OrderSource, SqliteSource, XlsxSource, open_order_source
+from retrieve import Retriever
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ORDERS_FIXTURE = os.path.join(TEST_DIR, "fixtures", "orders.csv")
+ASSO_DETAILS_FIXTURE = os.path.join(TEST_DIR, "..", "example.associations_addresses.json")
+
+UNPROCESSED_LINES = [5, 6, 8, 9, 10]
+
+
+class TestOrderSources(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.expected = CsvSource(ORDERS_FIXTURE).fetch_orders()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.tmp_dir, "orders.csv")
+        shutil.copy(ORDERS_FIXTURE, self.csv_path)
+
+        # same content as the fixture, as an xlsx export
+        self.xlsx_path = os.path.join(self.tmp_dir, "orders.xlsx")
+        workbook = openpyxl.Workbook()
+        with open(ORDERS_FIXTURE, "r", encoding="utf-8") as f:
+            for row in pd.read_csv(f, header=None, dtype=str, keep_default_na=False).values.tolist():
+                workbook.active.append([value if value != "" else None for value in row])
+        workbook.save(self.xlsx_path)
+
+        # and as a SQLite table
+        self.sqlite_path = os.path.join(self.tmp_dir, "orders.sqlite")
+        with sqlite3.connect(self.sqlite_path) as connection:
+            self.expected.rename_axis("line").reset_index().to_sql("orders", connection, index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def get_sources(self):
+        return [CsvSource(self.csv_path), XlsxSource(self.xlsx_path), SqliteSource(self.sqlite_path)]
+
+    def test_fetch_orders(self):
+        self.assertEqual(self.expected.index.to_list(), list(range(3, 11)))
+        for source in self.get_sources():
+            orders = source.fetch_orders()
+            pd.testing.assert_frame_equal(orders[self.expected.columns], self.expected, check_index_type=False)
+
+    def test_fetch_unprocessed_orders(self):
+        for source in self.get_sources():
+            self.assertEqual(source.fetch_orders(unprocessed_only=True).index.to_list(), UNPROCESSED_LINES)
+
+    def test_chunks(self):
+        for source in self.get_sources():
+            chunks = list(source.iter_chunks(chunk_size=3))
+            self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 2])
+            self.assertEqual(pd.concat(chunks).index.to_list(), self.expected.index.to_list())
+
+    def test_write_receipt_number(self):
+        for source in self.get_sources():
+            source.write_receipt_number("2022-03-0001", 5)
+            reopened = open_order_source(source.path)
+            self.assertEqual(reopened.fetch_orders().loc[5, "№ facture"], "2022-03-0001")
+            self.assertNotIn(5, reopened.fetch_orders(unprocessed_only=True).index)
+            self.assertIn("2022-03-0001", reopened.fetch_receipt_numbers())
+
+    def test_blank_lines_keep_the_line_numbers(self):
+        with open(self.csv_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        # blank line 5 (between the lines 4 and 6 of the fixture)
+        with open(self.csv_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[:4] + ["\n"] + lines[5:])
+
+        orders = CsvSource(self.csv_path).fetch_orders()
+        self.assertNotIn(5, orders.index)
+        pd.testing.assert_frame_equal(orders.loc[6:], self.expected.loc[6:], check_index_type=False)
+
+    def test_sources_are_abstract(self):
+        with self.assertRaises(TypeError):
+            OrderSource()
+
+    def test_retriever_with_source(self):
+        retriever = Retriever(archive=Archive(tempfile.mkdtemp()), asso_details_path=ASSO_DETAILS_FIXTURE,
+                              source=SqliteSource(self.sqlite_path), unprocessed_only=True)
+        self.assertEqual(retriever.get_unprocessed_orders().index.to_list(), UNPROCESSED_LINES)
+        # the receipt numbers of the processed lines are known even if they were not loaded
+        self.assertIn("2022-01-0001", retriever.get_receipt_numbers())
+
+        retriever.write_receipt_number("2022-03-0001", 6)
+        self.assertNotIn(6, retriever.get_unprocessed_orders().index)
+        self.assertNotIn(6, SqliteSource(self.sqlite_path).fetch_orders(unprocessed_only=True).index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import smtplib
+import tempfile
+import time
+import unittest
+from email.message import EmailMessage
+
+from catalog import ReceiptCatalog
+from outbox import RECEIPTS_HEADER, Outbox, OutboxSender, RateLimiter
+
+
+class FakeSMTP():
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+        self.messages = []
+
+    def send_message(self, msg):
+        if self.fail:
+            raise smtplib.SMTPDataError(421, b"Try again later")
+        self.sent.append(msg["To"])
+        self.messages.append(msg)
+
+    def quit(self):
+        pass
+
+
+def build_message(to):
+    msg = EmailMessage()
+    msg["To"] = to
+    msg["Subject"] = "Facture(s) CS Design"
+    msg.set_content("Hello")
+    msg.add_attachment(b"%PDF", maintype="application", subtype="pdf", filename="2022-01-0001.pdf")
+    return msg
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.outbox = Outbox(self.tmp_dir.name)
+        for i in range(3):
+            self.outbox.add(build_message(f"client{i}@gmail.com"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def count(self, dir_name):
+        return len(os.listdir(os.path.join(self.tmp_dir.name, dir_name)))
+
+    def test_drain(self):
+        smtp = FakeSMTP()
+        sender = OutboxSender(self.outbox, concurrency=2, smtp_factory=lambda: smtp)
+
+        self.assertEqual(sender.drain(), 3)
+        self.assertEqual(sorted(smtp.sent), ["client0@gmail.com", "client1@gmail.com", "client2@gmail.com"])
+        self.assertEqual(self.count("new"), 0)
+        self.assertEqual(self.count("sent"), 3)
+
+    def test_drain_updates_the_catalog(self):
+        catalog = ReceiptCatalog(os.path.join(self.tmp_dir.name, "catalog.sqlite"))
+        self.addCleanup(catalog.close)
+        for number in ["2022-01-0001", "2022-01-0002"]:
+            catalog.add(number, number + ".pdf", "bde")
+        catalog.mark_sent(["2022-01-0001", "2022-01-0002"], "queued")
+        self.outbox.add(build_message("bde@gmail.com"), ["2022-01-0001", "2022-01-0002"])
+
+        smtp = FakeSMTP()
+        OutboxSender(self.outbox, smtp_factory=lambda: smtp, catalog=catalog).drain()
+
+        receipts = catalog.query(recipient="bde")
+        self.assertEqual([r["status"] for r in receipts], ["sent", "sent"])
+        self.assertTrue(all(r["sent_at"] is not None for r in receipts))
+        # the header is only used by the sender
+        self.assertTrue(all(RECEIPTS_HEADER not in msg for msg in smtp.messages))
+
+    def test_retry_with_backoff(self):
+        sender = OutboxSender(self.outbox, max_attempts=2, smtp_factory=lambda: FakeSMTP(fail=True))
+
+        self.assertEqual(sender.drain(), 0)
+        # messages are back in new/, but not to be retried right away
+        self.assertEqual(self.count("new"), 3)
+        self.assertEqual(self.outbox.pending(), [])
+        self.assertTrue(all(Outbox.parse_file_name(f)[1] == 1 for f in self.outbox.pending(now=float("inf"))))
+
+        # second failure: given up
+        for file_name in self.outbox.pending(now=float("inf")):
+            self.outbox.claim(file_name)
+            self.outbox.mark_failed(file_name, max_attempts=2)
+        self.assertEqual(self.count("failed"), 3)
+
+    def test_recover_only_stale_claims(self):
+        first, second, _ = self.outbox.pending()
+        self.outbox.claim(first)
+        self.outbox.claim(second)
+        # the first one was claimed by a sender stopped an hour ago, the second one is being sent by another sender
+        claimed_at = time.time() - 3600
+        os.utime(os.path.join(self.tmp_dir.name, "cur", first), (claimed_at, claimed_at))
+
+        self.outbox.recover()
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir.name, "cur")), [second])
+        self.assertIn(first, self.outbox.pending())
+
+    def test_quota_is_kept_across_runs(self):
+        smtp = FakeSMTP()
+        sender = OutboxSender(self.outbox, per_minute=2, max_wait=0, smtp_factory=lambda: smtp)
+        self.assertEqual(sender.drain(), 2)
+
+        # a new sender reads the emails already sent from the log
+        sender = OutboxSender(self.outbox, per_minute=2, max_wait=0, smtp_factory=lambda: smtp)
+        self.assertEqual(sender.drain(), 0)
+        self.assertEqual(self.count("new"), 1)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(per_minute=2, per_day=3)
+        self.assertEqual(limiter.try_acquire(now=0), 0)
+        self.assertEqual(limiter.try_acquire(now=1), 0)
+        self.assertEqual(limiter.try_acquire(now=2), 58)
+        self.assertEqual(limiter.try_acquire(now=61), 0)
+        self.assertEqual(limiter.try_acquire(now=200), 24 * 3600 - 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+from PIL import Image
+
+import assets
+import preflight
+from test.test_retrieve import build_test_retriever
+
+
+class TestPreflight(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.retriever = build_test_retriever()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def build_orders(self, **columns):
+        orders = {'Date': ['05/01/2022'], 'Inté / Exté': ['Inté'], 'Bénéficiaire': ['Jean Dupont'],
+                  'Contact eventuel': ['jean.dupont@example.com'], 'A1': ['2'], 'A2': [''], 'A3': [''],
+                  'Sticker': [''], 'T-shirt': [''], 'Prix total': ['8,00 €']}
+        orders.update(columns)
+        return pd.DataFrame(orders, index=range(3, 3 + len(orders['Date'])))
+
+    def test_valid_orders(self):
+        self.assertEqual(preflight.check_quantities(self.build_orders()), [])
+        self.assertEqual(preflight.check_totals(self.build_orders()), [])
+        self.assertEqual(preflight.check_recipients(self.retriever, self.build_orders()), [])
+        self.assertEqual(preflight.check_dates(self.build_orders()), [])
+
+    def test_every_issue_is_reported(self):
+        orders = self.build_orders(Date=['05/01/2022', '31/02/2022', '07/01/2022', '08/01/2022'],
+                                   **{'Inté / Exté': ['Inté', 'Asso', 'Asso', 'Exté'],
+                                      'Bénéficiaire': ['Jean Dupont', 'BDE ', 'Club Inconnu', 'Mairie'],
+                                      'Contact eventuel': ['jean.dupont@example.com', '', '', 'mairie@'],
+                                      'A1': ['deux', '1', '', '1'], 'A2': ['', '', '1', ''],
+                                      'A3': ['', '', '', '1.5'], 'Sticker': ['', '', '', ''], 'T-shirt': ['', '', '', ''],
+                                      'Prix total': ['8,00 €', '4,00 €', '3,00 €', '5,50 €']})
+
+        quantities = preflight.check_quantities(orders)
+        self.assertEqual(len(quantities), 2)
+        self.assertTrue(quantities[0].startswith("ligne 3 : la quantité 'deux' (A1)"))
+        self.assertTrue(quantities[1].startswith("ligne 6 : la quantité '1.5' (A3)"))
+        # the lines with invalid quantities are not priced
+        totals = preflight.check_totals(orders)
+        self.assertEqual(len(totals), 1)
+        self.assertTrue(totals[0].startswith("ligne 5 :"))
+        recipients = preflight.check_recipients(self.retriever, orders)
+        self.assertEqual([issue[:8] for issue in recipients], ["ligne 5 ", "ligne 6 "])
+        self.assertIn("Club Inconnu", recipients[0])
+        self.assertEqual(len(preflight.check_dates(orders)), 1)
+
+    def test_split_issues(self):
+        issues = ["la variable VR_IBAN n'est pas définie (.env)."]
+        orders = self.build_orders()
+        orders.loc[orders.index[0], "A1"] = "1.5"
+        batch_issues, lines = preflight.split_issues(preflight.check_quantities(orders) + issues)
+        self.assertEqual(batch_issues, issues)
+        self.assertEqual(lines, {orders.index[0]})
+
+    def test_receipts_dir(self):
+        self.assertEqual(preflight.check_receipts_dir(self.tmp_dir.name, 10, min_free_space_mb=1), [])
+        self.assertEqual(len(preflight.check_receipts_dir(os.path.join(self.tmp_dir.name, "missing"), 10)), 1)
+        issues = preflight.check_receipts_dir(self.tmp_dir.name, 10, min_free_space_mb=10 ** 12)
+        self.assertIn("Mo nécessaires", issues[0])
+
+    def test_environment(self):
+        logo_path = os.path.join(self.tmp_dir.name, "logo.png")
+        Image.new("RGB", (10, 10)).save(logo_path)
+        config = {name: "x" for name in preflight.RECEIPT_CONFIG}
+        with mock.patch.dict(os.environ, config, clear=True), mock.patch.object(assets, "LOGO_PATH", logo_path), \
+                mock.patch.object(preflight.rc, "HAS_FRENCH_LOCALE", True):
+            self.assertEqual(preflight.check_environment(outbox=True), [])
+            self.assertEqual(len(preflight.check_environment(outbox=False)), len(preflight.MAIL_CONFIG))
+        with mock.patch.dict(os.environ, config, clear=True), mock.patch.object(assets, "LOGO_PATH", "missing.png"), \
+                mock.patch.object(preflight.rc, "HAS_FRENCH_LOCALE", False):
+            self.assertEqual(len(preflight.check_environment(outbox=True)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import pandas as pd
+
+import pricing
+
+
+class TestPricing(unittest.TestCase):
+
+    def test_format_price(self):
+        self.assertEqual(pricing.format_price(400), "4,00€")
+        self.assertEqual(pricing.format_price(15), "0,15€")
+        self.assertEqual(pricing.format_price(105), "1,05€")
+        self.assertEqual(pricing.format_price(22500), "225,00€")
+        self.assertEqual(pricing.format_price(-45), "-0,45€")
+        self.assertEqual(pricing.format_price(-4500), "-45,00€")
+
+    def test_parse_price(self):
+        self.assertEqual(pricing.parse_price("1,05 €"), 105)
+        self.assertEqual(pricing.parse_price("4€"), 400)
+        self.assertEqual(pricing.parse_price("0,5"), 50)
+        self.assertIsNone(pricing.parse_price(""))
+        self.assertIsNone(pricing.parse_price("gratuit"))
+
+    def test_price_orders(self):
+        orders = pd.DataFrame({'A1': ['1', ''], 'A2': ['', ''], 'A3': ['', '2'], 'Sticker': ['7', None], 'T-shirt': ['', ''],
+                               'Prix total': ['5,05 €', '3,00 €']}, index=[3, 4])
+        line_items, totals = pricing.price_orders(orders)
+
+        self.assertEqual(totals.to_dict(), {3: 505, 4: 200})
+        orders_lists = pricing.get_orders_lists(line_items)
+        self.assertEqual([o["designation"] for o in orders_lists[3]], ["Impression affiche A1", "Impression sticker"])
+        self.assertEqual(orders_lists[3][1]["line total price"], "1,05€ TTC")
+        self.assertEqual(orders_lists[4][0]["unit price"], "1,00€ HT")
+        # the second order total does not match the catalog
+        self.assertEqual(pricing.find_wrong_totals(orders, totals).index.tolist(), [4])
+
+    def test_non_numeric_quantity(self):
+        orders = pd.DataFrame({'A1': ['deux'], 'A2': [''], 'A3': [''], 'Sticker': [''], 'T-shirt': ['']})
+        with self.assertRaises(ValueError):
+            pricing.price_orders(orders)
+
+    def test_invalid_quantities(self):
+        for quantity in ['1.5', '-2']:
+            orders = pd.DataFrame({'A1': [quantity], 'A2': [''], 'A3': [''], 'Sticker': [''], 'T-shirt': ['']}, index=[7])
+            with self.assertRaisesRegex(ValueError, "line 7"):
+                pricing.get_quantities(orders)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+import process_all_orders as pao
+import receipt_creation as rc
+from sheets_backend import InMemorySheetsBackend
+from test.test_retrieve import ORDERS_FIXTURE, build_test_retriever
+
+
+def fake_process_recipient_orders(retriever, recip_name, recip_orders, sheet_receipt_names, *args, written_receipts=None, **kwargs):
+    """Creates the receipts of the recipient, the email of Jean Dupont can not be sent"""
+    for line, order in recip_orders.iterrows():
+        written_receipts[line] = f"{order['Date'][6:]}-{order['Date'][3:5]}-{line:04d}"
+    if recip_name == "Jean Dupont":
+        raise Exception("SMTP error")
+
+
+class TestBackfill(unittest.TestCase):
+    def test_receipts_of_failed_months_are_written(self):
+        backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        retriever = build_test_retriever(backend)
+        orders = retriever.orders.loc[[5, 6, 7]].copy()
+        # January: BDA, February: Jean Dupont (fails after his receipts are created), then Mairie
+        orders.loc[5, "Date"] = "20/01/2022"
+        orders.loc[7, "Date"] = "28/02/2022"
+        orders.loc[7, "Bénéficiaire"] = "Jean Dupont"
+
+        with mock.patch.object(pao, "process_recipient_orders", fake_process_recipient_orders), \
+                mock.patch.object(rc, "word_in_thread", lambda: contextlib.nullcontext(None)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaisesRegex(Exception, "SMTP error"):
+                pao.process_orders_by_month(retriever, orders, outbox=object(), max_workers=2)
+
+        # the receipts of both months are written (line L is cells[L - 1])
+        self.assertEqual(backend.cells[4][12], "2022-01-0005")
+        self.assertEqual(backend.cells[5][12], "2022-02-0006")
+        self.assertEqual(backend.cells[6][12], "2022-02-0007")
+
+    def test_archived_numbers_of_past_years_are_used(self):
+        retriever = build_test_retriever()
+        # a receipt of January 2021, archived
+        archived = retriever.orders.loc[[3]].copy()
+        archived["№ facture"] = "2021-01-0001"
+        retriever.archive.add(archived.set_axis([1]), pd.Series(["2021"], index=[1]), first_open_line=3)
+        orders = retriever.orders.loc[[5]].copy()
+        orders.loc[5, "Date"] = "20/01/2021"
+
+        used_numbers = []
+        def record_numbers(retriever, recip_name, recip_orders, sheet_receipt_names, *args, **kwargs):
+            used_numbers.extend(sheet_receipt_names)
+
+        with mock.patch.object(pao, "process_recipient_orders", record_numbers), \
+                mock.patch.object(rc, "word_in_thread", lambda: contextlib.nullcontext(None)), \
+                contextlib.redirect_stdout(io.StringIO()):
+            pao.process_orders_by_month(retriever, orders, outbox=object())
+
+        self.assertIn("2021-01-0001", used_numbers)
+
+
+if __name__ == '__main__':
+    unittest.main()
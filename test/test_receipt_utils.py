@@ -0,0 +1,64 @@
+import datetime as dt
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import docx
+from docx.shared import Cm
+
+import receipt_utils as ru
+
+
+class TestReceiptNumbers(unittest.TestCase):
+    def setUp(self):
+        self.receipts_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.receipts_dir)
+
+    def test_parse_order_date(self):
+        self.assertEqual(ru.parse_order_date("05/01/2022"), dt.date(2022, 1, 5))
+        self.assertIsNone(ru.parse_order_date(""))
+        self.assertIsNone(ru.parse_order_date("janvier"))
+
+    def test_get_receipt_number_of_past_month(self):
+        date = dt.date(2022, 3, 14)
+        receipt_nb = ru.get_receipt_number(set(), self.receipts_dir, date)
+
+        # numbered (and stored) in the month of the date, not the current one
+        self.assertEqual(receipt_nb, "2022-03-0001")
+        self.assertTrue(os.path.isdir(os.path.join(self.receipts_dir, "2022-03")))
+
+        # the numbers already used in the sheet are skipped
+        self.assertEqual(ru.get_receipt_number({"2022-03-0001", "2022-03-0002"}, self.receipts_dir, date), "2022-03-0003")
+        # the numbers of the other months do not matter
+        self.assertEqual(ru.get_receipt_number({"2022-03-0001"}, self.receipts_dir, dt.date(2022, 4, 1)), "2022-04-0001")
+
+
+class TestBuildTable(unittest.TestCase):
+    def test_build_table(self):
+        document = docx.Document()
+        rows = [["Qté", "Désignation"]] + [[str(i), f"A{i} & <co>"] for i in range(500)] + [["", "Net à payer"]]
+        table = ru.build_table(document, rows, [Cm(0.5), Cm(10)], body_alignments={0: "right"})
+
+        self.assertEqual(len(table.rows), 502)
+        self.assertEqual(table.cell(3, 1).text, "A2 & <co>")
+        self.assertEqual(table.cell(501, 1).text, "Net à payer")
+        self.assertEqual(table.style.name, "Receipt Table")
+        # widths are set in the grid, alignment only in the body rows
+        self.assertEqual([col.width for col in table.columns], [Cm(0.5).twips * 635, Cm(10).twips * 635])
+        self.assertEqual(table.cell(1, 0).paragraphs[0].alignment, 2)
+        self.assertIsNone(table.cell(0, 0).paragraphs[0].alignment)
+
+        # the style is only added once, and the document can be saved & read back
+        ru.build_table(document, rows[:2], [Cm(0.5), Cm(10)])
+        self.assertEqual(len([s for s in document.styles if s.name == "Receipt Table"]), 1)
+        buffer = io.BytesIO()
+        document.save(buffer)
+        self.assertEqual(len(docx.Document(buffer).tables), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+import utils as ut
+from receipt_writer import ReceiptWriter
+
+
+class TestReceiptWriter(unittest.TestCase):
+    def test_write_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, "2022-03", f"2022-03-000{i}.pdf") for i in range(1, 4)]
+            with ReceiptWriter() as writer:
+                for path in paths:
+                    writer.write(path, path.encode())
+                self.assertEqual(writer.flush(), paths)
+
+            for path in paths:
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), path.encode())
+            # no temporary file is left
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp_dir, "2022-03"))), sorted(map(os.path.basename, paths)))
+
+    def test_errors_are_raised(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = ReceiptWriter()
+            # a directory cannot be replaced by a file
+            writer.write(tmp_dir, b"")
+            with self.assertRaises(OSError):
+                writer.close()
+
+    def test_mail_with_receipts_in_memory(self):
+        orders = [{'Date': '05/01/2022', 'Description': 'Affiches', 'Prix total': '8,00 €'}]
+        msg = ut.build_receipts_mail("bde", "bde@example.com", "Asso", [("2022-01-0001.pdf", b"%PDF-1.4")], orders, "Jean")
+
+        attachments = list(msg.iter_attachments())
+        self.assertEqual([a.get_filename() for a in attachments], ["2022-01-0001.pdf"])
+        self.assertEqual(attachments[0].get_content(), b"%PDF-1.4")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+import reconcile
+from sheets_backend import InMemorySheetsBackend
+from test.test_retrieve import ORDERS_FIXTURE, build_test_retriever
+
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        self.backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        # receipts sent for the lines 5 (BDA, 6€), 6 (Jean Dupont, 15€) and 10 (bds, 1,05€), line 7 (Mairie, 24€) has one
+        self.backend.set_range("M5:M6", [["2022-02-0002"], ["2022-02-0003"]])
+        self.backend.set_range("M10", [["2022-02-0004"]])
+        self.retriever = build_test_retriever(self.backend)
+
+    def write_statement(self, content: str) -> str:
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_bank_statement(self):
+        path = self.write_statement(
+            "Date;Libellé;Débit;Crédit\n"
+            "01/03/2022;VIR SEPA MAIRIE FACTURE 2022-02-0001 2022-02-0004;;25,05\n"
+            "02/03/2022;VIR SEPA BUREAU DES ARTS;;6,00\n"
+            "03/03/2022;CB PAPETERIE;12,00;\n"
+            "04/03/2022;VIR INCONNU;;15,00\n"
+            "05/03/2022;VIR SEPA BUREAU DES ARTS;;6,00\n")
+        transactions = reconcile.read_statement(path, reconcile.STATEMENT_FORMATS["banque"])
+        matches, unmatched = reconcile.reconcile(self.retriever.orders, transactions, self.retriever.asso_details)
+
+        self.assertEqual([(m.lines, m.rule) for m in matches], [([7, 10], "référence"), ([5], "montant & nom")])
+        # the debit is skipped, the unknown payer and the second payment of the same receipt are not matched
+        self.assertEqual([t.line for t in unmatched], [5, 6])
+
+        self.retriever.write_columns(reconcile.get_payments_values(matches, "Virement"))
+        self.assertEqual(self.backend.calls["batchUpdate"], 1)
+        self.assertEqual([self.backend.cells[line - 1][13] for line in (5, 7, 10)], ["Virement"] * 3)
+        self.assertEqual(self.backend.cells[6][14], "01/03/2022")
+        self.assertEqual(self.backend.cells[5][13], "")
+
+    def test_lydia_export_and_date_window(self):
+        path = self.write_statement(
+            "Date,Nom,Montant,Message\n"
+            "20/02/2022,Jean Dupont,\"15,00\",stickers\n")
+        transactions = list(reconcile.read_statement(path, reconcile.STATEMENT_FORMATS["lydia"]))
+        self.assertEqual(transactions[0].date, dt.date(2022, 2, 20))
+
+        matches, _ = reconcile.reconcile(self.retriever.orders, transactions)
+        self.assertEqual(matches[0].lines, [6])
+        # a payment a year later is not matched
+        matches, unmatched = reconcile.reconcile(self.retriever.orders, [transactions[0]._replace(date=dt.date(2023, 2, 20))])
+        self.assertEqual((matches, len(unmatched)), ([], 1))
+
+    def test_unreadable_rows_are_reported(self):
+        path = self.write_statement(
+            "Date,Nom,Montant,Message\n"
+            "20/02/2022,Jean Dupont,\"+15,00\",stickers\n"
+            "21/02/2022,Mairie,\"1.234,50\",affiches\n"
+            "22/02/2022,Papeterie,\"-12,00\",papier\n"
+            "23/02/2022,Paul Durand,\"12,0,0\",affiche\n"
+            "2022-02-24,Lucie Bernard,\"3,00\",affiche\n")
+        unreadable = []
+        transactions = list(reconcile.read_statement(path, reconcile.STATEMENT_FORMATS["lydia"], unreadable))
+
+        # the debit is the only row skipped
+        self.assertEqual([(t.line, t.amount_cents) for t in transactions], [(2, 1500), (3, 123450)])
+        self.assertEqual(unreadable, [reconcile.UnreadableRow(5, "Montant", "12,0,0"),
+                                      reconcile.UnreadableRow(6, "Date", "2022-02-24")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import io
+import multiprocessing
+import unittest
+from unittest import mock
+
+import docx
+from PIL import Image
+
+import assets
+
+try:
+    import receipt_creation as rc
+    from render_service import RenderJob, RenderService
+except Exception:  # Windows-only dependencies (Word, fr_FR locale)
+    rc = None
+
+
+def get_test_logo() -> io.BytesIO:
+    buffer = io.BytesIO()
+    Image.new("RGB", (60, 30), (200, 30, 30)).save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def patch_receipt_values() -> None:
+    """Replaces the logo & the association details (the ones of the .env may be missing)"""
+    assets.get_logo = get_test_logo
+    rc.VR_OFFICIAL_NAME = "Association"
+    rc.VR_INFO = "1, rue de la République"
+
+
+def get_text(docx_data: bytes) -> str:
+    document = docx.Document(io.BytesIO(docx_data))
+    return "\n".join(p.text for p in document.paragraphs)
+
+
+@unittest.skipIf(rc is None, "receipt_creation cannot be imported on this platform")
+class TestRenderService(unittest.TestCase):
+    def setUp(self):
+        # (the workers are patched by their initializer: spawned workers, as on Windows, do not inherit the patch)
+        for patcher in [mock.patch.object(assets, "get_logo", get_test_logo),
+                        mock.patch.object(rc, "VR_OFFICIAL_NAME", "Association"),
+                        mock.patch.object(rc, "VR_INFO", "1, rue de la République")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        rc.get_receipt_template.cache_clear()
+        self.jobs = [RenderJob(f"Client {i}", [{"quantity": i, "designation": "A3", "unit price": "1,00€",
+                                                "line total price": f"{i},00€"}],
+                               f"2022-03-{i:04d}", f"{i},00 € TTC") for i in range(1, 13)]
+
+    def build_renderer(self, max_workers: int) -> "RenderService":
+        return RenderService(max_workers, initializer=patch_receipt_values, mp_context=multiprocessing.get_context("spawn"))
+
+    def test_results_are_in_the_order_of_the_jobs(self):
+        with self.build_renderer(max_workers=3) as renderer:
+            rendered = [future.result() for future in renderer.submit_all(self.jobs)]
+
+        self.assertEqual(len(rendered), len(self.jobs))
+        for job, docx_data in zip(self.jobs, rendered):
+            self.assertIn(job.receipt_nb, get_text(docx_data))
+            self.assertIn(job.recipient_info, get_text(docx_data))
+
+    def test_same_receipt_as_the_main_process(self):
+        job = self.jobs[0]
+        with self.build_renderer(max_workers=1) as renderer:
+            rendered = renderer.submit(job).result()
+        inline = rc.render_receipt_docx(job.recipient_info, job.orders, job.receipt_nb, job.total_price)
+        self.assertEqual(get_text(rendered), get_text(inline))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,21 @@
+import os
+import tempfile
 import unittest
 from retrieve import Retriever
+from archive import Archive
+from sheets_backend import InMemorySheetsBackend
 import pandas as pd
 
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+ORDERS_FIXTURE = os.path.join(TEST_DIR, "fixtures", "orders.csv")
+ASSO_DETAILS_FIXTURE = os.path.join(TEST_DIR, "..", "example.associations_addresses.json")
+
+
+def build_test_retriever(backend=None):
+    """Returns a retriever reading the fixture sheet from memory (no network)"""
+    backend = backend if backend is not None else InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+    return Retriever(archive=Archive(tempfile.mkdtemp()), backend=backend, asso_details_path=ASSO_DETAILS_FIXTURE)
+
 
 class TestRetrieverMethods(unittest.TestCase):
     @classmethod
@@ -9,7 +23,7 @@ class TestRetrieverMethods(unittest.TestCase):
         """
         This method is called once before running all the test methods in this class.
         """
-        cls.retriever = Retriever()
+        cls.retriever = build_test_retriever()
     
     def test_get_unprocessed_orders(self):
 
@@ -44,6 +58,72 @@ class TestRetrieverMethods(unittest.TestCase):
         self.assertTrue(retrieved_asso_orders.equals(asso_orders))
         self.assertTrue(retrieved_indiv_orders.equals(indiv_orders))
         self.assertTrue(retrieved_extern_orders.equals(extern_orders))
+
+    def test_fetch_orders_data(self):
+        orders = self.retriever.orders
+
+        # lines are indexed by their number in the sheet
+        self.assertEqual(orders.index.tolist(), list(range(3, 11)))
+        self.assertEqual(self.retriever.get_unprocessed_orders().index.tolist(), [5, 6, 8, 9, 10])
+
+    def test_filter_unknown_assos(self):
+        asso_orders = self.retriever.filter_by_client_type(self.retriever.get_unprocessed_orders(), 'Asso')
+        known_asso_orders = self.retriever.filter_unknown_assos(asso_orders)
+
+        # 'BDA ' is matched with 'bda' once normalized
+        self.assertEqual(known_asso_orders['Bénéficiaire'].tolist(), ['BDA ', 'bds'])
+        self.assertEqual(self.retriever.get_asso_details('BDA ')['official name'], 'Bureau des Arts')
+
+    def test_write_receipt_number(self):
+        backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        retriever = build_test_retriever(backend)
+        retriever.write_receipt_number("2022-02-0002", 6)
+
+        self.assertEqual(backend.cells[5][12], "2022-02-0002")
+        self.assertEqual(backend.calls["update"], 1)
+
+    def test_write_receipt_numbers(self):
+        backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        retriever = build_test_retriever(backend)
+        retriever.write_receipt_numbers({5: "2022-01-0002", 6: "2022-02-0001"})
+
+        self.assertEqual(backend.cells[4][12], "2022-01-0002")
+        self.assertEqual(backend.cells[5][12], "2022-02-0001")
+        # a single request for all the lines
+        self.assertEqual(backend.calls["batchUpdate"], 1)
+        self.assertEqual(backend.calls["update"], 0)
+
+    def test_group_by_recipient(self):
+        retriever = build_test_retriever()
+        orders = pd.DataFrame({'Inté / Exté': ['Asso', 'Asso', 'Inté', 'Asso', 'Inté', 'Exté'],
+                               'Bénéficiaire': ['bde', 'BDE ', 'Élise  Morel', 'B.D.E', 'elise morel', 'bde']},
+                              index=[3, 4, 5, 6, 7, 8])
+        # 'B.D.E' is merged with 'bde' (auto merge)
+        retriever.merged_names['B.D.E'] = 'bde'
+
+        groups = retriever.group_by_recipient(orders)
+        self.assertEqual([(name, recip_orders.index.tolist()) for name, recip_orders in groups],
+                         [('bde', [3, 4, 6]), ('Élise  Morel', [5, 7]), ('bde', [8])])
+        self.assertEqual(retriever.filter_by_recipient_name(orders, 'Bde').index.tolist(), [3, 4, 6, 8])
+        self.assertEqual(retriever.filter_by_recipient_name(orders, 'Elise Morel').index.tolist(), [5, 7])
+
+    def test_fetch_lines_status(self):
+        backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        retriever = build_test_retriever(backend)
+        backend.set_range("M6:N6", [["2022-02-0002", "Virement"]])
+        lines = retriever.fetch_lines_status([5, 6])
+
+        self.assertEqual(lines["№ facture"].tolist(), ["", "2022-02-0002"])
+        self.assertEqual(retriever.orders.loc[6, "Encaissement"], "Virement")
+        self.assertEqual(backend.calls["batchGet"], 1)
+
+    def test_get_orders_by_month(self):
+        orders = pd.DataFrame({'Date': ['05/01/2022', '12/03/2022', '', '28/01/2022']}, index=[3, 4, 5, 6])
+        by_month = self.retriever.get_orders_by_month(orders)
+
+        self.assertEqual(list(by_month), ['2022-01', '2022-03', None])
+        self.assertEqual(by_month['2022-01'].index.tolist(), [3, 6])
+        self.assertEqual(by_month[None].index.tolist(), [5])
     
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
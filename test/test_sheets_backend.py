@@ -0,0 +1,65 @@
+import os
+import unittest
+
+from googleapiclient.errors import HttpError
+
+import spreadsheet_utils as su
+from sheets_backend import InMemorySheetsBackend, parse_a1_range
+
+ORDERS_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "orders.csv")
+
+
+class TestInMemorySheetsBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        self.sheet = su.get_spreadsheet(None, backend=self.backend)
+
+    def test_parse_a1_range(self):
+        self.assertEqual(parse_a1_range("A:S"), (0, 0, None, 18))
+        self.assertEqual(parse_a1_range("C5"), (4, 2, 4, 2))
+        self.assertEqual(parse_a1_range("'Feuille 1'!A3:S"), (2, 0, None, 18))
+        self.assertEqual(parse_a1_range("AA1:AB2"), (0, 26, 1, 27))
+
+    def test_get_trims_empty_cells(self):
+        values = self.sheet.values().get(spreadsheetId="test", range="A4:D4").execute()["values"]
+        self.assertEqual(values, [["12/01/2022", "Commande"]])
+        self.assertNotIn("values", self.sheet.values().get(spreadsheetId="test", range="A100:S").execute())
+
+    def test_spreadsheet_utils_functions(self):
+        col_indexes = su.get_all_col_indexes(self.sheet)
+        data = su.fetch_all_data(self.sheet, col_indexes)
+        self.assertEqual(len(data), 8)
+        self.assertEqual(su.find_lines("bde", self.sheet, col_indexes["Bénéficiaire"]), [3])
+        self.assertTrue(su.has_receipt(3, self.sheet, col_indexes))
+
+        orders_list, total_price, recipient_name = su.get_order_data(10, self.sheet, col_indexes)
+        self.assertEqual(orders_list[0]["line total price"], "1,05€ TTC")
+
+        su.write_receipt_number("2022-02-0002", 10, self.sheet, col_indexes)
+        self.assertTrue(su.has_receipt(10, self.sheet, col_indexes))
+
+    def test_batch_requests(self):
+        self.sheet.values().batchUpdate(spreadsheetId="test", body={"valueInputOption": "RAW", "data": [
+            {"range": "N5", "values": [["Virement"]]}, {"range": "N6", "values": [["Chèque"]]}]}).execute()
+        value_ranges = self.sheet.values().batchGet(spreadsheetId="test", ranges=["N5", "N6"]).execute()["valueRanges"]
+        self.assertEqual([v["values"] for v in value_ranges], [[["Virement"]], [["Chèque"]]])
+        self.assertEqual(self.backend.calls["batchUpdate"], 1)
+        self.assertEqual(self.backend.calls["batchGet"], 1)
+
+    def test_quota_errors(self):
+        self.backend.fail_next_requests(1)
+        with self.assertRaises(HttpError) as error:
+            self.sheet.values().get(spreadsheetId="test", range="A:S").execute()
+        self.assertEqual(error.exception.resp.status, 429)
+        # the next request succeeds
+        self.sheet.values().get(spreadsheetId="test", range="A:S").execute()
+
+        limited_backend = InMemorySheetsBackend(self.backend.cells, max_requests_per_minute=2)
+        for _ in range(2):
+            limited_backend.values().get(range="A1").execute()
+        with self.assertRaises(HttpError):
+            limited_backend.values().get(range="A1").execute()
+
+
+if __name__ == '__main__':
+    unittest.main()
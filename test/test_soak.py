@@ -0,0 +1,22 @@
+import unittest
+
+from test.soak import check_slos, run_soak
+
+
+class TestSoak(unittest.TestCase):
+    def test_small_run(self):
+        measures = run_soak(nb_orders=60, nb_recipients=30)
+
+        # one line out of ten is already paid
+        self.assertEqual(measures["receipts"], 54)
+        self.assertEqual(measures["api calls"]["get"], 1)
+        self.assertEqual(check_slos(measures, min_receipts_per_second=1, max_api_calls=100), [])
+
+    def test_slos(self):
+        measures = {"receipts per second": 5, "peak rss (MB)": 300, "leaked open files": 2,
+                    "leaked word applications": 1, "leaked smtp connections": 0, "api calls": {"get": 1, "update": 50}}
+        self.assertEqual(len(check_slos(measures, min_receipts_per_second=10, max_rss_mb=200, max_api_calls=10)), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
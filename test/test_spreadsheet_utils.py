@@ -0,0 +1,53 @@
+import json
+import unittest
+
+import spreadsheet_utils as su
+
+COLUMNS = ["Date", "Type", "Inté / Exté", "Bénéficiaire", "Contact eventuel", "Description",
+           "A1", "A2", "A3", "Sticker", "T-shirt", "Prix total", "№ facture", "Encaissement", "Commentaire"]
+
+VALUES = [["Comptabilité CS Design"],
+          COLUMNS,
+          ["01/03/2022", "Prestation", "Asso", "bde", "", "Affiches \"gala\"", "2", "", "", "", "", "8,00 €"],
+          ["02/03/2022", "Prestation", "Inté", "Élise", "elise@gmail.com", "Stickers", "", "", "", "100", "", "15,00 €",
+           "2022-03-0001", "Virement", "ok"],
+          [],
+          ["04/03/2022", "Prestation", "Asso", "bds"]]
+
+
+def split_in_chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestStreamingParse(unittest.TestCase):
+
+    def test_iter_values_rows(self):
+        body = json.dumps({"range": "'Compta'!A1:S6", "majorDimension": "ROWS", "values": VALUES},
+                          ensure_ascii=False, indent=1).encode("utf-8")
+        # chunks of any size (even splitting the utf-8 characters) give the same rows
+        for size in (1, 3, 7, 64, len(body)):
+            self.assertEqual(list(su.iter_values_rows(split_in_chunks(body, size))), VALUES)
+
+    def test_iter_values_rows_is_lazy(self):
+        body = json.dumps({"values": VALUES}).encode("utf-8")
+        chunks = iter(split_in_chunks(body, 16))
+        rows = su.iter_values_rows(chunks)
+        self.assertEqual(next(rows), VALUES[0])
+        # the rest of the response has not been read
+        self.assertTrue(len(list(chunks)) > 0)
+
+    def test_iter_order_lines(self):
+        column_idx = {col_name: i for i, col_name in enumerate(COLUMNS)}
+        lines = list(su.iter_order_lines(iter(VALUES), column_idx))
+
+        # stops at the first empty line
+        self.assertEqual([line["line"] for line in lines], [3, 4])
+        self.assertEqual(lines[0]["Bénéficiaire"], "bde")
+        self.assertEqual(lines[0]["№ facture"], "")
+        self.assertEqual(lines[1]["Encaissement"], "Virement")
+        self.assertIsNone(lines[1].get("Commentaire"))
+        self.assertEqual(lines[1].to_dict()["Contact eventuel"], "elise@gmail.com")
+
+
+if __name__ == '__main__':
+    unittest.main()
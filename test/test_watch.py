@@ -0,0 +1,127 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from unittest import mock
+
+import preflight
+import process_all_orders as pao
+from sheets_backend import InMemorySheetsBackend
+from test.test_retrieve import ORDERS_FIXTURE, build_test_retriever
+
+try:
+    from watch import Watcher
+except Exception:  # Windows-only dependencies (Word, fr_FR locale)
+    Watcher = None
+
+
+@unittest.skipIf(Watcher is None, "receipt_creation cannot be imported on this platform")
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.backend = InMemorySheetsBackend.from_csv(ORDERS_FIXTURE)
+        with mock.patch("watch.ReceiptCatalog", lambda: mock.MagicMock()):
+            self.watcher = Watcher(build_test_retriever(self.backend))
+        self.addCleanup(self.watcher.close)
+        # the orders processed by the fake process_recipient_orders (without writing their receipt number), by recipient
+        self.processed = {}
+        self.fail_writes = False
+
+    def fake_process_recipient_orders(self, retriever, recip_name, recip_orders, *args, writer=None, **kwargs):
+        self.processed[recip_name] = recip_orders.index.tolist()
+        if self.fail_writes:
+            # a directory can not be replaced by a file: the receipt file can not be written
+            writer.write(self.tmp_dir.name, b"")
+
+    def poll(self) -> int:
+        self.processed = {}
+        # (the configuration & receipts directory of the tests are not checked)
+        with mock.patch.object(pao, "process_recipient_orders", self.fake_process_recipient_orders), \
+                mock.patch.object(preflight, "check_environment", return_value=[]), \
+                mock.patch.object(preflight, "check_receipts_dir", return_value=[]), \
+                mock.patch.object(self.watcher, "get_smtp"), mock.patch.object(self.watcher, "get_word"), \
+                contextlib.redirect_stdout(io.StringIO()) as output:
+            nb_handled = self.watcher.poll()
+        self.output = output.getvalue()
+        return nb_handled
+
+    def test_write_errors_are_reported_at_each_poll(self):
+        self.fail_writes = True
+        self.assertEqual(self.poll(), 3)
+        self.assertEqual(self.processed, {"BDA ": [5], "Jean Dupont": [6], "bds": [10]})
+        self.assertIn("Erreur lors de l'écriture", self.output)
+        # nothing is kept until the end of the run
+        self.assertEqual(self.watcher.writer.futures, [])
+
+    def test_poll_only_when_changed(self):
+        self.assertEqual(self.poll(), 3)
+        self.assertEqual(self.poll(), 0)
+
+        # new order at the end of the sheet
+        self.backend.cells.append(["20/02/2022", "Prestation", "Inté", "Paul Durand", "paul.durand@gmail.com", "Affiche",
+                                   "", "", "2", "", "", "2,00 €", "", "", "", "", "Impression", ""])
+        self.assertEqual(self.poll(), 1)
+        self.assertEqual(self.processed, {"Paul Durand": [len(self.backend.cells)]})
+
+    def test_changes_in_the_middle_of_the_sheet(self):
+        self.poll()
+        # the email of Alice Martin is fixed, but the signature of the sheet does not cover her line
+        self.backend.set_range("E9", [["alice.martin@gmail.com"]])
+        with mock.patch.object(self.watcher, "has_changed", return_value=False):
+            self.assertEqual(self.poll(), 0)
+            # until the whole sheet is downloaded again
+            self.watcher.max_age = 0
+            self.assertEqual(self.poll(), 1)
+        self.assertEqual(self.processed, {"Alice Martin": [9]})
+
+    def test_inserted_lines(self):
+        self.poll()
+        # a line inserted above the orders already handled (and not invoiced): only the new one is processed
+        self.backend.cells.insert(4, ["03/02/2022", "Prestation", "Exté", "Mairie", "contact@mairie.fr", "Affiche",
+                                      "", "", "1", "", "", "1,00 €", "", "", "", "", "Impression", ""])
+        self.assertEqual(self.poll(), 1)
+        self.assertEqual(self.processed, {"Mairie": [5]})
+
+    def test_duplicates_are_held_back(self):
+        self.poll()
+        # two club members enter the same order
+        for _ in range(2):
+            self.backend.cells.append(["20/02/2022", "Prestation", "Inté", "Paul Durand", "paul.durand@gmail.com", "Affiche",
+                                       "", "", "2", "", "", "2,00 €", "", "", "", "", "Impression", ""])
+        nb_lines = len(self.backend.cells)
+
+        self.assertEqual(self.poll(), 1)
+        self.assertEqual(self.processed, {"Paul Durand": [nb_lines - 1]})
+        self.assertIn(f"ligne {nb_lines} (Paul Durand", self.output)
+        # still reported at the next refresh (the first one is invoiced now)
+        self.backend.set_range(f"M{nb_lines - 1}", [["2022-02-0002"]])
+        self.assertEqual(self.poll(), 0)
+        self.assertIn("identique à la facture 2022-02-0002", self.output)
+
+    def test_orders_with_issues_are_held_back(self):
+        self.poll()
+        # a fractional quantity, and a wrong total
+        self.backend.cells.append(["20/02/2022", "Prestation", "Inté", "Paul Durand", "paul.durand@gmail.com", "Affiche",
+                                   "", "", "1.5", "", "", "1,50 €", "", "", "", "", "Impression", ""])
+        self.backend.cells.append(["21/02/2022", "Prestation", "Inté", "Lucie Bernard", "lucie.bernard@gmail.com", "Affiche",
+                                   "", "", "2", "", "", "3,00 €", "", "", "", "", "Impression", ""])
+        self.backend.cells.append(["22/02/2022", "Prestation", "Exté", "Mairie", "contact@mairie.fr", "Affiche",
+                                   "", "", "1", "", "", "1,00 €", "", "", "", "", "Impression", ""])
+        nb_lines = len(self.backend.cells)
+
+        self.assertEqual(self.poll(), 1)
+        self.assertEqual(self.processed, {"Mairie": [nb_lines]})
+        self.assertIn(f"ligne {nb_lines - 2} :", self.output)
+        self.assertIn(f"ligne {nb_lines - 1} :", self.output)
+
+        # the problems of the configuration hold back all the orders
+        self.backend.cells.append(["23/02/2022", "Prestation", "Exté", "Mairie", "contact@mairie.fr", "Affiche",
+                                   "", "", "2", "", "", "2,00 €", "", "", "", "", "Impression", ""])
+        with mock.patch.object(preflight, "run_preflight", return_value=["la variable VR_IBAN n'est pas définie (.env)."]):
+            self.assertEqual(self.poll(), 0)
+        self.assertEqual(self.processed, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 """ General utility functions (data transformation & email sending) """
 
-from typing import Dict, List
+from typing import Dict, List, Tuple, Union
 from dotenv import load_dotenv
 import os
 import smtplib
@@ -20,6 +20,9 @@ CSDESIGN_TRESURER = os.getenv('CSD_TRESURER_NAME')
 CSD_TRESURER_PHONE = os.getenv('CSD_TRESURER_PHONE')
 
 # data processing
+# a receipt attached to an email: the path of its pdf, or its file name & content (rendered in memory)
+ReceiptAttachment = Union[str, Tuple[str, bytes]]
+
 
 def filter_processed_orders(data: Dict[str, str]) -> List[Dict[str, str]]:
     """Returns order lines that have no receipt and that have not been paid"""
@@ -91,8 +94,15 @@ def get_asso_lines(data_dicts, asso_name):
     return asso_lines
 
 
-def send_receipts_by_mail(recipient_name, recipient_email: str, recipient_type:Literal["Asso", "Inté", "Exté"], receipts_paths: List[str], orders_data: List[Dict[str, str]], recipient_first_name = None):
-    """Sends the receipts by email to an association"""
+def open_smtp_connection() -> smtplib.SMTP_SSL:
+    """Returns a logged in SMTP connection, that can be reused to send several emails"""
+    smtp = smtplib.SMTP_SSL('smtp.gmail.com', 465)
+    smtp.login(SENDER_EMAIL, APP_PASSWORD)
+    return smtp
+
+
+def build_receipts_mail(recipient_name, recipient_email: str, recipient_type:Literal["Asso", "Inté", "Exté"], receipts_paths: List[ReceiptAttachment], orders_data: List[Dict[str, str]], recipient_first_name = None) -> EmailMessage:
+    """Composes the email (text and attached receipts) sent to a recipient"""
 
     subject = "Facture(s) CS Design"
 
@@ -122,12 +132,35 @@ def send_receipts_by_mail(recipient_name, recipient_email: str, recipient_type:L
 
     # add pdf receipts as attachments
     for receipt in receipts_paths:
-        with open(receipt, 'rb') as f:
-            file_data = f.read()
+        if isinstance(receipt, tuple):
+            file_name, file_data = receipt
+        else:
+            with open(receipt, 'rb') as f:
+                file_data = f.read()
+            file_name = receipt.split("\\")[-1]
         msg.add_attachment(file_data, maintype="application",
-                           subtype="pdf", filename=receipt.split("\\")[-1])
+                           subtype="pdf", filename=file_name)
+    return msg
+
+
+def send_receipts_by_mail(recipient_name, recipient_email: str, recipient_type:Literal["Asso", "Inté", "Exté"], receipts_paths: List[ReceiptAttachment], orders_data: List[Dict[str, str]], recipient_first_name = None, smtp = None, outbox = None, receipts_numbers: List[str] = ()):
+    """Sends the receipts by email to an association
+
+        If an already opened SMTP connection is given, it is used (and left open),
+        otherwise a new one is opened for this email only.
+        If an outbox is given, the email is only written to it (it will be sent by outbox.py,
+        which marks the given receipts numbers as sent in the catalog).
+    """
+    msg = build_receipts_mail(recipient_name, recipient_email, recipient_type, receipts_paths, orders_data, recipient_first_name)
+
+    if outbox is not None:
+        outbox.add(msg, receipts_numbers)
+        return
+
+    if smtp is not None:
+        smtp.send_message(msg)
+        return
 
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-        smtp.login(SENDER_EMAIL, APP_PASSWORD)
+    with open_smtp_connection() as smtp:
         smtp.send_message(msg)
 
@@ -0,0 +1,231 @@
+""" Long-running mode: watches the spreadsheet and processes the new orders as soon as they can be.
+
+    The sheet is polled cheaply (number of lines + hash of its last lines), and only downloaded
+    entirely when it changed, or every FULL_REFRESH_INTERVAL (the changes in the middle of the sheet,
+    ex: a fixed email address, are not covered by the signature). The retriever, SMTP connection
+    and Word application are kept between polls, and the polling interval grows while nothing changes.
+"""
+
+import argparse
+import os
+import smtplib
+import time
+from typing import List
+
+import pandas as pd
+
+import preflight
+import process_all_orders as pao
+import receipt_creation as rc
+import utils as ut
+from catalog import ReceiptCatalog
+from duplicates import find_duplicates, get_recent_invoiced_orders
+from receipt_writer import ReceiptWriter
+from retrieve import Retriever
+
+# polling intervals (in seconds)
+MIN_POLL_INTERVAL = 60
+MAX_POLL_INTERVAL = 15 * 60
+# the whole sheet is downloaded again after this time (in seconds), even if its last lines did not change
+FULL_REFRESH_INTERVAL = int(os.getenv('FULL_REFRESH_INTERVAL', 10 * 60))
+# columns written when an order is processed or paid (not part of the orders fingerprints)
+PROCESSING_COLUMNS = ["№ facture", "Encaissement", "Date encaissement", "Montant"]
+
+
+def get_row_fingerprints(orders: pd.DataFrame) -> pd.Series:
+    """Returns a fingerprint of the content of each order (the same wherever the line is in the sheet).
+
+        Identical orders (ex: entered twice) are told apart by their rank among them: the fingerprints
+        must be computed on all the orders of the sheet, not only on the processable ones.
+    """
+    content = orders.drop(columns=PROCESSING_COLUMNS, errors="ignore")
+    content = content.loc[:, ~content.columns.duplicated()].fillna("").astype(str)
+    hashes = pd.util.hash_pandas_object(content, index=False)
+    return hashes.astype(str) + ":" + hashes.groupby(hashes).cumcount().astype(str)
+
+
+class Watcher():
+    def __init__(self, retriever: Retriever = None, max_age: float = FULL_REFRESH_INTERVAL) -> None:
+        """
+            Args:
+                retriever (Retriever) : the retriever to use (connects to the spreadsheet by default)
+                max_age (float) : age (in seconds) after which the sheet is downloaded again, even if it did not change
+        """
+        self.retriever = retriever if retriever is not None else Retriever()
+        self.signature = None
+        self.max_age = max_age
+        self.fetched_at = time.monotonic()
+        # fingerprints of the orders already handled (processed or failed) during this run
+        # (not their lines: lines can be inserted above them)
+        self.handled_orders = set()
+        self.smtp = None
+        self.word = None
+        self.catalog = ReceiptCatalog()
+        self.writer = ReceiptWriter()
+
+    def get_smtp(self):
+        """Returns the SMTP connection, (re)opening it if needed (gmail closes idle connections)"""
+        if self.smtp is not None:
+            try:
+                self.smtp.noop()
+            except smtplib.SMTPException:
+                self.smtp = None
+        if self.smtp is None:
+            self.smtp = ut.open_smtp_connection()
+        return self.smtp
+
+    def get_word(self):
+        """Returns the Word application, launching it the first time"""
+        if self.word is None:
+            self.word = rc.start_word()
+        return self.word
+
+    def has_changed(self) -> bool:
+        """Returns True if the sheet changed since the last poll"""
+        signature = self.retriever.fetch_sheet_signature()
+        changed = signature != self.signature
+        self.signature = signature
+        return changed
+
+    def refresh(self) -> bool:
+        """Downloads the orders (and the assos details) again if the sheet changed, or if they are too old.
+
+            Returns True if they were downloaded.
+        """
+        if self.retriever.source is not None:
+            return False
+        too_old = time.monotonic() - self.fetched_at > self.max_age
+        if not self.has_changed() and not too_old:
+            return False
+        self.retriever.fetch_orders_data(self.retriever.creds)
+        self.retriever.fetch_asso_details()
+        self.fetched_at = time.monotonic()
+        return True
+
+    def get_new_orders(self, fingerprints: pd.Series) -> pd.DataFrame:
+        """Returns the orders that can be processed and that were not handled yet (given the fingerprints of all the orders)"""
+        can_be_processed = pd.concat(pao.get_processable_orders(self.retriever))
+        return can_be_processed[~fingerprints[can_be_processed.index].isin(self.handled_orders)]
+
+    def poll(self) -> int:
+        """Checks the sheet once and processes the newly processable orders.
+
+            Returns the number of orders that were handled.
+        """
+        if not self.refresh():
+            return 0
+
+        fingerprints = get_row_fingerprints(self.retriever.orders)
+        new_orders = self.get_new_orders(fingerprints)
+        if new_orders.empty:
+            return 0
+        new_orders = self.drop_duplicates(self.check_orders(new_orders))
+        if new_orders.empty:
+            return 0
+
+        print(f"{len(new_orders)} nouvelle(s) prestation(s) à traiter.")
+        sheet_receipt_names = self.retriever.get_receipt_numbers()
+        # (the variants of the name of an asso, or names differing only by their case, are the same recipient)
+        for recip_name, recip_orders in self.retriever.group_by_recipient(new_orders):
+            # never retry automatically an order during this run, even if it failed
+            self.handled_orders.update(fingerprints[recip_orders.index])
+            try:
+                pao.process_recipient_orders(self.retriever, recip_name, recip_orders,
+                                             sheet_receipt_names, self.get_smtp(), self.get_word(),
+                                             catalog=self.catalog, writer=self.writer)
+            except Exception as e:
+                print(f"Erreur pour {recip_name} : {e}")
+        self.flush_writer()
+
+        return len(new_orders)
+
+    def check_orders(self, orders: pd.DataFrame) -> pd.DataFrame:
+        """Runs the preflight on the new orders, returns the ones that can be processed.
+
+            Nobody checks the orders before they are processed: the ones with an issue are held back
+            (all of them if the issue is not one of an order), and reported again at the next refresh.
+        """
+        issues = preflight.run_preflight(self.retriever, orders)
+        if not issues:
+            return orders
+        print(f"{len(issues)} problème(s), les commandes concernées ne sont pas traitées :")
+        for issue in issues:
+            print(f" - {issue}")
+        batch_issues, lines = preflight.split_issues(issues)
+        if batch_issues:
+            return orders.iloc[:0]
+        return orders.drop(index=list(lines))
+
+    def drop_duplicates(self, orders: pd.DataFrame) -> pd.DataFrame:
+        """Returns the orders without their likely duplicates (same order in the batch, or already invoiced).
+
+            The duplicates are reported at each refresh (they are not marked as handled), they can be
+            invoiced anyway with invoice.py --include-duplicates.
+        """
+        if orders.empty:
+            return orders
+        duplicates = find_duplicates(orders, get_recent_invoiced_orders(self.retriever))
+        if duplicates.empty:
+            return orders
+        print(f"{len(duplicates)} doublon(s) probable(s), non traité(s) :")
+        for line, duplicate in duplicates.iterrows():
+            print(f" - ligne {line} ({duplicate['Bénéficiaire']}, {duplicate['Date']}, {duplicate['Prix total']}) "
+                  f"identique à la {duplicate['duplicate of']}")
+        return orders.drop(index=duplicates.index)
+
+    def flush_writer(self) -> List[str]:
+        """Waits for the receipts files of the poll, returns (and prints) the errors that happened while writing them"""
+        try:
+            self.writer.flush()
+        except Exception as e:
+            print(f"Erreur lors de l'écriture des fichiers des factures : {e}")
+            return [str(e)]
+        return []
+
+    def run(self, min_interval: float = MIN_POLL_INTERVAL, max_interval: float = MAX_POLL_INTERVAL) -> None:
+        """Polls the sheet forever, backing off (up to max_interval) while nothing happens"""
+        interval = min_interval
+        while True:
+            try:
+                nb_handled = self.poll()
+            except Exception as e:
+                print(f"Erreur lors de la lecture du tableur : {e}")
+                nb_handled = 0
+
+            if nb_handled:
+                interval = min_interval
+            time.sleep(interval)
+            if not nb_handled:
+                interval = min(2 * interval, max_interval)
+
+    def close(self) -> None:
+        """Waits for the receipts files, and releases the SMTP connection, the Word application and the catalog"""
+        self.writer.close()
+        self.catalog.close()
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self.smtp = None
+        if self.word is not None:
+            self.word.Quit()
+            self.word = None
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--min-interval", help="Minimum time between two polls (in seconds).",
+                        type=float, default=MIN_POLL_INTERVAL)
+    parser.add_argument("--max-interval", help="Maximum time between two polls when nothing happens (in seconds).",
+                        type=float, default=MAX_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    watcher = Watcher()
+    try:
+        watcher.run(args.min_interval, args.max_interval)
+    except KeyboardInterrupt:
+        print("Ok!")
+    finally:
+        watcher.close()